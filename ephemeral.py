@@ -1,10 +1,5 @@
-import pystray
-from pystray import MenuItem as item
-from PIL import Image, ImageDraw
-import pyperclip
 import subprocess
 import threading
-import keyboard
 import sys
 import re
 import os
@@ -13,6 +8,19 @@ import time
 import shlex
 import ctypes
 import shutil
+import json
+import hashlib
+import codecs
+import uuid
+import zipfile
+import queue
+import argparse
+import socket
+import io
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+STARTUP_CLOCK = time.perf_counter() # Startup milestones are measured from here
 
 # --- Configuration ---
 HOTKEY = 'ctrl+alt+x'
@@ -20,15 +28,116 @@ APP_NAME = "Ephemeral"
 LAST_DETECTED_LANG = "python" # Default starting language
 
 # Only this specific keyword enables network access
-NETWORK_FLAGS = {'unsafe'} 
+NETWORK_FLAGS = {'unsafe'}
 
-# Map languages to the 'Clean Slate' Image on Docker Hub
+# Other bare header keywords that switch on per-run behaviour
+RUN_FLAGS = {'live', 'session', 'nocache'}
+
+# Resource limits per run; LANG_MAP entries may set 'limits' and headers override with key=value
+# (e.g. ```rust timeout=300 cpus=4```). timeout/output of 0 disable that limit.
+DEFAULT_LIMITS = {
+    'timeout': 60,     # Wall-clock seconds before the container is killed
+    'memory': '2g',
+    'cpus': '2',
+    'pids': 512,
+    'tmpfs': '512m',   # Size of the in-memory /tmp
+    'output': '50m',   # Total stdout+stderr before the run is killed
+    'artifacts': '2g', # Total size of files written to /output before the run is killed
+}
+
+# Output capture: only the first and last N KB of each stream are kept in memory
+OUTPUT_HEAD_KB = 64
+OUTPUT_TAIL_KB = 64
+LIVE_OUTPUT = False        # Always mirror output to a console window (or use the 'live' header flag)
+LIVE_OUTPUT_MAX_MB = 16    # Stop mirroring to the live log beyond this
+
+# Session kernels ('session' header flag): stopped after this many idle seconds
+SESSION_IDLE_TIMEOUT = 900
+
+# Container runtime: 'podman' (default), 'podman-api' (REST API, CLI fallback), 'docker',
+# or 'local' (no isolation; CI and tests only)
+CONTAINER_BACKEND = os.environ.get('EPHEMERAL_BACKEND', 'podman')
+# Podman service socket for 'podman-api': unix:///path/podman.sock or tcp://host:port.
+# Empty means the default rootless socket on Linux; on Windows, expose the service over tcp.
+PODMAN_API_URL = os.environ.get('EPHEMERAL_PODMAN_API', '')
+# Several Podman connections (names from `podman system connection list`, or unix:// / tcp://
+# API URLs) to spread runs over, e.g. ['podman-machine-default', 'podman-machine-default-root'].
+# Empty: everything runs on the default connection.
+PODMAN_CONNECTIONS = [c.strip() for c in os.environ.get('EPHEMERAL_CONNECTIONS', '').split(',') if c.strip()]
+CONNECTION_SLOTS = 2           # Concurrent runs per connection before it counts as full
+CONNECTION_HEALTH_SECONDS = 30 # How often each connection is health-checked
+
+# Concurrent hotkey presses are queued and served by this many workers
+WORKER_COUNT = 2
+
+# Warm pool: idle, network-less containers kept ready for recently used languages
+POOL_ENABLED = True
+POOL_SIZE = 1          # Idle containers kept per language
+POOL_IDLE_TTL = 300    # Seconds an unused warm container survives
+POOL_MAX_LANGS = 3     # Recently used languages that keep a pool (LRU eviction)
+
+# Artifacts: /output is staged next to Downloads so results are renamed into place, not copied
+DOWNLOADS_DIR = os.path.join(os.path.expanduser("~"), "Downloads")
+ARTIFACT_STAGING_DIR = os.path.join(DOWNLOADS_DIR, ".ephemeral-staging") # Created on first use; None: system temp
+ARTIFACT_POLL_SECONDS = 0.5   # How often /output is checked while the container runs
+ARTIFACT_MIN_FREE_MB = 1024   # Kill the run if the disk gets this close to full
+
+# Host-side state (compile cache, etc.)
+DATA_DIR = os.path.join(os.path.expanduser("~"), ".ephemeral")
+COMPILE_CACHE_DIR = os.path.join(DATA_DIR, "compile_cache")
+COMPILE_CACHE_MAX_MB = 1024 # LRU eviction above this size
+RESULT_CACHE_DIR = os.path.join(DATA_DIR, "result_cache")
+RESULT_CACHE_ENABLED = False # Opt-in (tray toggle); 'nocache' in a header bypasses it
+RESULT_CACHE_MAX_MB = 512
+DATASET_DIR = os.path.join(DATA_DIR, "datasets") # Seed files for the 'data=name[,name]' header
+DEPS_INDEX_FILE = os.path.join(DATA_DIR, "deps_images.json") # Images built for 'deps=pkg[,pkg]' headers
+DEPS_IMAGE_MAX = 8          # Least recently used dependency images beyond this are removed
+DEPS_BUILD_TIMEOUT = 900    # Seconds one dependency install may take
+USAGE_HISTORY_FILE = os.path.join(DATA_DIR, "usage.json")
+
+# Language registry: one <name>.toml or <name>.json per language. User files override system
+# files, which override (or extend) the built-in LANG_MAP below; edits apply without a restart.
+USER_REGISTRY_DIR = os.path.join(DATA_DIR, "languages")
+SYSTEM_REGISTRY_DIR = os.path.join(os.environ.get('PROGRAMDATA', '/etc'), "Ephemeral", "languages")
+REGISTRY_POLL_SECONDS = 2
+
+# Tracing: per-phase timings of every run, appended as JSON lines and shown under "Recent Runs"
+TRACE_ENABLED = True
+TRACE_FILE = os.path.join(DATA_DIR, "trace.jsonl")
+TRACE_MAX_MB = 10         # Rotated to trace.jsonl.1 above this
+TRACE_RECENT_RUNS = 20    # Runs kept for the tray submenu and percentiles
+METRICS_PORT = 0          # e.g. 9464 serves /metrics and /runs on 127.0.0.1; 0 disables
+
+# Podman machine lifecycle: stop the VM when unused, boot it ahead of the hours you usually run snippets
+MACHINE_IDLE_MINUTES = 20         # Stop the machine after this long without a run; 0 keeps it up
+MACHINE_PREBOOT = True            # Boot it again ahead of hours that were busy in recent weeks
+MACHINE_PREBOOT_LEAD_MINUTES = 10 # How early to boot before a usually busy hour
+MACHINE_PREBOOT_MIN_WEEKS = 2     # An hour of the week counts as busy after runs in this many weeks
+MACHINE_HISTORY_WEEKS = 4
+MACHINE_POLL_SECONDS = 30
+MACHINE_STOP_ON_QUIT = True
+MACHINE_ACTIVITY_FILE = os.path.join(DATA_DIR, "activity.json")
+
+# Background prefetch of the most used images while the machine is idle
+PREFETCH_ENABLED = True
+PREFETCH_TOP_N = 5              # Most used images kept local and fresh
+PREFETCH_IDLE_SECONDS = 300     # User input idle time before prefetching starts
+PREFETCH_INTERVAL = 600         # Seconds between prefetch passes
+PREFETCH_REFRESH_HOURS = 24     # Re-pull present images (e.g. ':latest') after this
+PREFETCH_CONCURRENCY = 1        # Parallel background pulls
+PREFETCH_MAX_MB_PER_HOUR = 2048 # Download budget for background pulls
+
+# Map languages to the 'Clean Slate' Image on Docker Hub. 'deps_install' is the command that
+# installs a 'deps=' header's packages into a derived image ('{deps}' alone expands to the
+# package names; inside a string, to a quoted, comma-separated list).
 LANG_MAP = {
     # --- Standard Interpreted ---
-    'python': {'image': 'python:3.10-slim', 'cmd': ['python', '-']},
-    'node':   {'image': 'node:18-alpine',   'cmd': ['node', '-']},
+    'python': {'image': 'python:3.10-slim', 'cmd': ['python', '-'], 'session': 'python',
+               'deps_install': ['pip', 'install', '--no-cache-dir', '{deps}']},
+    # Packages land in /node_modules, which require() finds from any working directory.
+    'node':   {'image': 'node:18-alpine',   'cmd': ['node', '-'], 'deps_install': ['npm', 'install', '--prefix', '/', '{deps}']},
     'bash':   {'image': 'alpine:latest',    'cmd': ['sh']},
-    'ruby':   {'image': 'ruby:alpine',      'cmd': ['ruby']},
+    'ruby':   {'image': 'ruby:alpine',      'cmd': ['ruby'], 'deps_install': ['gem', 'install', '--no-document', '{deps}']},
     
     # --- TiddlyWiki (Build Environment) ---
     'tiddlywiki': {
@@ -40,7 +149,8 @@ LANG_MAP = {
     # --- GitHub Actions / CI Tools ---
     'gh-runner': {
         'image': 'catthehacker/ubuntu:act-22.04', 
-        'cmd': ['bash']
+        'cmd': ['bash'],
+        'limits': {'timeout': 300, 'memory': '4g'}
     },
     'actionlint': {
         'image': 'rhysd/actionlint:latest',
@@ -49,24 +159,42 @@ LANG_MAP = {
     },
 
     # --- Science & Data ---
-    'science': {'image': 'continuumio/anaconda3', 'cmd': ['python', '-']},
-    'octave':  {'image': 'gnuoctave/octave:latest', 'cmd': ['octave', '--no-gui', '--quiet']},
-    'r':       {'image': 'r-base:latest',           'cmd': ['R', '--vanilla', '--slave', '-f', '/dev/stdin']},
-    'julia':   {'image': 'julia:alpine',            'cmd': ['julia']},
+    # 'session' names the SESSION_DRIVERS kernel used by the `session` header flag
+    'science': {'image': 'continuumio/anaconda3', 'cmd': ['python', '-'], 'session': 'python', 'limits': {'timeout': 180, 'memory': '4g'},
+                'deps_install': ['pip', 'install', '--no-cache-dir', '{deps}']},
+    'octave':  {'image': 'gnuoctave/octave:latest', 'cmd': ['octave', '--no-gui', '--quiet'], 'session': 'octave'},
+    'r':       {'image': 'r-base:latest',           'cmd': ['R', '--vanilla', '--slave', '-f', '/dev/stdin'], 'session': 'r',
+                'deps_install': ['Rscript', '-e', 'install.packages(c({deps}), repos="https://cloud.r-project.org")']},
+    'julia':   {'image': 'julia:alpine',            'cmd': ['julia'], 'session': 'julia',
+                'deps_install': ['julia', '-e', 'using Pkg; Pkg.add([{deps}])']},
 
     # --- Systems & Compiled (Compile-and-Run Chains) ---
-    'c':       {'image': 'gcc:latest', 'cmd': ['sh', '-c', 'gcc -x c - -o /tmp/run && /tmp/run']},
-    'cpp':     {'image': 'gcc:latest', 'cmd': ['sh', '-c', 'g++ -x c++ - -o /tmp/run && /tmp/run']},
-    'fortran': {'image': 'gcc:latest', 'cmd': ['sh', '-c', 'gfortran -x f95 - -o /tmp/run && /tmp/run']},
-    'rust':    {'image': 'rust:alpine', 'cmd': ['sh', '-c', 'rustc - -o /tmp/run && /tmp/run']},
-    'go':      {'image': 'golang:alpine', 'cmd': ['sh', '-c', 'cat > /tmp/main.go && go run /tmp/main.go']},
+    # 'compile' splits the chain so the built artifact in /artifact can be cached and re-run.
+    'c':       {'image': 'gcc:latest', 'cmd': ['sh', '-c', 'gcc -x c - -o /tmp/run && /tmp/run'],
+                'compile': {'build': 'gcc -x c - -o /artifact/run', 'run': '/artifact/run'}},
+    'cpp':     {'image': 'gcc:latest', 'cmd': ['sh', '-c', 'g++ -x c++ - -o /tmp/run && /tmp/run'],
+                'compile': {'build': 'g++ -x c++ - -o /artifact/run', 'run': '/artifact/run'}},
+    'fortran': {'image': 'gcc:latest', 'cmd': ['sh', '-c', 'gfortran -x f95 - -o /tmp/run && /tmp/run'],
+                'compile': {'build': 'gfortran -x f95 - -o /artifact/run', 'run': '/artifact/run'}},
+    'rust':    {'image': 'rust:alpine', 'cmd': ['sh', '-c', 'rustc - -o /tmp/run && /tmp/run'],
+                'compile': {'build': 'rustc - -o /artifact/run', 'run': '/artifact/run'}, 'limits': {'timeout': 180}},
+    'go':      {'image': 'golang:alpine', 'cmd': ['sh', '-c', 'cat > /tmp/main.go && go run /tmp/main.go'],
+                'compile': {'build': 'cat > /tmp/main.go && go build -o /artifact/run /tmp/main.go', 'run': '/artifact/run'}},
     
     # --- Expansion Pack (Systems) ---
-    'java':    {'image': 'eclipse-temurin:21-jdk-alpine', 'cmd': ['sh', '-c', 'cat > /tmp/Main.java && java /tmp/Main.java']},
+    'java':    {'image': 'eclipse-temurin:21-jdk-alpine', 'cmd': ['sh', '-c', 'cat > /tmp/Main.java && java /tmp/Main.java'],
+                'compile': {
+                    'build': 'cat > /tmp/Main.java && javac -d /artifact /tmp/Main.java && cd /artifact && '
+                             'for f in *.class; do c="${f%.class}"; '
+                             'javap -cp /artifact "$c" | grep -q "static void main(java.lang.String" && echo "$c" > main && break; done',
+                    'run': 'java -cp /artifact "$(cat /artifact/main)"'
+                }},
 
     # --- Golfing & Modern Compiled ---
-    'crystal': {'image': 'crystallang/crystal:latest', 'cmd': ['sh', '-c', 'cat > /tmp/run.cr && crystal run /tmp/run.cr']},
-    'nim':     {'image': 'nimlang/nim:alpine', 'cmd': ['sh', '-c', 'cat > /tmp/run.nim && nim c -r --verbosity:0 --hints:off /tmp/run.nim']},
+    'crystal': {'image': 'crystallang/crystal:latest', 'cmd': ['sh', '-c', 'cat > /tmp/run.cr && crystal run /tmp/run.cr'],
+                'compile': {'build': 'cat > /tmp/run.cr && crystal build -o /artifact/run /tmp/run.cr', 'run': '/artifact/run'}},
+    'nim':     {'image': 'nimlang/nim:alpine', 'cmd': ['sh', '-c', 'cat > /tmp/run.nim && nim c -r --verbosity:0 --hints:off /tmp/run.nim'],
+                'compile': {'build': 'cat > /tmp/run.nim && nim c --verbosity:0 --hints:off -o:/artifact/run /tmp/run.nim', 'run': '/artifact/run'}},
 
     # --- Lisp & Functional ---
     'lisp':    {'image': 'clfoundation/sbcl:slim', 'cmd': ['sh', '-c', 'cat > /tmp/run.lisp && sbcl --script /tmp/run.lisp']},
@@ -81,7 +209,8 @@ LANG_MAP = {
     'brainfuck': {'image': 'esolang/brainfuck-esotope', 'cmd': ['sh', '-c', 'cat > /tmp/code && script /tmp/code']},
 
     # --- Hardware Description (HDL) ---
-    'verilog': {'image': 'hdlc/iverilog', 'cmd': ['sh', '-c', 'cat > /tmp/run.v && iverilog /tmp/run.v -o /tmp/out && vvp /tmp/out']},
+    'verilog': {'image': 'hdlc/iverilog', 'cmd': ['sh', '-c', 'cat > /tmp/run.v && iverilog /tmp/run.v -o /tmp/out && vvp /tmp/out'],
+                'compile': {'build': 'cat > /tmp/run.v && iverilog /tmp/run.v -o /artifact/run', 'run': 'vvp /artifact/run'}},
 
     # --- Functional & Scripting ---
     'haskell': {'image': 'haskell:slim', 'cmd': ['runghc']},
@@ -90,7 +219,7 @@ LANG_MAP = {
     'php':     {'image': 'php:alpine',      'cmd': ['php']},
 
     # --- Documents & Typesetting ---
-    'latex':   {'image': 'pandoc/extra', 'entrypoint': '/bin/sh', 'cmd': ['-c', 'cat > /output/doc.tex && pdflatex -output-directory /output /output/doc.tex']},
+    'latex':   {'image': 'pandoc/extra', 'entrypoint': '/bin/sh', 'cmd': ['-c', 'cat > /output/doc.tex && pdflatex -output-directory /output /output/doc.tex'], 'limits': {'timeout': 120}},
     'pandoc':  {'image': 'pandoc/extra', 'entrypoint': '/bin/sh', 'cmd': ['-c', 'cat > /tmp/input.md && pandoc /tmp/input.md -o /output/converted.pdf']},
     'pandoc-pdf': {'image': 'pandoc/extra', 'entrypoint': '/bin/sh', 'cmd': ['-c', 'cat > /tmp/input.md && pandoc /tmp/input.md -o /output/converted.pdf']},
     'pandoc-docx': {'image': 'pandoc/extra', 'entrypoint': '/bin/sh', 'cmd': ['-c', 'cat > /tmp/input.md && pandoc /tmp/input.md -o /output/converted.docx']},
@@ -128,7 +257,169 @@ for lang in ESOLANGS:
     if lang not in LANG_MAP:
         LANG_MAP[lang] = {'image': f'esolang/{lang}', 'cmd': ['sh', '-c', 'cat > /tmp/code && script /tmp/code']}
 
+# --- Language Resolver ---
+# LANG_MAP plus the registry are indexed once: every name (lowercased) maps straight to its
+# canonical entry, following alias chains of any length, and one compiled pattern finds a
+# language name as a whole token in a shebang line. Call rebuild_lang_index() after changes.
+LANG_TOKEN = re.compile(r"^([a-z0-9\+\#]+)(?:[:\-](\d+(?:\.\d+)*))?$")
+ANSI_ESCAPE = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+CODEBLOCK = re.compile(r"```(.*?)\n(.*?)```", re.DOTALL)
+PREVIOUS_RESULT = re.compile(r"^Result \(.*\):[\r\n]+---[\r\n]+", re.MULTILINE)
+TRAILING_FENCE = re.compile(r"```+\s*$")
+UNSAFE_FILENAME_CHARS = re.compile(r'[^a-zA-Z0-9]')
+LANG_INDEX = {'entries': {}, 'canonical': {}, 'shebang': None}
+
+def resolve_alias(name, lang_map):
+    """Follow an alias chain to its last name (a config entry, or an alias to nothing); None on a cycle."""
+    seen = set()
+    while isinstance(lang_map.get(name), str):
+        if name in seen: return None
+        seen.add(name)
+        name = lang_map[name]
+    return name
+
+def rebuild_lang_index():
+    global LANG_INDEX
+    entries = dict(LANG_MAP)
+    with REGISTRY_LOCK:
+        for name, record in REGISTRY.items():
+            entries[name] = {'registry': name} # Loaded by lang_config() on first use
+        for name, record in REGISTRY.items():
+            for alias in record['aliases']:
+                if alias not in REGISTRY: entries[alias] = name
+    canonical = {}
+    for name in entries:
+        target = resolve_alias(name, entries)
+        if target: canonical.setdefault(name.lower(), target)
+    names = '|'.join(re.escape(name) for name in sorted(canonical, key=len, reverse=True))
+    # A name counts only as a whole token: after start/space/'/'/'!' and before space/end,
+    # optionally with a version ('python3', 'python:3.11'); so 'sh' never matches inside 'bash'.
+    shebang = re.compile(r'(?<![^\s/!])(' + names + r')((?:[:\-]?\d+(?:\.\d+)*)?)(?!\S)', re.IGNORECASE)
+    # One assignment: hotkey and worker threads see either the old tables or the new ones, never a mix.
+    LANG_INDEX = {'entries': entries, 'canonical': canonical, 'shebang': shebang}
+
+def canonical_lang(name):
+    return LANG_INDEX['canonical'].get(name.lower())
+
+def lang_config(name):
+    """A copy of a canonical language's config, parsing its registry file on first use."""
+    entry = LANG_INDEX['entries'].get(name)
+    if not isinstance(entry, dict): return None
+    if 'registry' not in entry: return entry.copy()
+    with REGISTRY_LOCK:
+        record = REGISTRY.get(entry['registry'])
+        if record is None: return None
+        if record['config'] is None:
+            try: record['config'], _ = parse_registry_file(record['path'])
+            except Exception as e:
+                print(f"Invalid language file {record['path']}: {e}")
+                return None
+        config = record['config']
+    # A file may only tune a built-in language (e.g. just 'pool_size'), so layer it on top.
+    builtin = LANG_MAP.get(name)
+    config = dict(builtin if isinstance(builtin, dict) else {}, **config)
+    return config if config.get('image') else None
+
+# --- Language Registry ---
+try: import tomllib
+except ImportError: tomllib = None # Python < 3.11: JSON files only
+
+REGISTRY_FIELDS = {'image', 'cmd', 'entrypoint', 'aliases', 'limits', 'compile', 'session',
+                   'pool_size', 'result_cache', 'compile_cache', 'deps_install'}
+REGISTRY = {} # name -> {'path', 'mtime', 'aliases', 'config' (None until first used)}
+REGISTRY_LOCK = threading.Lock()
+REGISTRY_ALIAS_CACHE = os.path.join(DATA_DIR, "registry_aliases.json")
+REGISTRY_WATCHER = None
+
+def parse_registry_file(path):
+    """(config, aliases) from one language file."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    data = tomllib.loads(raw.decode('utf-8')) if path.lower().endswith('.toml') else json.loads(raw)
+    if not isinstance(data, dict): raise ValueError("expected a table/object")
+    unknown = set(data) - REGISTRY_FIELDS
+    if unknown: print(f"{os.path.basename(path)}: ignoring unknown fields {sorted(unknown)}")
+    config = {key: value for key, value in data.items() if key in REGISTRY_FIELDS and key != 'aliases'}
+    for key in ('cmd', 'deps_install'):
+        if isinstance(config.get(key), str): config[key] = shlex.split(config[key])
+    if 'cmd' in config and not isinstance(config['cmd'], list): raise ValueError("'cmd' must be a list or string")
+    if 'limits' in config and not isinstance(config['limits'], dict): raise ValueError("'limits' must be a table")
+    aliases = data.get('aliases', [])
+    if isinstance(aliases, str): aliases = [aliases]
+    return config, [str(alias).lower() for alias in aliases]
+
+def registry_files():
+    """{language name: (path, mtime)} from a stat-only scan; user files win over system files."""
+    files = {}
+    for directory in (SYSTEM_REGISTRY_DIR, USER_REGISTRY_DIR):
+        try: entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError: continue
+        for entry in entries:
+            name, ext = os.path.splitext(entry.name)
+            if ext.lower() not in ('.json', '.toml') or not entry.is_file(): continue
+            if ext.lower() == '.toml' and tomllib is None: continue
+            files[name.lower()] = (entry.path, entry.stat().st_mtime)
+    return files
+
+def registry_aliases(files, parsed):
+    """{path: aliases}; only files changed since the cached scan are parsed (into `parsed`)."""
+    try:
+        with open(REGISTRY_ALIAS_CACHE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError): cache = {}
+    fresh = {}
+    for path, mtime in files.values():
+        cached = cache.get(path)
+        if cached and cached[0] == mtime:
+            fresh[path] = cached
+            continue
+        try: parsed[path], aliases = parse_registry_file(path)
+        except Exception as e:
+            print(f"Invalid language file {path}: {e}")
+            aliases = []
+        fresh[path] = [mtime, aliases]
+    if fresh != cache:
+        try:
+            os.makedirs(DATA_DIR, exist_ok=True)
+            with open(REGISTRY_ALIAS_CACHE, 'w', encoding='utf-8') as f:
+                json.dump(fresh, f)
+        except OSError as e: print(f"Could not save registry alias cache: {e}")
+    return {path: aliases for path, (_, aliases) in fresh.items()}
+
+def load_registry(files=None):
+    """Rescan the registry dirs and rebuild the language index; unchanged files stay loaded."""
+    files = registry_files() if files is None else files
+    parsed = {}
+    aliases = registry_aliases(files, parsed)
+    with REGISTRY_LOCK:
+        previous = dict(REGISTRY)
+        REGISTRY.clear()
+        for name, (path, mtime) in files.items():
+            old = previous.get(name)
+            config = old['config'] if old and old['path'] == path and old['mtime'] == mtime else parsed.get(path)
+            REGISTRY[name] = {'path': path, 'mtime': mtime, 'aliases': aliases.get(path, []), 'config': config}
+    rebuild_lang_index()
+
+def watch_registry(icon):
+    signature = registry_files()
+    while True:
+        time.sleep(REGISTRY_POLL_SECONDS)
+        current = registry_files()
+        if current == signature: continue
+        signature = current
+        load_registry(current)
+        icon.notify(f"Language registry reloaded ({len(current)} files).", title="Ephemeral")
+
+def start_registry_watcher(icon):
+    global REGISTRY_WATCHER
+    if REGISTRY_WATCHER is not None: return
+    REGISTRY_WATCHER = threading.Thread(target=watch_registry, args=(icon,), daemon=True)
+    REGISTRY_WATCHER.start()
+
+load_registry()
+
 def create_icon_image():
+    from PIL import Image, ImageDraw
     image = Image.new('RGB', (64, 64), (30, 30, 30))
     dc = ImageDraw.Draw(image)
     dc.rectangle((16, 16, 48, 48), fill=(255, 255, 255)) 
@@ -136,11 +427,11 @@ def create_icon_image():
     return image
 
 def get_clipboard():
+    import pyperclip
     return pyperclip.paste()
 
 def strip_ansi_codes(text):
-    ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    return ansi_escape.sub('', text)
+    return ANSI_ESCAPE.sub('', text)
 
 def strip_shebang(text):
     if not text: return text
@@ -156,25 +447,61 @@ def parse_codeblock(content):
         return None, None
         
     # Scenario 1: Markdown Block (```python unsafe ...)
-    pattern = r"```(.*?)\n(.*?)```"
-    match = re.search(pattern, content, re.DOTALL)
+    match = CODEBLOCK.search(content)
     if match:
         header = match.group(1).strip() if match.group(1) else None
         return header, strip_shebang(match.group(2))
         
     # Scenario 2: Shebang Line (#! python unsafe)
-    first_line = content.strip().splitlines()[0]
-    if first_line.startswith("#!"):
-        lower_line = first_line.lower()
-        sorted_keys = sorted(LANG_MAP.keys(), key=len, reverse=True)
-        for key in sorted_keys:
-            if key in lower_line:
-                # Return full header to capture flags
-                full_header = first_line.lstrip("#!").strip()
-                return full_header, strip_shebang(content)
-                
+    stripped = content.lstrip()
+    if stripped.startswith("#!"):
+        first_line = stripped.split('\n', 1)[0].rstrip()
+        match = LANG_INDEX['shebang'].search(first_line)
+        if match:
+            # Header is the language (with a ':'/'-' version) plus the flags on either side of it,
+            # so '#!/usr/bin/env python3 unsafe' and '#! unsafe python3' both become 'python unsafe'.
+            lang, version = match.group(1), match.group(2)
+            if version[:1] in (':', '-'): lang += version
+            before = [t for t in first_line[2:match.start()].split()
+                      if t.lower() in NETWORK_FLAGS or t.lower() in RUN_FLAGS or '=' in t] # Not '/usr/bin/env'
+            return ' '.join([lang] + before + first_line[match.end():].split()), strip_shebang(content)
+
     return None, None
 
+FENCE_OPEN = re.compile(r'^ {0,3}(`{3,})(.*)$')
+FENCE_CLOSE = {} # Fence length -> compiled closing pattern
+
+def fence_close(length):
+    if length not in FENCE_CLOSE: FENCE_CLOSE[length] = re.compile(r'^ {0,3}`{%d,}\s*$' % length)
+    return FENCE_CLOSE[length]
+
+def parse_codeblocks(content, keep_shebang=False):
+    """Every fenced block as (header, code), in order.
+
+    Fences close on a line of at least as many backticks, so ```` wrappers (as used in
+    ephemeral_test_suite.md) nest correctly; a wrapper without a header is unwrapped.
+    """
+    blocks = []
+    if not content: return blocks
+    lines = content.replace('\r\n', '\n').split('\n')
+    i = 0
+    while i < len(lines):
+        opening = FENCE_OPEN.match(lines[i])
+        if not opening or '`' in opening.group(2):
+            i += 1
+            continue
+        fence, header = opening.group(1), opening.group(2).strip()
+        closing = fence_close(len(fence))
+        j = i + 1
+        while j < len(lines) and not closing.match(lines[j]):
+            j += 1
+        body = '\n'.join(lines[i + 1:j])
+        inner = parse_codeblocks(body, keep_shebang) if not header else []
+        if inner: blocks.extend(inner)
+        else: blocks.append((header or None, body + '\n' if keep_shebang else strip_shebang(body + '\n')))
+        i = j + 1
+    return blocks
+
 def prompt_user_for_language(default_lang, code_preview=""):
     fd_out, path_out = tempfile.mkstemp(suffix='.txt')
     os.close(fd_out)
@@ -221,10 +548,40 @@ def prompt_user_for_language(default_lang, code_preview=""):
         if os.path.exists(path_ctx): os.remove(path_ctx)
     return detected_lang
 
+SIZE_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)([kmg]?)b?$', re.IGNORECASE)
+
+def parse_size(value):
+    """'512m' -> bytes; plain numbers are bytes. Returns None when unparseable."""
+    match = SIZE_PATTERN.match(str(value).strip())
+    if not match: return None
+    scale = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}[match.group(2).lower()]
+    return int(float(match.group(1)) * scale)
+
+def coerce_limit(key, value):
+    if key == 'timeout': return float(value)
+    if key == 'pids': return int(value)
+    if key == 'cpus': return str(float(value))
+    if parse_size(value) is None: raise ValueError(value)
+    return value
+
+def resolve_limits(lang_limits, overrides):
+    """Layer DEFAULT_LIMITS < LANG_MAP 'limits' < header key=value; an invalid value falls back a layer."""
+    limits = dict(lang_limits or {})
+    for key in DEFAULT_LIMITS:
+        for layer in (overrides, lang_limits or {}, DEFAULT_LIMITS):
+            if key not in layer: continue
+            try:
+                limits[key] = coerce_limit(key, layer[key])
+                break
+            except (TypeError, ValueError): print(f"Ignoring invalid {key} limit: {layer[key]!r}")
+    return limits
+
 def resolve_runtime_config(header_line):
     if not header_line: return None
-    try: tokens = shlex.split(header_line)
-    except: tokens = header_line.split() 
+    if '"' in header_line or "'" in header_line or '\\' in header_line:
+        try: tokens = shlex.split(header_line)
+        except: tokens = header_line.split()
+    else: tokens = header_line.split() # Nothing for shlex to do
     if not tokens: return None
 
     # 1. Detect Network Flags
@@ -242,37 +599,31 @@ def resolve_runtime_config(header_line):
     # 2. Parse Language
     base_lang_input = cleaned_tokens[0].lower()
     overrides = {}
+    flags = set()
     
     for token in cleaned_tokens[1:]:
         if '=' in token:
             key, val = token.split('=', 1)
             overrides[key.lower()] = val
+        elif token.lower() in RUN_FLAGS:
+            flags.add(token.lower())
 
     base_lang = base_lang_input
     version = None
-    match = re.match(r"^([a-z0-9\+\#]+)(?:[:\-](\d+(?:\.\d+)*))?$", base_lang_input)
+    match = LANG_TOKEN.match(base_lang_input)
     if match:
         base_lang = match.group(1)
         version = match.group(2) 
-        
-    if base_lang in LANG_MAP:
-        resolved = LANG_MAP[base_lang]
-        if isinstance(resolved, str):
-            base_lang = resolved
-            if base_lang in LANG_MAP and isinstance(LANG_MAP[base_lang], str):
-                 base_lang = LANG_MAP[base_lang]
-        elif isinstance(resolved, dict):
-            pass
-
-    config = None
-    if base_lang in LANG_MAP and isinstance(LANG_MAP[base_lang], dict):
-        config = LANG_MAP[base_lang].copy()
+
+    canonical = canonical_lang(base_lang)
+    if canonical: base_lang = canonical
+    config = lang_config(canonical) if canonical else None
     
     if not config:
         if 'image' in overrides: config = {'image': '', 'cmd': []}
         else:
             image_tag = f"{base_lang_input}" if ':' in base_lang_input else f"{base_lang_input}:latest"
-            config = {'image': image_tag, 'cmd': [base_lang, '-']}
+            config = {'image': image_tag, 'cmd': [base_lang, '-'], 'unknown_lang': True} # Guessed from the header
 
     if version and config and 'image' not in overrides:
         original_image = config.get('image', '')
@@ -285,86 +636,1193 @@ def resolve_runtime_config(header_line):
     if 'image' in overrides: config['image'] = overrides['image']
     if 'cmd' in overrides: config['cmd'] = shlex.split(overrides['cmd'])
     if 'entrypoint' in overrides: config['entrypoint'] = overrides['entrypoint']
+    if 'cmd' in overrides or 'entrypoint' in overrides:
+        config.pop('compile', None)
+        config.pop('session', None)
     
+    if 'data' in overrides: config['datasets'] = overrides['data'].split(',')
+    if 'deps' in overrides: config['deps'] = sorted({d.strip() for d in overrides['deps'].split(',') if d.strip()})
     config['allow_network'] = network_enabled
+    config['flags'] = flags
+    config['limits'] = resolve_limits(config.get('limits'), overrides)
+    config['overrides'] = overrides
     return config
 
 # --- Clipboard Images ---
+# Images go on the clipboard as the registered "PNG" format (the file's own bytes when no
+# downscaling is needed). CF_DIB is only promised: a hidden owner window renders it on
+# WM_RENDERFORMAT if a paste target asks for it, so most pastes never build the bitmap.
+CLIPBOARD_IMAGE_MAX_PIXELS = 12_000_000 # Downscale larger images (e.g. 300 dpi plots); 0 keeps full size
+CLIPBOARD_OWNER = {'hwnd': None, 'thread': None, 'pending': None, 'ready': threading.Event()}
+WIN32 = {}
+CF_DIB = 8
+GMEM_MOVEABLE = 0x0002
+WM_CLOSE, WM_DESTROY = 0x0010, 0x0002
+WM_RENDERFORMAT, WM_RENDERALLFORMATS, WM_DESTROYCLIPBOARD = 0x0305, 0x0306, 0x0307
+
+def win32_api():
+    """user32/kernel32 with handle-sized signatures (the defaults truncate 64-bit handles)."""
+    if WIN32: return WIN32
+    from ctypes import wintypes
+    user32 = ctypes.WinDLL('user32', use_last_error=True)
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.GlobalAlloc.restype, kernel32.GlobalAlloc.argtypes = wintypes.HGLOBAL, [wintypes.UINT, ctypes.c_size_t]
+    kernel32.GlobalLock.restype, kernel32.GlobalLock.argtypes = ctypes.c_void_p, [wintypes.HGLOBAL]
+    kernel32.GlobalUnlock.argtypes = [wintypes.HGLOBAL]
+    kernel32.GlobalFree.argtypes = [wintypes.HGLOBAL]
+    kernel32.GetModuleHandleW.restype, kernel32.GetModuleHandleW.argtypes = wintypes.HMODULE, [wintypes.LPCWSTR]
+    user32.OpenClipboard.argtypes = [wintypes.HWND]
+    user32.SetClipboardData.restype, user32.SetClipboardData.argtypes = wintypes.HANDLE, [wintypes.UINT, wintypes.HANDLE]
+    user32.RegisterClipboardFormatW.restype, user32.RegisterClipboardFormatW.argtypes = wintypes.UINT, [wintypes.LPCWSTR]
+    user32.CreateWindowExW.restype = wintypes.HWND
+    user32.CreateWindowExW.argtypes = [wintypes.DWORD, wintypes.LPCWSTR, wintypes.LPCWSTR, wintypes.DWORD, ctypes.c_int,
+                                       ctypes.c_int, ctypes.c_int, ctypes.c_int, wintypes.HWND, wintypes.HMENU,
+                                       wintypes.HINSTANCE, wintypes.LPVOID]
+    user32.DefWindowProcW.restype = ctypes.c_ssize_t
+    user32.DefWindowProcW.argtypes = [wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
+    user32.SendMessageW.argtypes = [wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
+    user32.GetMessageW.argtypes = [ctypes.POINTER(wintypes.MSG), wintypes.HWND, wintypes.UINT, wintypes.UINT]
+    WIN32.update(user32=user32, kernel32=kernel32, wintypes=wintypes,
+                 CF_PNG=user32.RegisterClipboardFormatW("PNG"))
+    return WIN32
+
+def global_from_bytes(data):
+    kernel32 = win32_api()['kernel32']
+    handle = kernel32.GlobalAlloc(GMEM_MOVEABLE, len(data))
+    if not handle: raise MemoryError("GlobalAlloc failed")
+    ctypes.memmove(kernel32.GlobalLock(handle), data, len(data))
+    kernel32.GlobalUnlock(handle)
+    return handle
+
+def render_pending_dib():
+    """Build the promised CF_DIB (the clipboard must already be open or being rendered)."""
+    pending = CLIPBOARD_OWNER['pending']
+    if not pending: return
+    from io import BytesIO
+    from PIL import Image
+    with Image.open(BytesIO(pending['png'])) as img: # Our own copy: the run's output dir is gone by now
+        img = img.convert("RGB")
+        if img.size != pending['size']: img = img.resize(pending['size'], Image.LANCZOS)
+        output = BytesIO()
+        img.save(output, "BMP")
+    buffer = output.getbuffer()
+    dib = (ctypes.c_char * (len(buffer) - 14)).from_buffer(buffer, 14) # Skip the BITMAPFILEHEADER, no copy
+    win32_api()['user32'].SetClipboardData(CF_DIB, global_from_bytes(dib))
+
+def clipboard_owner_loop():
+    api = win32_api()
+    user32, wintypes = api['user32'], api['wintypes']
+    WNDPROC = ctypes.WINFUNCTYPE(ctypes.c_ssize_t, wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM)
+
+    class WNDCLASSW(ctypes.Structure):
+        _fields_ = [('style', wintypes.UINT), ('lpfnWndProc', WNDPROC), ('cbClsExtra', ctypes.c_int),
+                    ('cbWndExtra', ctypes.c_int), ('hInstance', wintypes.HINSTANCE), ('hIcon', wintypes.HICON),
+                    ('hCursor', wintypes.HANDLE), ('hbrBackground', wintypes.HBRUSH),
+                    ('lpszMenuName', wintypes.LPCWSTR), ('lpszClassName', wintypes.LPCWSTR)]
+
+    def window_proc(hwnd, msg, wparam, lparam):
+        try:
+            if msg == WM_RENDERFORMAT:
+                if wparam == CF_DIB: render_pending_dib()
+                return 0
+            if msg == WM_RENDERALLFORMATS:
+                # Quitting: render now so a promised bitmap outlives us.
+                if CLIPBOARD_OWNER['pending'] and user32.OpenClipboard(hwnd):
+                    try: render_pending_dib()
+                    finally: user32.CloseClipboard()
+                return 0
+            if msg == WM_DESTROYCLIPBOARD:
+                CLIPBOARD_OWNER['pending'] = None
+                return 0
+            if msg == WM_DESTROY:
+                user32.PostQuitMessage(0)
+                return 0
+        except Exception as e: print(f"Clipboard render failed: {e}")
+        return user32.DefWindowProcW(hwnd, msg, wparam, lparam)
+
+    proc = WNDPROC(window_proc) # Referenced for the lifetime of the loop
+    instance = api['kernel32'].GetModuleHandleW(None)
+    window_class = WNDCLASSW(lpfnWndProc=proc, hInstance=instance, lpszClassName="EphemeralClipboardOwner")
+    user32.RegisterClassW(ctypes.byref(window_class))
+    hwnd = user32.CreateWindowExW(0, window_class.lpszClassName, "Ephemeral", 0, 0, 0, 0, 0,
+                                  wintypes.HWND(-3), None, instance, None) # HWND_MESSAGE: message-only
+    CLIPBOARD_OWNER['hwnd'] = hwnd
+    CLIPBOARD_OWNER['ready'].set()
+    msg = wintypes.MSG()
+    while hwnd and user32.GetMessageW(ctypes.byref(msg), None, 0, 0) > 0:
+        user32.TranslateMessage(ctypes.byref(msg))
+        user32.DispatchMessageW(ctypes.byref(msg))
+
+def clipboard_owner():
+    """hwnd of the hidden window that renders delayed formats, started on first use."""
+    if CLIPBOARD_OWNER['thread'] is None:
+        CLIPBOARD_OWNER['thread'] = threading.Thread(target=clipboard_owner_loop, daemon=True)
+        CLIPBOARD_OWNER['thread'].start()
+    CLIPBOARD_OWNER['ready'].wait(5)
+    return CLIPBOARD_OWNER['hwnd']
+
+def release_clipboard_owner():
+    """Destroy the owner window; Windows first asks it to render anything still promised."""
+    if CLIPBOARD_OWNER['hwnd']: win32_api()['user32'].SendMessageW(CLIPBOARD_OWNER['hwnd'], WM_CLOSE, 0, 0)
+
+def prepare_clipboard_image(image_path):
+    """(png bytes, size, original size): the file as-is if it is a PNG within the pixel budget."""
+    from io import BytesIO
+    from PIL import Image
+    with Image.open(image_path) as img:
+        original = img.size
+        pixels = original[0] * original[1]
+        size = original
+        if CLIPBOARD_IMAGE_MAX_PIXELS and pixels > CLIPBOARD_IMAGE_MAX_PIXELS:
+            scale = (CLIPBOARD_IMAGE_MAX_PIXELS / pixels) ** 0.5
+            size = (max(1, int(original[0] * scale)), max(1, int(original[1] * scale)))
+        if img.format == 'PNG' and size == original:
+            with open(image_path, 'rb') as f: return f.read(), size, original
+        img.draft('RGB', size) # JPEG: decode at reduced scale directly
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        if img.size != size: img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        output = BytesIO()
+        img.save(output, 'PNG', compress_level=1) # Speed over size; it only lives on the clipboard
+        return output.getvalue(), size, original
+
 def copy_image_to_clipboard(image_path):
+    """Put an image on the clipboard; returns a stats dict, or None on failure."""
     try:
-        from io import BytesIO
-        img = Image.open(image_path)
-        output = BytesIO()
-        img.convert("RGB").save(output, "BMP")
-        data = output.getvalue()[14:] 
-        output.close()
-        user32 = ctypes.windll.user32
-        kernel32 = ctypes.windll.kernel32
-        OpenClipboard = user32.OpenClipboard
-        EmptyClipboard = user32.EmptyClipboard
-        SetClipboardData = user32.SetClipboardData
-        CloseClipboard = user32.CloseClipboard
-        GlobalAlloc = kernel32.GlobalAlloc
-        GlobalLock = kernel32.GlobalLock
-        GlobalUnlock = kernel32.GlobalUnlock
-        GMEM_MOVEABLE = 0x0002
-        CF_DIB = 8
-        OpenClipboard(0)
-        EmptyClipboard()
-        hCd = GlobalAlloc(GMEM_MOVEABLE, len(data))
-        pchData = GlobalLock(hCd)
-        ctypes.memmove(pchData, data, len(data))
-        GlobalUnlock(hCd)
-        SetClipboardData(CF_DIB, hCd)
-        CloseClipboard()
-        return True
+        start = time.perf_counter()
+        png, size, original = prepare_clipboard_image(image_path)
+        api = win32_api()
+        user32 = api['user32']
+        hwnd = clipboard_owner()
+        if not user32.OpenClipboard(hwnd): raise OSError("Clipboard is busy")
+        try:
+            user32.EmptyClipboard() # Sends WM_DESTROYCLIPBOARD for an earlier promise
+            CLIPBOARD_OWNER['pending'] = {'png': png, 'size': size}
+            user32.SetClipboardData(api['CF_PNG'], global_from_bytes(png))
+            if hwnd: user32.SetClipboardData(CF_DIB, None) # Promise; rendered on request
+            else: render_pending_dib() # No owner window: render eagerly
+        finally: user32.CloseClipboard()
+        stats = {'size': size, 'original': original, 'png_bytes': len(png),
+                 'pixel_bytes': size[0] * size[1] * 4, 'seconds': time.perf_counter() - start}
+        write_trace_event({'event': 'clipboard_image', 'ts': time.time(), 'width': size[0], 'height': size[1],
+                           'original_width': original[0], 'original_height': original[1], 'png_bytes': len(png),
+                           'pixel_bytes': stats['pixel_bytes'], 'ms': round(stats['seconds'] * 1000, 1)})
+        return stats
     except Exception as e:
         print(f"Image copy failed: {e}")
-        return False
+        return None
+
+# --- Container Backends ---
+# Every container CLI call goes through BACKEND.argv(); call sites speak podman's dialect and
+# each backend translates what differs. 'local' is a fake for CI and tests: it runs the
+# language command directly on the host, with no isolation at all.
+def hidden_startupinfo():
+    if os.name != 'nt': return None
+    startupinfo = subprocess.STARTUPINFO()
+    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    return startupinfo
+
+class PodmanBackend:
+    name = 'podman'
+    executable = 'podman'
+    has_machine = True   # `podman machine` start/stop applies
+    containers = True    # Runs real containers (pool, compile cache and image checks apply)
+
+    def __init__(self, connection=None):
+        self.connection = connection # A named `podman system connection`; None is the default
+        if connection: self.has_machine = False # Its machine (if any) is managed outside Ephemeral
+
+    def argv(self, args):
+        if self.connection: return [self.executable, '--connection', self.connection] + list(args)
+        return [self.executable] + list(args)
+
+    def popen(self, argv, **kwargs):
+        return subprocess.Popen(argv, **kwargs)
+
+    def parse_images(self, output):
+        """[(names, image id)] from `images --format json` output."""
+        return [(image.get('Names') or [], image.get('Id')) for image in json.loads(output or '[]') or []]
+
+class DockerBackend(PodmanBackend):
+    name = 'docker'
+    executable = 'docker'
+    has_machine = False
+
+    def argv(self, args):
+        args = list(args)
+        if args[:2] == ['image', 'exists']:
+            args = ['image', 'inspect', '--format', '{{.Id}}'] + args[2:]
+        elif args[:1] == ['images']:
+            args = ['images', '--format', '{{json .}}']
+        elif args[:1] == ['rm']:
+            args = ['rm', '--force', args[-1]] # docker rm has no --time
+        return [self.executable] + args
+
+    def parse_images(self, output):
+        images = []
+        for line in output.splitlines():
+            if not line.strip(): continue
+            image = json.loads(line)
+            names = [] if image.get('Repository') in (None, '<none>') else [f"{image['Repository']}:{image.get('Tag') or 'latest'}"]
+            images.append((names, image.get('ID')))
+        return images
+
+class LocalBackend:
+    name = 'local'
+    has_machine = False
+    containers = False
+    VALUE_FLAGS = {'--name', '--memory', '--cpus', '--pids-limit', '--tmpfs', '--network', '-v', '--entrypoint'}
+
+    def argv(self, args):
+        args = list(args)
+        if args[:1] == ['run']: return self.host_command(args[1:])
+        # Image queries report nothing; everything else (rm, prune, pull...) is a no-op.
+        output = '[]' if args[:1] == ['images'] else ''
+        return [sys.executable, '-c', 'import sys; sys.stdout.write(sys.argv[1])', output]
+
+    def host_command(self, args):
+        entrypoint, position = [], 0
+        while position < len(args) and args[position].startswith('-'):
+            flag = args[position].split('=', 1)[0]
+            if flag == '--entrypoint': entrypoint = [args[position + 1]]
+            position += 2 if flag in self.VALUE_FLAGS and '=' not in args[position] else 1
+        return entrypoint + args[position + 1:] # Drop the image name
+
+    def popen(self, argv, **kwargs):
+        return subprocess.Popen(argv, **kwargs)
+
+class ApiProcess:
+    """The part of subprocess.Popen the run paths use, backed by a libpod API call or attach stream."""
+
+    def __init__(self, stdout=None, stderr=None):
+        self.returncode = None
+        self.stdin = self.stdout = self.stderr = None
+        self.done = threading.Event()
+        self.sinks = {}
+        self.killer = None
+        for which, mode in (('stdout', stdout), ('stderr', stderr)):
+            if mode == subprocess.PIPE:
+                read_fd, write_fd = os.pipe()
+                setattr(self, which, os.fdopen(read_fd, 'rb'))
+                self.sinks[which] = os.fdopen(write_fd, 'wb', buffering=0)
+
+    @classmethod
+    def completed(cls, returncode, kwargs, stdout=b'', stderr=b''):
+        process = cls()
+        if kwargs.get('stdin') == subprocess.PIPE: process.stdin = io.BytesIO() # Input nobody reads
+        if kwargs.get('stdout') == subprocess.PIPE: process.stdout = io.BytesIO(stdout)
+        if kwargs.get('stderr') == subprocess.PIPE: process.stderr = io.BytesIO(stderr)
+        process.finish(returncode)
+        return process
+
+    def emit(self, which, data):
+        sink = self.sinks.get(which)
+        if not sink or not data: return
+        try: sink.write(data)
+        except OSError: self.sinks.pop(which, None) # Nobody reads this stream any more
+
+    def finish(self, returncode):
+        for sink in self.sinks.values():
+            try: sink.close()
+            except OSError: pass
+        self.returncode = returncode
+        self.done.set()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout): raise subprocess.TimeoutExpired('podman-api', timeout)
+        return self.returncode
+
+    def kill(self):
+        if self.killer and self.returncode is None: self.killer()
+
+    terminate = kill
+
+    def communicate(self, input=None, timeout=None):
+        results = {}
+        readers = [threading.Thread(target=lambda w=which, s=stream: results.__setitem__(w, s.read()), daemon=True)
+                   for which, stream in (('stdout', self.stdout), ('stderr', self.stderr)) if stream]
+        for reader in readers: reader.start()
+        self.wait(timeout)
+        for reader in readers: reader.join()
+        return results.get('stdout'), results.get('stderr')
+
+class ApiStdin:
+    """Container stdin over an attach socket; close() half-closes it, which the container sees as EOF."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.closed = False
+
+    def write(self, data):
+        self.sock.sendall(data)
+        return len(data)
+
+    def flush(self): pass
+
+    def close(self):
+        if self.closed: return
+        self.closed = True
+        try: self.sock.shutdown(socket.SHUT_WR)
+        except OSError: pass
+
+class PodmanApiBackend(PodmanBackend):
+    """Talks to the Podman service (libpod REST API) over pooled socket connections.
+
+    `run` (attached or -d), `rm`, `info`, `image exists` and `images` go over the API instead
+    of spawning the CLI. Anything else, and everything while the socket is unreachable, runs
+    the podman CLI as before.
+    """
+    name = 'podman-api'
+    API_VERSION = 'v4.0.0'
+    RETRY_SECONDS = 30 # After the socket refused a connection, use the CLI for this long
+    POOL_SIZE = 4
+    RUN_VALUE_FLAGS = {'--name', '--memory', '--cpus', '--pids-limit', '--tmpfs', '--network', '-v', '--entrypoint', '--label'}
+    VOLUME = re.compile(r'^(.+?):(/[^:]*)(?::([a-z,]+))?$')
+
+    def __init__(self, url=None):
+        super().__init__()
+        self.url = url or PODMAN_API_URL or default_podman_api_url()
+        self.routed = bool(url) # A PODMAN_CONNECTIONS entry: CLI commands must reach the same service
+        if url: self.has_machine = False
+        self.idle = []
+        self.lock = threading.Lock()
+        self.down_until = 0.0
+
+    def argv(self, args):
+        if self.routed: return [self.executable, '--url', self.url] + list(args)
+        return super().argv(args)
+
+    def popen(self, argv, **kwargs):
+        if self.url and time.monotonic() >= self.down_until:
+            try:
+                process = self.api_process(list(argv[len(self.argv([])):]), kwargs) # Past `podman [--url URL]`
+                if process: return process
+            except OSError as e:
+                # Nothing was created yet, so running the same command through the CLI is safe.
+                self.down_until = time.monotonic() + self.RETRY_SECONDS
+                print(f"Podman API at {self.url} unreachable ({e}); using the CLI.")
+        return subprocess.Popen(argv, **kwargs)
+
+    def api_process(self, args, kwargs):
+        """An ApiProcess for the commands the API covers, or None to run the CLI."""
+        from urllib.parse import quote
+        if args == ['info']:
+            status, _ = self.request('GET', '/libpod/_ping')
+            return ApiProcess.completed(0 if status == 200 else 125, kwargs)
+        if args == ['info', '--format', 'json']:
+            status, body = self.request('GET', '/libpod/info')
+            return ApiProcess.completed(0 if status == 200 else 125, kwargs, stdout=body)
+        if args[:2] == ['image', 'exists'] and len(args) == 3:
+            status, _ = self.request('GET', f"/libpod/images/{quote(args[2], safe='')}/exists")
+            return ApiProcess.completed(0 if status == 204 else 1, kwargs)
+        if args == ['images', '--format', 'json']:
+            status, body = self.request('GET', '/libpod/images/json')
+            return ApiProcess.completed(0 if status == 200 else 125, kwargs, stdout=body)
+        if args[:1] == ['rm'] and '--force' in args:
+            status, body = self.request('DELETE', f"/libpod/containers/{quote(args[-1], safe='')}?force=true&t=0")
+            return ApiProcess.completed(0 if status < 300 else 1, kwargs, stderr=api_error(body))
+        if args[:1] == ['run']:
+            parsed = self.run_spec(args[1:])
+            if parsed: return self.run_container(*parsed, kwargs)
+        return None
+
+    def run_spec(self, args):
+        """(libpod SpecGenerator, detach) for podman-dialect `run` args; None if a flag is not understood."""
+        spec = {'stdin': False, 'resource_limits': {}, 'mounts': [], 'labels': {}}
+        detach, position = False, 0
+        while position < len(args) and args[position].startswith('-'):
+            flag, _, value = args[position].partition('=')
+            if flag in self.RUN_VALUE_FLAGS and not value:
+                if position + 1 >= len(args): return None
+                value = args[position + 1]
+                position += 2
+            else: position += 1
+            if flag == '-i': spec['stdin'] = True
+            elif flag == '-d': detach = True
+            elif flag == '--rm': spec['remove'] = True
+            elif flag == '--pull' and value == 'never': pass # Creating a container never pulls
+            elif flag == '--name': spec['name'] = value
+            elif flag == '--entrypoint': spec['entrypoint'] = [value]
+            elif flag == '--memory': spec['resource_limits']['memory'] = {'limit': parse_size(value)}
+            elif flag == '--cpus': spec['resource_limits']['cpu'] = {'quota': int(float(value) * 100000), 'period': 100000}
+            elif flag == '--pids-limit': spec['resource_limits']['pids'] = {'limit': int(value)}
+            elif flag == '--label':
+                key, _, label = value.partition('=')
+                spec['labels'][key] = label
+            elif flag == '--network' and value == 'none': spec['netns'] = {'nsmode': 'none'}
+            elif flag == '--tmpfs':
+                destination, _, options = value.partition(':')
+                spec['mounts'].append({'type': 'tmpfs', 'source': 'tmpfs', 'destination': destination,
+                                       'options': options.split(',') if options else []})
+            elif flag == '-v':
+                match = self.VOLUME.match(value)
+                if not match: return None
+                spec['mounts'].append({'type': 'bind', 'source': machine_path(match.group(1)),
+                                       'destination': match.group(2), 'options': (match.group(3) or 'rw').split(',')})
+            else: return None
+        if position >= len(args): return None
+        spec['image'], spec['command'] = args[position], args[position + 1:]
+        return spec, detach
+
+    def run_container(self, spec, detach, kwargs):
+        from urllib.parse import quote
+        remove = spec.pop('remove', False)
+        if detach: spec['remove'] = remove # Attached runs are removed explicitly once their exit code is read
+        status, body = self.request('POST', '/libpod/containers/create', spec)
+        if status >= 300: return ApiProcess.completed(125, kwargs, stderr=api_error(body))
+        container = quote(json.loads(body)['Id'], safe='')
+        if detach:
+            try: status, body = self.request('POST', f'/libpod/containers/{container}/start')
+            except OSError as e: status, body = 599, str(e).encode('utf-8')
+            if status >= 300:
+                try: self.request('DELETE', f'/libpod/containers/{container}?force=true&t=0')
+                except OSError: pass
+                return ApiProcess.completed(125, kwargs, stderr=api_error(body))
+            return ApiProcess.completed(0, kwargs, stdout=container.encode('ascii') + b'\n')
+        process = ApiProcess(kwargs.get('stdout'), kwargs.get('stderr'))
+        try:
+            sock, pending = self.attach(container)
+            status, body = self.request('POST', f'/libpod/containers/{container}/start')
+            if status >= 300: raise RuntimeError(api_error(body).decode('utf-8', 'replace'))
+        except Exception as e:
+            # The container exists now: fail this run rather than let popen() run it again via the CLI.
+            try: self.request('DELETE', f'/libpod/containers/{container}?force=true&t=0')
+            except OSError: pass
+            return ApiProcess.completed(125, kwargs, stderr=str(e).encode('utf-8'))
+        process.stdin = ApiStdin(sock)
+        if kwargs.get('stdin') != subprocess.PIPE or not spec['stdin']: process.stdin.close()
+        if kwargs.get('stdin') != subprocess.PIPE: process.stdin = None
+        process.killer = lambda: self.request('DELETE', f'/libpod/containers/{container}?force=true&t=0')
+        threading.Thread(target=self.pump_attach, args=(sock, pending, container, process), daemon=True).start()
+        return process
+
+    def attach(self, container):
+        """A hijacked connection streaming the container's stdio; returns (socket, bytes already read)."""
+        sock = self.connect()
+        sock.sendall((f"POST /{self.API_VERSION}/libpod/containers/{container}/attach"
+                      "?stdin=true&stdout=true&stderr=true&stream=true HTTP/1.1\r\n"
+                      "Host: d\r\nConnection: Upgrade\r\nUpgrade: tcp\r\nContent-Length: 0\r\n\r\n").encode('ascii'))
+        data = b''
+        while b'\r\n\r\n' not in data:
+            chunk = sock.recv(65536)
+            if not chunk: raise OSError("Podman API closed the attach connection")
+            data += chunk
+        head, _, pending = data.partition(b'\r\n\r\n')
+        status = head.split(b' ', 2)[1]
+        if status not in (b'101', b'200'):
+            sock.close()
+            raise RuntimeError(f"attach failed: {head.splitlines()[0].decode('ascii', 'replace')}")
+        return sock, pending
+
+    def pump_attach(self, sock, pending, container, process):
+        """Demultiplex the attach stream (8-byte frame headers: stream id, 3 pad bytes, length)."""
+        buffer = bytearray(pending)
+        try:
+            while True:
+                while len(buffer) >= 8 and len(buffer) >= 8 + int.from_bytes(buffer[4:8], 'big'):
+                    size = int.from_bytes(buffer[4:8], 'big')
+                    process.emit('stderr' if buffer[0] == 2 else 'stdout', bytes(buffer[8:8 + size]))
+                    del buffer[:8 + size]
+                chunk = sock.recv(65536)
+                if not chunk: break
+                buffer += chunk
+        except OSError: pass
+        finally: sock.close()
+        returncode = 137 # Killed (removed) before its exit code could be read
+        try:
+            status, body = self.request('POST', f'/libpod/containers/{container}/wait')
+            if status == 200: returncode = int(json.loads(body))
+            self.request('DELETE', f'/libpod/containers/{container}?force=true&t=0')
+        except (OSError, ValueError): pass
+        process.finish(returncode)
+
+    def connect(self):
+        if self.url.startswith('unix://'):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(5)
+            sock.connect(self.url[len('unix://'):])
+        elif self.url.startswith('tcp://'):
+            host, _, port = self.url[len('tcp://'):].rstrip('/').rpartition(':')
+            sock = socket.create_connection((host, int(port)), timeout=5)
+        else: raise OSError(f"Unsupported Podman API URL: {self.url}")
+        sock.settimeout(None)
+        return sock
+
+    def request(self, method, path, body=None):
+        """(status, body bytes) of one API call on a pooled keep-alive connection."""
+        import http.client
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        headers = {'Content-Type': 'application/json'} if data is not None else {}
+        with self.lock:
+            conn = self.idle.pop() if self.idle else None
+        while True:
+            fresh = conn is None
+            if fresh:
+                conn = http.client.HTTPConnection('d')
+                conn.sock = self.connect()
+                conn.auto_open = 0 # Never let http.client dial localhost:80 on its own
+            try:
+                conn.request(method, f'/{self.API_VERSION}{path}', body=data, headers=headers)
+                response = conn.getresponse()
+                payload = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                conn = None
+                # A pooled connection the service had closed: retry once on a new one, but only
+                # where a repeat is harmless (a retried create could leave a duplicate container).
+                if fresh or method not in ('GET', 'DELETE'): raise OSError(str(e)) from e
+                continue
+            with self.lock:
+                if len(self.idle) < self.POOL_SIZE and not response.will_close: self.idle.append(conn)
+                else: conn.close()
+            return response.status, payload
+
+def default_podman_api_url():
+    if os.name == 'nt': return '' # The machine's named pipe is not supported; set PODMAN_API_URL to a tcp:// service
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or f"/run/user/{os.getuid()}"
+    return f"unix://{runtime_dir}/podman/podman.sock"
+
+def machine_path(host_path):
+    """C:\\Users\\me -> /mnt/c/Users/me: the API, unlike the CLI, does not translate Windows paths."""
+    match = re.match(r'^([A-Za-z]):[\\/](.*)$', host_path)
+    if os.name != 'nt' or not match: return host_path
+    return f"/mnt/{match.group(1).lower()}/" + match.group(2).replace('\\', '/')
+
+def api_error(body):
+    try: return (json.loads(body).get('message') or '').encode('utf-8')
+    except (ValueError, AttributeError): return body or b''
+
+def backend_call(args, timeout=None):
+    """subprocess.call() of a podman-dialect command through BACKEND.popen()."""
+    process = BACKEND.popen(BACKEND.argv(args), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            startupinfo=hidden_startupinfo())
+    try: return process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        raise
+
+def backend_output(args, timeout=None):
+    """subprocess.check_output() of a podman-dialect command through BACKEND.popen()."""
+    process = BACKEND.popen(BACKEND.argv(args), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            startupinfo=hidden_startupinfo())
+    try: out, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        raise
+    if process.returncode: raise subprocess.CalledProcessError(process.returncode, args, out)
+    return out
+
+BACKENDS = {'podman': PodmanBackend, 'podman-api': PodmanApiBackend, 'docker': DockerBackend, 'local': LocalBackend}
+BACKEND = BACKENDS.get(CONTAINER_BACKEND, PodmanBackend)()
+
+# --- Tracing ---
+# A run (one hotkey job) collects phase timings on its thread; phases nested inside another
+# phase are logged but left out of the run's breakdown, so the breakdown adds up.
+TRACE_LOCAL = threading.local()
+TRACE_LOCK = threading.Lock()
+RECENT_RUNS = deque(maxlen=TRACE_RECENT_RUNS)
+TRACE_SEQ = {'next_id': 1}
+METRICS_SERVER = None
+
+def write_trace_event(event):
+    if not TRACE_ENABLED: return
+    try:
+        with TRACE_LOCK:
+            os.makedirs(DATA_DIR, exist_ok=True)
+            if os.path.exists(TRACE_FILE) and os.path.getsize(TRACE_FILE) > TRACE_MAX_MB * 1024 * 1024:
+                os.replace(TRACE_FILE, TRACE_FILE + '.1')
+            with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(event) + '\n')
+    except Exception as e: print(f"Trace write failed: {e}")
+
+def current_trace():
+    return getattr(TRACE_LOCAL, 'run', None)
+
+def use_trace(trace):
+    """Attach this thread to a run started elsewhere (e.g. notebook block workers)."""
+    TRACE_LOCAL.run = trace
+    TRACE_LOCAL.depth = 0
+
+def begin_trace(label, start=None):
+    with TRACE_LOCK:
+        run_id = TRACE_SEQ['next_id']
+        TRACE_SEQ['next_id'] += 1
+    use_trace({'id': run_id, 'label': label, 'status': 'ok', 'started': time.time(),
+               'start': start or time.perf_counter(), 'phases': {}})
+    return current_trace()
+
+def annotate_trace(**fields):
+    trace = current_trace()
+    if trace: trace.update(fields)
+
+def add_phase(name, seconds, depth=0, trace=None):
+    trace = trace or current_trace()
+    if trace is None: return # Outside a run (startup probes, tests) there is nothing to attribute it to
+    if depth == 0:
+        with TRACE_LOCK:
+            trace['phases'][name] = trace['phases'].get(name, 0.0) + seconds
+    write_trace_event({'event': 'phase', 'ts': time.time(), 'run': trace['id'],
+                       'phase': name, 'seconds': round(seconds, 4), 'depth': depth})
+
+@contextmanager
+def trace_phase(name):
+    depth = getattr(TRACE_LOCAL, 'depth', 0)
+    TRACE_LOCAL.depth = depth + 1
+    start = time.perf_counter()
+    try: yield
+    finally:
+        TRACE_LOCAL.depth = depth
+        add_phase(name, time.perf_counter() - start, depth)
+
+def traced(name):
+    """Decorator: time every call of the function as phase `name`."""
+    def wrap(func):
+        def call(*args, **kwargs):
+            with trace_phase(name): return func(*args, **kwargs)
+        call.__name__, call.__doc__ = func.__name__, func.__doc__
+        return call
+    return wrap
+
+def end_trace():
+    trace = current_trace()
+    if not trace: return
+    use_trace(None)
+    summary = {'id': trace['id'], 'label': trace['label'], 'status': trace['status'],
+               'started': trace['started'], 'seconds': round(time.perf_counter() - trace['start'], 4),
+               'phases': {name: round(value, 4) for name, value in trace['phases'].items()}}
+    with TRACE_LOCK:
+        RECENT_RUNS.append(summary)
+    write_trace_event(dict(summary, event='run', ts=time.time()))
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+def phase_percentiles():
+    """{phase: (p50, p90, p99)} over the recent runs, with 'total' first."""
+    with TRACE_LOCK:
+        runs = list(RECENT_RUNS)
+    names = ['total'] + sorted({name for run in runs for name in run['phases']})
+    stats = {}
+    for name in names:
+        values = [run['seconds'] if name == 'total' else run['phases'][name] for run in runs
+                  if name == 'total' or name in run['phases']]
+        stats[name] = tuple(percentile(values, q) for q in (0.5, 0.9, 0.99))
+    return stats
+
+def recent_runs_menu_items():
+    from pystray import MenuItem as item
+    with TRACE_LOCK:
+        runs = list(RECENT_RUNS)[::-1]
+    startup = startup_summary()
+    header = (item(f"Startup: {startup}", None, enabled=False),) if startup else ()
+    if not runs: return header + (item('No runs yet', None, enabled=False),)
+    items = list(header)
+    for run in runs[:10]:
+        phases = ', '.join(f"{name} {value:.2f}" for name, value in
+                           sorted(run['phases'].items(), key=lambda p: -p[1])[:4])
+        items.append(item(f"#{run['id']} {run['label']} ({run['status']}) {run['seconds']:.2f}s: {phases}",
+                          None, enabled=False))
+    items.append(item(f"Percentiles over last {len(runs)} runs (p50 / p90 / p99)", None, enabled=False))
+    for name, (p50, p90, p99) in phase_percentiles().items():
+        items.append(item(f"  {name}: {p50:.2f}s / {p90:.2f}s / {p99:.2f}s", None, enabled=False))
+    return tuple(items)
+
+def metrics_text():
+    """Prometheus text format: phase percentiles and counts over the recent runs."""
+    with TRACE_LOCK:
+        runs = list(RECENT_RUNS)
+    lines = ['# TYPE ephemeral_phase_seconds summary']
+    for name, values in phase_percentiles().items():
+        for quantile, value in zip(('0.5', '0.9', '0.99'), values):
+            lines.append(f'ephemeral_phase_seconds{{phase="{name}",quantile="{quantile}"}} {value:.4f}')
+    lines.append('# TYPE ephemeral_recent_runs gauge')
+    for status in sorted({run['status'] for run in runs}):
+        lines.append(f'ephemeral_recent_runs{{status="{status}"}} {sum(1 for r in runs if r["status"] == status)}')
+    return '\n'.join(lines) + '\n'
+
+def start_metrics_server():
+    global METRICS_SERVER
+    if not METRICS_PORT or METRICS_SERVER: return
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics': body, kind = metrics_text(), 'text/plain; version=0.0.4'
+            elif self.path == '/runs':
+                with TRACE_LOCK: body = json.dumps(list(RECENT_RUNS), indent=2)
+                kind = 'application/json'
+            else:
+                self.send_error(404)
+                return
+            data = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', kind)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args): pass
+
+    try:
+        METRICS_SERVER = ThreadingHTTPServer(('127.0.0.1', METRICS_PORT), MetricsHandler)
+        threading.Thread(target=METRICS_SERVER.serve_forever, daemon=True).start()
+    except Exception as e: print(f"Metrics endpoint failed to start: {e}")
 
 # --- Podman Lifecycle ---
 def check_podman_alive():
-    try:
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        subprocess.check_call(['podman', 'info'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, startupinfo=startupinfo)
-        return True
-    except: return False
+    try: return mark_podman_status(probe_call(['info']) == 0)
+    except OSError: return mark_podman_status(False)
 
+@traced('image_check')
 def check_image_exists(image_name):
+    try: return backend_call(['image', 'exists', image_name]) == 0
+    except Exception: return False
+
+# --- Image Index ---
+# One `podman images` call answers "is this image local?" for every later run.
+# It is dropped after pulls and prunes, and a run that still hits "image not known"
+# falls back to a real `podman image exists` check.
+IMAGE_INDEX = {}          # connection name (None: default) -> {normalized image name -> image id}
+IMAGE_INDEX_LOCK = threading.Lock()
+IMAGE_INDEX_BUILD_LOCK = threading.Lock()
+IMAGE_CHECK_COST = None   # Measured seconds of one `podman image exists` call
+
+def normalize_image_name(image_name):
+    name = image_name.strip()
+    if '@' in name: return name
+    if ':' not in name.rsplit('/', 1)[-1]: name += ':latest'
+    registry, _, rest = name.partition('/')
+    if not rest: return f'docker.io/library/{name}'
+    if '.' not in registry and ':' not in registry and registry != 'localhost':
+        return f'docker.io/{name}'
+    return name
+
+def strip_registry(normalized_name):
+    # Short names may resolve to any search registry (quay.io, ...), so also match without it.
+    return normalized_name.split('/', 1)[1] if '/' in normalized_name else normalized_name
+
+def build_image_index():
+    global IMAGE_CHECK_COST
+    start = time.perf_counter()
     try:
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        subprocess.check_call(['podman', 'image', 'exists', image_name], startupinfo=startupinfo)
-        return True
-    except: return False
+        out = backend_output(['images', '--format', 'json'])
+        images = BACKEND.parse_images(out.decode('utf-8'))
+    except Exception as e:
+        print(f"Image index build failed: {e}")
+        return None
+    index = {}
+    for names, image_id in images:
+        for name in names:
+            normalized = normalize_image_name(name)
+            index[normalized] = image_id
+            index.setdefault(strip_registry(normalized), image_id)
+    elapsed = time.perf_counter() - start
+    with IMAGE_INDEX_LOCK:
+        IMAGE_INDEX[connection_name()] = index
+    if index and IMAGE_CHECK_COST is None:
+        # Calibrate once so the saving is visible: this is what every run used to pay.
+        probe_start = time.perf_counter()
+        check_image_exists(next(iter(index)))
+        IMAGE_CHECK_COST = time.perf_counter() - probe_start
+        print(f"[Ephemeral] Image index: {len(images)} images in {elapsed * 1000:.0f} ms, "
+              f"saves ~{IMAGE_CHECK_COST * 1000:.0f} ms per run")
+    return index
+
+def invalidate_image_index():
+    with IMAGE_INDEX_LOCK:
+        IMAGE_INDEX.pop(connection_name(), None)
+
+def current_image_index():
+    """The current connection's image index, building it first if needed; concurrent callers share one build."""
+    with IMAGE_INDEX_BUILD_LOCK:
+        index = IMAGE_INDEX.get(connection_name())
+        return index if index is not None else build_image_index()
 
+def lookup_image_id(image_name):
+    index = current_image_index()
+    if index is None: return None
+    normalized = normalize_image_name(image_name)
+    return index.get(normalized) or index.get(strip_registry(normalized))
+
+@traced('image_check')
+def image_present(image_name):
+    if not BACKEND.containers: return True
+    if current_image_index() is None:
+        return check_image_exists(image_name)
+    return lookup_image_id(image_name) is not None
+
+def is_missing_image_failure(returncode, stderr):
+    message = stderr.lower()
+    return returncode == 125 and ('image not known' in message or 'image not found' in message or 'no such image' in message)
+
+@traced('podman_check')
 def ensure_podman_running(icon):
-    if check_podman_alive(): return
+    """Start (or create) the Podman machine if the backend does not answer; returns whether it does."""
+    if check_podman_alive(): return True
+    if READINESS['cancelled']: return False
+    if not BACKEND.has_machine:
+        icon.notify(f"{BACKEND.name} is not reachable. Start it and try again.", title="Ephemeral Init")
+        return mark_podman_status(False)
     icon.notify("Podman is not running. Attempting to start...", title="Ephemeral Init")
-    startupinfo = subprocess.STARTUPINFO()
-    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
     try:
-        subprocess.check_call(['podman', 'machine', 'start'], startupinfo=startupinfo, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        icon.notify("Podman machine started successfully.", title="Ephemeral Init")
-    except subprocess.CalledProcessError:
+        if probe_call(['machine', 'start']) == 0:
+            icon.notify("Podman machine started successfully.", title="Ephemeral Init")
+            return mark_podman_status(True)
+        if READINESS['cancelled']: return False
         icon.notify("Start failed. Initializing new machine...", title="Ephemeral Init")
-        try:
-            subprocess.check_call(['podman', 'machine', 'init'], startupinfo=startupinfo)
-            subprocess.check_call(['podman', 'machine', 'start'], startupinfo=startupinfo)
+        if probe_call(['machine', 'init'], quiet=False) == 0 and probe_call(['machine', 'start'], quiet=False) == 0:
             icon.notify("Podman machine initialized and started.", title="Ephemeral Init")
-        except Exception as e:
-            icon.notify(f"Could not start Podman: {e}", title="Ephemeral Fatal Error")
+            return mark_podman_status(True)
+        if not READINESS['cancelled']: icon.notify("Could not start Podman.", title="Ephemeral Fatal Error")
+    except Exception as e:
+        icon.notify(f"Could not start Podman: {e}", title="Ephemeral Fatal Error")
+    return mark_podman_status(False)
 
 def stop_podman_machine(icon):
+    if not BACKEND.has_machine: return
     icon.notify("Stopping Podman machine...", title="Ephemeral Shutdown")
-    startupinfo = subprocess.STARTUPINFO()
-    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    startupinfo = hidden_startupinfo()
     try:
-        subprocess.run(['podman', 'machine', 'stop'], startupinfo=startupinfo)
+        subprocess.run(BACKEND.argv(['machine', 'stop']), startupinfo=startupinfo)
     except Exception as e:
         print(f"Error stopping podman: {e}")
 
+# --- Podman Readiness ---
+# The tray starts one background probe (`podman info`, booting the machine if needed) and
+# caches the answer. Runs wait on that probe instead of spawning their own `podman info`;
+# a good answer is trusted for PODMAN_STATUS_TTL seconds. Quitting kills a probe in flight.
+PODMAN_STATUS_TTL = 300
+PODMAN_PROBE_TIMEOUT = 300 # Longest a run waits for the probe (a cold machine boot)
+READINESS = {'ready': None, 'checked': 0.0, 'probe': None, 'cancelled': False, 'procs': set()}
+READINESS_LOCK = threading.Lock()
+
+def probe_call(args, quiet=True):
+    """subprocess.call() of a backend command that cancel_readiness_probe() can kill."""
+    output = subprocess.DEVNULL if quiet else None
+    with READINESS_LOCK:
+        if READINESS['cancelled']: return -1
+        proc = BACKEND.popen(BACKEND.argv(args), stdout=output, stderr=output, startupinfo=hidden_startupinfo())
+        READINESS['procs'].add(proc)
+    try: return proc.wait()
+    finally:
+        with READINESS_LOCK: READINESS['procs'].discard(proc)
+
+def mark_podman_status(ready):
+    with READINESS_LOCK:
+        READINESS['ready'], READINESS['checked'] = ready, time.monotonic()
+    return ready
+
+def invalidate_podman_status():
+    with READINESS_LOCK: READINESS['ready'] = None
+
+def start_readiness_probe(icon):
+    """Start the shared probe unless one is already running; returns the Event it sets when done."""
+    with READINESS_LOCK:
+        probe = READINESS['probe']
+        if probe is None or probe.is_set():
+            probe = READINESS['probe'] = threading.Event()
+            threading.Thread(target=run_readiness_probe, args=(icon, probe), daemon=True).start()
+    return probe
+
+def run_readiness_probe(icon, probe):
+    try:
+        with MACHINE_LOCK: # Never race an idle stop that is in progress
+            if ensure_podman_running(icon): MACHINE['stopped_at'] = None
+    except Exception as e:
+        print(f"Podman readiness probe failed: {e}")
+        mark_podman_status(False)
+    finally:
+        probe.set()
+        mark_startup('podman')
+
+def wait_for_podman(icon):
+    """True once the backend is known to answer; free while the cached answer is fresh."""
+    if CONNECTIONS: # Health checks replace the single probe; the run is routed to a healthy connection
+        with trace_phase('podman_wait'):
+            CONNECTIONS_READY.wait(PODMAN_PROBE_TIMEOUT)
+        return bool(current_connection()['healthy'])
+    with READINESS_LOCK:
+        if READINESS['ready'] and time.monotonic() - READINESS['checked'] < PODMAN_STATUS_TTL: return True
+    with trace_phase('podman_wait'):
+        start_readiness_probe(icon).wait(PODMAN_PROBE_TIMEOUT)
+    return bool(READINESS['ready'])
+
+def cancel_readiness_probe():
+    with READINESS_LOCK:
+        READINESS['cancelled'] = True
+        procs = list(READINESS['procs'])
+    for proc in procs:
+        try: proc.kill()
+        except OSError: pass
+
+# --- Machine Lifecycle ---
+# Every run touches the activity clock and records its hour of the week (weekday * 24 + hour)
+# in MACHINE_ACTIVITY_FILE. After MACHINE_IDLE_MINUTES without runs, sessions or warm
+# containers are dropped and the machine is stopped, unless this or the coming hour is usually
+# busy. While stopped, the machine is booted again MACHINE_PREBOOT_LEAD_MINUTES before such an
+# hour. The next run after a stop boots it through the readiness probe as usual. VM stats for
+# the tray are only fetched while the "Podman Machine" submenu is being shown.
+MACHINE = {'last_activity': time.time(), 'stopped_at': None, 'preboot_slot': None, 'stats': None, 'history': None,
+           'stats_refreshing': False}
+MACHINE_LOCK = threading.Lock() # Held while the machine is being stopped or (re)probed
+
+def activity_slot(ts):
+    t = time.localtime(ts)
+    return str(t.tm_wday * 24 + t.tm_hour)
+
+def activity_history():
+    if MACHINE['history'] is None:
+        try:
+            with open(MACHINE_ACTIVITY_FILE, 'r', encoding='utf-8') as f:
+                MACHINE['history'] = json.load(f)
+        except (OSError, ValueError): MACHINE['history'] = {}
+    return MACHINE['history']
+
+def record_machine_activity():
+    """Reset the idle clock and note this hour of the week (at most one file write per hour)."""
+    now = time.time()
+    MACHINE['last_activity'] = now
+    with USAGE_LOCK:
+        history = activity_history()
+        day = time.strftime('%Y-%m-%d', time.localtime(now))
+        days = history.setdefault(activity_slot(now), [])
+        if day in days: return
+        cutoff = time.strftime('%Y-%m-%d', time.localtime(now - MACHINE_HISTORY_WEEKS * 7 * 86400))
+        history[activity_slot(now)] = [d for d in days if d > cutoff] + [day]
+        try:
+            os.makedirs(DATA_DIR, exist_ok=True)
+            with open(MACHINE_ACTIVITY_FILE + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(history, f)
+            os.replace(MACHINE_ACTIVITY_FILE + '.tmp', MACHINE_ACTIVITY_FILE)
+        except OSError as e: print(f"Activity history save failed: {e}")
+
+def predicted_busy(ts):
+    """True if runs happened in this hour of the week in at least MACHINE_PREBOOT_MIN_WEEKS recent weeks."""
+    cutoff = time.strftime('%Y-%m-%d', time.localtime(time.time() - MACHINE_HISTORY_WEEKS * 7 * 86400))
+    with USAGE_LOCK:
+        days = activity_history().get(activity_slot(ts), [])
+        return sum(1 for d in days if d > cutoff) >= MACHINE_PREBOOT_MIN_WEEKS
+
+def machine_in_use():
+    with JOB_LOCK:
+        jobs = len(JOB_QUEUE) + len(JOB_RUNNING)
+    with KERNEL_LOCK:
+        kernels = len(KERNELS)
+    return ACTIVE_RUNS > 0 or jobs > 0 or kernels > 0
+
+def stop_idle_machine(icon, reason="idle"):
+    with MACHINE_LOCK:
+        if machine_in_use(): return False
+        invalidate_podman_status()
+        with USAGE_LOCK:
+            prefetches = list(PREFETCH_PROCESSES)
+        for process in prefetches:
+            try: process.terminate()
+            except OSError: pass
+        shutdown_warm_pool()
+        try: subprocess.run(BACKEND.argv(['machine', 'stop']), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            startupinfo=hidden_startupinfo(), timeout=120)
+        except Exception as e: print(f"Error stopping podman: {e}")
+        mark_podman_status(False)
+        MACHINE['stopped_at'], MACHINE['stats'] = time.time(), None
+    write_trace_event({'event': 'machine_stop', 'ts': time.time(), 'reason': reason})
+    print(f"[Ephemeral] Podman machine stopped ({reason}).")
+    return True
+
+def refresh_machine_stats():
+    """Memory and CPU use inside the VM, from `podman info`; None if it does not answer."""
+    try:
+        out = backend_output(['info', '--format', 'json'], timeout=15)
+        host = json.loads(out.decode('utf-8'))['host']
+        cpu = host.get('cpuUtilization') or {}
+        MACHINE['stats'] = {'mem_used': host['memTotal'] - host['memFree'], 'mem_total': host['memTotal'],
+                            'cpus': host.get('cpus'), 'cpu_percent': 100 - cpu['idlePercent'] if 'idlePercent' in cpu else None,
+                            'updated': time.time()}
+    except Exception: MACHINE['stats'] = None
+    finally: MACHINE['stats_refreshing'] = False
+    return MACHINE['stats']
+
+def request_machine_stats():
+    """Refresh the stats in the background if they are older than MACHINE_POLL_SECONDS; the menu shows the last ones."""
+    stats = MACHINE['stats']
+    if MACHINE['stats_refreshing'] or (stats and time.time() - stats['updated'] < MACHINE_POLL_SECONDS): return
+    MACHINE['stats_refreshing'] = True
+    threading.Thread(target=refresh_machine_stats, daemon=True).start()
+
+def machine_tick(icon, now=None):
+    now = now or time.time()
+    if READINESS['ready']:
+        idle = now - MACHINE['last_activity']
+        busy = predicted_busy(now) or predicted_busy(now + MACHINE_PREBOOT_LEAD_MINUTES * 60)
+        if MACHINE_IDLE_MINUTES and idle >= MACHINE_IDLE_MINUTES * 60 and not busy:
+            stop_idle_machine(icon, f"idle {idle / 60:.0f} min")
+    elif MACHINE_PREBOOT and MACHINE['stopped_at']:
+        upcoming = now + MACHINE_PREBOOT_LEAD_MINUTES * 60
+        if predicted_busy(upcoming) and MACHINE['preboot_slot'] != activity_slot(upcoming):
+            MACHINE['preboot_slot'] = activity_slot(upcoming)
+            MACHINE['stopped_at'], MACHINE['last_activity'] = None, now
+            write_trace_event({'event': 'machine_preboot', 'ts': now, 'slot': activity_slot(upcoming)})
+            start_readiness_probe(ConsoleNotifier())
+
+def machine_lifecycle_loop(icon):
+    while True:
+        time.sleep(MACHINE_POLL_SECONDS)
+        try: machine_tick(icon)
+        except Exception as e: print(f"Machine lifecycle check failed: {e}")
+
+def start_machine_lifecycle(icon):
+    if BACKEND.has_machine and (MACHINE_IDLE_MINUTES or MACHINE_PREBOOT):
+        threading.Thread(target=machine_lifecycle_loop, args=(icon,), daemon=True).start()
+
+def machine_menu_items():
+    from pystray import MenuItem as item
+    if READINESS['ready']: request_machine_stats()
+    stats = MACHINE['stats']
+    if READINESS['ready'] and stats:
+        cpu = f", CPU {stats['cpu_percent']:.0f}%" if stats['cpu_percent'] is not None else ''
+        state = (f"Running: {stats['mem_used'] / 2**30:.1f} / {stats['mem_total'] / 2**30:.1f} GB RAM"
+                 f"{cpu} ({stats['cpus']} CPUs)")
+    elif READINESS['ready']: state = "Running"
+    elif MACHINE['stopped_at']: state = f"Stopped at {time.strftime('%H:%M', time.localtime(MACHINE['stopped_at']))}"
+    else: state = "Not running" if READINESS['ready'] is False else "Starting..."
+    items = [item(state, None, enabled=False)]
+    if MACHINE_IDLE_MINUTES and READINESS['ready']:
+        left = MACHINE_IDLE_MINUTES - (time.time() - MACHINE['last_activity']) / 60
+        items.append(item(f"Idle stop in {max(left, 0):.0f} min", None, enabled=False))
+    items.append(item('Stop Machine Now', lambda icon, _: threading.Thread(
+        target=lambda: icon.notify("Podman machine stopped." if stop_idle_machine(icon, "tray")
+                                   else "Runs are still active; machine left running.", title="Ephemeral"),
+        daemon=True).start(), enabled=lambda _: bool(READINESS['ready'])))
+    items.append(item('Start Machine Now', lambda icon, _: start_readiness_probe(icon),
+                      enabled=lambda _: not READINESS['ready']))
+    return tuple(items)
+
+# --- Connections ---
+# With PODMAN_CONNECTIONS set, BACKEND becomes a ConnectionRouter: every BACKEND call uses the
+# connection the calling thread's run was routed to (the first one otherwise). Runs go to a
+# healthy connection with a free slot, preferring one that already holds their images, then
+# the least loaded. Session runs stay on the first connection so their kernels are found again.
+# Callbacks that run on other threads (kills, warm pool refills) carry their connection along.
+CONNECTIONS = []
+CONNECTIONS_LOCK = threading.Lock()
+CONNECTIONS_READY = threading.Event() # Set after the first health check of every connection
+CONNECTION_LOCAL = threading.local()
+CONNECTION_UTILIZATION_WINDOW = 600 # Seconds the tray's utilization figure covers
+
+class ConnectionRouter:
+    """BACKEND while several connections are configured."""
+    def __getattr__(self, name):
+        return getattr(current_connection()['backend'], name)
+
+def current_connection():
+    return getattr(CONNECTION_LOCAL, 'connection', None) or (CONNECTIONS[0] if CONNECTIONS else None)
+
+def connection_name():
+    connection = current_connection()
+    return connection['name'] if connection else None
+
+def connection_named(name):
+    return next((c for c in CONNECTIONS if c['name'] == name), None)
+
+@contextmanager
+def bound_connection(connection):
+    """Run the block against `connection` (None keeps the current one)."""
+    previous = getattr(CONNECTION_LOCAL, 'connection', None)
+    if connection: CONNECTION_LOCAL.connection = connection
+    try: yield
+    finally: CONNECTION_LOCAL.connection = previous
+
+def setup_connections():
+    global BACKEND, WORKER_COUNT
+    if not PODMAN_CONNECTIONS or CONNECTIONS: return
+    for name in PODMAN_CONNECTIONS:
+        backend = PodmanApiBackend(name) if '://' in name else PodmanBackend(name)
+        CONNECTIONS.append({'name': name, 'backend': backend, 'slots': CONNECTION_SLOTS, 'active': 0,
+                            'healthy': None, 'checked': None, 'latency': None, 'runs': 0, 'recent': deque(maxlen=500)})
+    BACKEND = ConnectionRouter()
+    WORKER_COUNT = max(WORKER_COUNT, CONNECTION_SLOTS * len(CONNECTIONS))
+
+def check_connection(connection):
+    """Health-check one connection (`info`) and keep its image index warm for routing."""
+    start = time.perf_counter()
+    with bound_connection(connection):
+        try: healthy = backend_call(['info'], timeout=15) == 0
+        except Exception: healthy = False
+        if healthy and connection['healthy'] is not True: invalidate_image_index() # Back up: its images may have changed
+        if healthy: current_image_index()
+    if healthy != connection['healthy'] and connection['healthy'] is not None:
+        print(f"[Ephemeral] Connection {connection['name']} is {'healthy' if healthy else 'down'}.")
+    connection.update(healthy=healthy, checked=time.time(), latency=time.perf_counter() - start)
+    return healthy
+
+def connection_health_loop():
+    while True:
+        checks = [threading.Thread(target=check_connection, args=(c,), daemon=True) for c in CONNECTIONS]
+        for check in checks: check.start()
+        for check in checks: check.join()
+        if not CONNECTIONS_READY.is_set():
+            CONNECTIONS_READY.set()
+            mark_startup('podman')
+        time.sleep(CONNECTION_HEALTH_SECONDS)
+
+def start_connection_monitor():
+    threading.Thread(target=connection_health_loop, daemon=True).start()
+
+def route_run(images, pinned=False):
+    """Reserve a slot on the best connection for a run needing `images`."""
+    healthy = [c for c in CONNECTIONS if c['healthy']] or CONNECTIONS[:1]
+    if pinned: healthy = CONNECTIONS[:1]
+    local = {}
+    for connection in healthy: # Index lookups may call podman, so they happen outside the lock
+        with bound_connection(connection):
+            local[connection['name']] = sum(1 for image in images if lookup_image_id(image))
+    with CONNECTIONS_LOCK:
+        connection = min(healthy, key=lambda c: (c['active'] >= c['slots'], -local[c['name']],
+                                                 c['active'] / c['slots'], CONNECTIONS.index(c)))
+        connection['active'] += 1
+    return connection
+
+@contextmanager
+def routed_run(images, pinned=False):
+    """Bind this thread to the connection chosen for a run, for the duration of the block."""
+    if not CONNECTIONS:
+        yield None
+        return
+    CONNECTIONS_READY.wait(PODMAN_PROBE_TIMEOUT)
+    connection = route_run([i for i in images if i], pinned)
+    annotate_trace(connection=connection['name'])
+    start = time.perf_counter()
+    try:
+        with bound_connection(connection): yield connection
+    finally:
+        with CONNECTIONS_LOCK:
+            connection['active'] -= 1
+            connection['runs'] += 1
+            connection['recent'].append((time.time(), time.perf_counter() - start))
+
+def connection_utilization(connection):
+    """Share of the connection's slot time used by runs that ended in the last window."""
+    cutoff = time.time() - CONNECTION_UTILIZATION_WINDOW
+    with CONNECTIONS_LOCK:
+        busy = sum(min(seconds, CONNECTION_UTILIZATION_WINDOW) for ended, seconds in connection['recent'] if ended >= cutoff)
+    return min(1.0, busy / (CONNECTION_UTILIZATION_WINDOW * connection['slots']))
+
+def connection_menu_items():
+    from pystray import MenuItem as item
+    if not CONNECTIONS: return (item('Default connection only (set PODMAN_CONNECTIONS)', None, enabled=False),)
+    items = []
+    for c in CONNECTIONS:
+        state = 'checking' if c['healthy'] is None else ('ok' if c['healthy'] else 'DOWN')
+        latency = f", {c['latency'] * 1000:.0f} ms" if c['latency'] is not None else ''
+        with IMAGE_INDEX_LOCK:
+            images = len(set((IMAGE_INDEX.get(c['name']) or {}).values()))
+        items.append(item(f"{c['name']}: {c['active']}/{c['slots']} running, {connection_utilization(c):.0%} busy "
+                          f"(10 min), {c['runs']} runs, {images} images [{state}{latency}]", None, enabled=False))
+    return tuple(items)
+
 def show_post_mortem_error(error_text):
     try:
         with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.txt') as tmp:
@@ -376,154 +1834,2118 @@ def show_post_mortem_error(error_text):
 
 def purge_cache(icon, item):
     icon.notify("Pruning unused images... this may take a moment.", title="Ephemeral Maintenance")
-    startupinfo = subprocess.STARTUPINFO()
-    startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+    # Warm containers pin their images; release them so the prune can reclaim everything.
+    shutdown_warm_pool()
+    startupinfo = hidden_startupinfo()
     try:
-        subprocess.run(['podman', 'image', 'prune', '--all', '--force'], startupinfo=startupinfo, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        gc_dependency_images(keep=0) # On every connection; clears their index too, which the prune alone would leave stale
+        for connection in CONNECTIONS or [None]:
+            with bound_connection(connection):
+                subprocess.run(BACKEND.argv(['image', 'prune', '--all', '--force']), startupinfo=startupinfo, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                invalidate_image_index()
+        IMAGE_DIGESTS.clear()
         icon.notify("Image cache cleared successfully.", title="Ephemeral")
     except Exception as e: icon.notify(f"Error clearing cache: {e}", title="Ephemeral Error")
 
+@traced('pull')
 def perform_visible_pull(image_name):
-    cmd_line = f'cmd /C "echo [Ephemeral] Image {image_name} not found. Downloading... && podman pull {image_name} || pause"'
+    pull_cmd = subprocess.list2cmdline(BACKEND.argv(['pull', image_name]))
+    cmd_line = f'cmd /C "echo [Ephemeral] Image {image_name} not found. Downloading... && {pull_cmd} || pause"'
     process = subprocess.Popen(cmd_line, creationflags=subprocess.CREATE_NEW_CONSOLE)
-    return process.wait()
+    exit_code = process.wait()
+    IMAGE_DIGESTS.pop((connection_name(), image_name), None)
+    invalidate_image_index()
+    return exit_code
 
-def run_container_piped(icon, config, code, lang):
-    output_dir = tempfile.mkdtemp()
+# --- Warm Container Pool ---
+# Each warm container serves exactly one snippet and is then destroyed, so the
+# one-shot isolation guarantee holds; the pool only hides create/start latency.
+WARM_POOL = {}                  # (image, run flags) -> idle containers
+WARM_POOL_USAGE = OrderedDict() # (image, run flags) -> last use, oldest first
+WARM_POOL_PENDING = {}          # (image, run flags) -> containers being spawned
+WARM_POOL_LOCK = threading.Lock()
+WARM_POOL_REAPER = None
+IMAGE_ENTRYPOINTS = {}          # (connection name, image) -> entrypoint
+POOL_IDLE_CMD = ['-c', 'trap "exit 0" TERM; while :; do sleep 1; done']
+
+def remove_output_dir(output_dir):
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+def container_run_flags(config):
+    """Isolation and resource flags shared by one-shot runs and warm containers."""
+    limits = config.get('limits') or DEFAULT_LIMITS
+    flags = ['--memory', str(limits['memory']), '--cpus', str(limits['cpus']),
+             '--pids-limit', str(limits['pids']),
+             # exec: the compile chains build and run their binaries from /tmp
+             '--tmpfs', f"/tmp:rw,exec,size={limits['tmpfs']}"]
+    if not config.get('allow_network', False):
+        flags.extend(['--network', 'none'])
+    return flags
+
+def pool_key(config):
+    return (config['image'], tuple(container_run_flags(config)), connection_name())
+
+def pool_eligible(config):
+    # Warm containers only carry the /output mount, so runs needing extra volumes start cold: that
+    # is every compile-cache run (/artifact is mounted per source hash, read-only on a hit) and
+    # every data= run. Mounting the shared cache into idle containers would let one snippet
+    # tamper with another's cached build.
+    return POOL_ENABLED and config.get('pool_size', POOL_SIZE) > 0 and BACKEND.containers and not config.get('allow_network', False) and not config.get('mounts')
+
+def get_image_entrypoint(image_name):
+    """Warm containers idle under `sh`, so exec must re-apply the image's own entrypoint."""
+    key = (connection_name(), image_name)
+    if key in IMAGE_ENTRYPOINTS: return IMAGE_ENTRYPOINTS[key]
     try:
-        startupinfo = subprocess.STARTUPINFO()
-        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-        
-        if not code.endswith('\n'): code += '\n'
-        code_bytes = code.replace('\r\n', '\n').encode('utf-8')
+        out = subprocess.check_output(
+            BACKEND.argv(['image', 'inspect', '--format', '{{json .Config.Entrypoint}}', image_name]),
+            stderr=subprocess.DEVNULL, startupinfo=hidden_startupinfo()
+        )
+        entrypoint = json.loads(out.decode('utf-8').strip() or 'null') or []
+    except: entrypoint = []
+    if isinstance(entrypoint, str): entrypoint = [entrypoint]
+    IMAGE_ENTRYPOINTS[key] = entrypoint
+    return entrypoint
 
-        # Base Command
-        podman_cmd = ['podman', 'run', '--rm', '-i', '--memory', '2g']
-        
-        # --- NETWORK LOGIC ---
-        if config.get('allow_network', False):
-            pass 
+def spawn_warm_container(key):
+    image, flags, _ = key
+    output_dir = new_output_dir()
+    podman_cmd = ['run', '-d', '--rm'] + list(flags)
+    podman_cmd.extend(['-v', f'{output_dir}:/output', '--entrypoint', 'sh', image])
+    podman_cmd.extend(POOL_IDLE_CMD)
+    try:
+        container_id = backend_output(podman_cmd).decode('utf-8').strip()
+    except Exception as e:
+        print(f"Warm container spawn failed for {image}: {e}")
+        remove_output_dir(output_dir)
+        return None
+    return {
+        'id': container_id, 'output_dir': output_dir, 'connection': current_connection(),
+        'entrypoint': get_image_entrypoint(image), 'created': time.time()
+    }
+
+def discard_warm_container(warm):
+    try:
+        with bound_connection(warm.get('connection')): backend_call(['rm', '--force', '--time', '0', warm['id']])
+    except Exception as e: print(f"Warm container removal failed: {e}")
+    remove_output_dir(warm['output_dir'])
+
+@traced('warm_acquire')
+def acquire_warm_container(config):
+    if not pool_eligible(config): return None
+    with WARM_POOL_LOCK:
+        idle = WARM_POOL.get(pool_key(config))
+        return idle.pop(0) if idle else None
+
+def refill_warm_pool(key, count, evicted):
+    CONNECTION_LOCAL.connection = connection_named(key[2]) # Spawn on the connection the pool belongs to
+    for warm in evicted:
+        discard_warm_container(warm)
+    for _ in range(count):
+        warm = spawn_warm_container(key)
+        with WARM_POOL_LOCK:
+            WARM_POOL_PENDING[key] -= 1
+            keep = warm and POOL_ENABLED and key in WARM_POOL_USAGE
+            if keep: WARM_POOL.setdefault(key, []).append(warm)
+        if warm and not keep: discard_warm_container(warm)
+
+def recycle_warm_pool(config):
+    """Mark the language as recently used and top its pool back up in the background."""
+    if not pool_eligible(config): return
+    key = pool_key(config)
+    evicted = []
+    with WARM_POOL_LOCK:
+        WARM_POOL_USAGE[key] = time.time()
+        WARM_POOL_USAGE.move_to_end(key)
+        while len(WARM_POOL_USAGE) > POOL_MAX_LANGS:
+            old_key, _ = WARM_POOL_USAGE.popitem(last=False)
+            evicted.extend(WARM_POOL.pop(old_key, []))
+        pending = WARM_POOL_PENDING.get(key, 0)
+        missing = max(0, config.get('pool_size', POOL_SIZE) - len(WARM_POOL.get(key, [])) - pending)
+        WARM_POOL_PENDING[key] = pending + missing
+    if missing or evicted:
+        threading.Thread(target=refill_warm_pool, args=(key, missing, evicted), daemon=True).start()
+    start_pool_reaper()
+
+def reap_idle_warm_containers():
+    while True:
+        time.sleep(min(30, POOL_IDLE_TTL))
+        expired = []
+        cutoff = time.time() - POOL_IDLE_TTL
+        with WARM_POOL_LOCK:
+            for key, idle in WARM_POOL.items():
+                expired.extend(w for w in idle if w['created'] < cutoff)
+                idle[:] = [w for w in idle if w['created'] >= cutoff]
+        for warm in expired:
+            discard_warm_container(warm)
+
+def start_pool_reaper():
+    global WARM_POOL_REAPER
+    with WARM_POOL_LOCK:
+        if WARM_POOL_REAPER is not None: return
+        WARM_POOL_REAPER = threading.Thread(target=reap_idle_warm_containers, daemon=True)
+    WARM_POOL_REAPER.start()
+
+def shutdown_warm_pool():
+    with WARM_POOL_LOCK:
+        drained = [w for idle in WARM_POOL.values() for w in idle]
+        WARM_POOL.clear()
+        WARM_POOL_USAGE.clear()
+    for warm in drained:
+        discard_warm_container(warm)
+
+def is_stale_warm_failure(returncode, stderr):
+    # `podman exec` reports its own failures with 125; anything else came from the snippet.
+    message = stderr.lower()
+    return returncode == 125 and ('no such container' in message or 'not running' in message)
+
+def build_run_command(config, output_dir, container_name):
+    # --pull=never: a stale image index must surface as "image not known", not a hidden pull
+    podman_cmd = ['run', '--rm', '-i', '--pull=never', '--name', container_name]
+    podman_cmd.extend(container_run_flags(config))
+    podman_cmd.extend(['-v', f'{output_dir}:/output'])
+    for host_path, container_path, mode in config.get('mounts', []):
+        podman_cmd.extend(['-v', f'{host_path}:{container_path}:{mode}'])
+    if 'entrypoint' in config: podman_cmd.extend(['--entrypoint', config['entrypoint']])
+    podman_cmd.append(config['image'])
+    podman_cmd.extend(config['cmd'])
+    return BACKEND.argv(podman_cmd)
+
+def build_exec_command(config, warm):
+    entrypoint = [config['entrypoint']] if 'entrypoint' in config else warm['entrypoint']
+    return BACKEND.argv(['exec', '-i', warm['id']] + entrypoint + list(config['cmd']))
+
+# --- Compile Cache ---
+# Artifacts live in COMPILE_CACHE_DIR/<key>, keyed by (image digest, build/run commands, source hash).
+# A miss mounts a fresh staging dir read-write as /artifact and publishes it with a rename;
+# a hit mounts the cached dir read-only and only runs the artifact.
+IMAGE_DIGESTS = {} # (connection name, image) -> image id; a tag can differ per connection
+COMPILE_CACHE_LOCK = threading.Lock()
+
+def normalize_code(code):
+    if not code.endswith('\n'): code += '\n'
+    return code.replace('\r\n', '\n').encode('utf-8')
+
+def get_image_digest(image_name):
+    key = (connection_name(), image_name)
+    if key in IMAGE_DIGESTS: return IMAGE_DIGESTS[key]
+    if connection_name() in IMAGE_INDEX and lookup_image_id(image_name):
+        IMAGE_DIGESTS[key] = lookup_image_id(image_name)
+        return IMAGE_DIGESTS[key]
+    try:
+        out = subprocess.check_output(BACKEND.argv(['image', 'inspect', '--format', '{{.Id}}', image_name]),
+                                      stderr=subprocess.DEVNULL, startupinfo=hidden_startupinfo())
+        digest = out.decode('utf-8').strip() or None
+    except: digest = None
+    if digest: IMAGE_DIGESTS[key] = digest
+    return digest
+
+def compile_cache_key(digest, spec, code_bytes):
+    h = hashlib.sha256()
+    for part in (digest, spec['build'], spec['run']):
+        h.update(part.encode('utf-8') + b'\0')
+    h.update(code_bytes)
+    return h.hexdigest()
+
+@traced('compile_cache')
+def prepare_compile_cache(config, code_bytes):
+    """Rewrite a compile-and-run config to build into (or run from) the artifact cache."""
+    spec = config.get('compile')
+    if not spec or COMPILE_CACHE_MAX_MB <= 0 or config.get('compile_cache') is False: return config
+    digest = get_image_digest(config['image'])
+    if not digest: return config
+    key = compile_cache_key(digest, spec, code_bytes)
+    cached_dir = os.path.join(COMPILE_CACHE_DIR, key)
+    config = dict(config)
+    config.pop('entrypoint', None)
+    if os.path.isfile(os.path.join(cached_dir, '.built')):
+        os.utime(cached_dir) # LRU touch
+        config['cmd'] = ['sh', '-c', f"cat > /dev/null; {spec['run']}"]
+        config['mounts'] = config.get('mounts', []) + [(cached_dir, '/artifact', 'ro')]
+        config['compile_cache'] = {'hit': True}
+    else:
+        os.makedirs(COMPILE_CACHE_DIR, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix='.staging-', dir=COMPILE_CACHE_DIR)
+        config['cmd'] = ['sh', '-c', f"{spec['build']} && touch /artifact/.built && {spec['run']}"]
+        config['mounts'] = config.get('mounts', []) + [(staging_dir, '/artifact', 'rw')]
+        config['compile_cache'] = {'hit': False, 'staging': staging_dir, 'target': cached_dir}
+    return config
+
+def finalize_compile_cache(config):
+    state = config.get('compile_cache')
+    if not state or state['hit']: return
+    staging_dir = state['staging']
+    if os.path.isfile(os.path.join(staging_dir, '.built')):
+        try: os.replace(staging_dir, state['target'])
+        except OSError: pass # A concurrent run already published the same key
+    remove_output_dir(staging_dir)
+    enforce_cache_limit(COMPILE_CACHE_DIR, COMPILE_CACHE_MAX_MB, COMPILE_CACHE_LOCK)
+
+def cache_entries(cache_dir):
+    """(last used, size in bytes, path) for each entry dir; staging dirs start with '.'."""
+    entries = []
+    if not os.path.isdir(cache_dir): return entries
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith('.') or not os.path.isdir(path): continue
+        size = 0
+        for root, _, files in os.walk(path):
+            for f in files:
+                try: size += os.path.getsize(os.path.join(root, f))
+                except OSError: pass
+        entries.append((os.path.getmtime(path), size, path))
+    return entries
+
+def enforce_cache_limit(cache_dir, max_mb, lock):
+    with lock:
+        entries = sorted(cache_entries(cache_dir))
+        total = sum(size for _, size, _ in entries)
+        limit = max_mb * 1024 * 1024
+        for _, size, path in entries:
+            if total <= limit: break
+            remove_output_dir(path)
+            total -= size
+
+def clear_compile_cache(icon, item):
+    with COMPILE_CACHE_LOCK:
+        entries = cache_entries(COMPILE_CACHE_DIR)
+        for _, _, path in entries:
+            remove_output_dir(path)
+    freed_mb = sum(size for _, size, _ in entries) / (1024 * 1024)
+    icon.notify(f"Compile cache cleared ({len(entries)} artifacts, {freed_mb:.1f} MB).", title="Ephemeral")
+
+# --- Result Cache ---
+# Opt-in memoization of successful, network-less one-shot runs. Entries live in
+# RESULT_CACHE_DIR/<key> (result.json plus the /output files), keyed by image digest,
+# entrypoint, cmd and the normalized code; a hit replays them without starting a container.
+RESULT_CACHE_LOCK = threading.Lock()
+RESULT_CACHE_STATS = {'hits': 0, 'misses': 0}
+
+def result_cache_key(config, code_bytes):
+    if not RESULT_CACHE_ENABLED or RESULT_CACHE_MAX_MB <= 0: return None
+    flags = config.get('flags', ())
+    if config.get('allow_network') or 'nocache' in flags or 'session' in flags: return None
+    if config.get('result_cache') is False: return None
+    digest = get_image_digest(config['image'])
+    if not digest: return None
+    h = hashlib.sha256()
+    # Dataset mounts are content-addressed, so a changed dataset changes the key.
+    for part in (digest, config.get('entrypoint', ''), json.dumps(config['cmd']), json.dumps(config.get('mounts', []))):
+        h.update(part.encode('utf-8') + b'\0')
+    h.update(code_bytes)
+    return h.hexdigest()
+
+@traced('result_cache')
+def load_cached_result(key, result):
+    """Fill result from the cache entry for key; returns False on a miss."""
+    entry_dir = os.path.join(RESULT_CACHE_DIR, key)
+    try:
+        with open(os.path.join(entry_dir, 'result.json'), 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        # Whole tree, subdirectories included, into the (empty) fresh output dir.
+        shutil.copytree(os.path.join(entry_dir, 'output'), result['output_dir'], dirs_exist_ok=True)
+        os.utime(entry_dir) # LRU touch
+    except (OSError, ValueError):
+        with RESULT_CACHE_LOCK: RESULT_CACHE_STATS['misses'] += 1
+        return False
+    result.update(returncode=cached['returncode'], stdout=cached['stdout'], stderr=cached['stderr'], cached=True)
+    with RESULT_CACHE_LOCK: RESULT_CACHE_STATS['hits'] += 1
+    return True
+
+def store_cached_result(key, result):
+    try:
+        os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix='.staging-', dir=RESULT_CACHE_DIR)
+        shutil.copytree(result['output_dir'], os.path.join(staging_dir, 'output'))
+        with open(os.path.join(staging_dir, 'result.json'), 'w', encoding='utf-8') as f:
+            json.dump({k: result[k] for k in ('returncode', 'stdout', 'stderr')}, f)
+        try: os.replace(staging_dir, os.path.join(RESULT_CACHE_DIR, key))
+        except OSError: pass # Another run stored the same key first
+        remove_output_dir(staging_dir)
+    except Exception as e: print(f"Result cache store failed: {e}")
+    enforce_cache_limit(RESULT_CACHE_DIR, RESULT_CACHE_MAX_MB, RESULT_CACHE_LOCK)
+
+def toggle_result_cache(icon, item):
+    global RESULT_CACHE_ENABLED
+    RESULT_CACHE_ENABLED = not RESULT_CACHE_ENABLED
+
+def result_cache_menu_text(item):
+    return f"Cache Results ({RESULT_CACHE_STATS['hits']} hits / {RESULT_CACHE_STATS['misses']} misses)"
+
+def clear_result_cache(icon, item):
+    with RESULT_CACHE_LOCK:
+        entries = cache_entries(RESULT_CACHE_DIR)
+        for _, _, path in entries:
+            remove_output_dir(path)
+    icon.notify(f"Result cache cleared ({len(entries)} results).", title="Ephemeral")
+
+# --- Datasets ---
+# Seed files live once in DATASET_DIR/blobs/<sha256>, however many names point at them, and
+# index.json maps each name to its blob. A 'data=sales,weather' header bind-mounts them
+# read-only at /data/<original filename>, so runs share the host file and nothing is copied.
+# Files dropped into DATASET_DIR/import are adopted (moved, not copied) under their file name.
+DATASET_LOCK = threading.Lock()
+DATASET_USERS = {} # sha256 -> runs currently mounting it
+DATASET_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]*$')
+
+def dataset_paths():
+    return (os.path.join(DATASET_DIR, 'index.json'), os.path.join(DATASET_DIR, 'blobs'),
+            os.path.join(DATASET_DIR, 'import'))
+
+def load_dataset_index():
+    try:
+        with open(dataset_paths()[0], 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError): return {}
+
+def save_dataset_index(index):
+    index_path = dataset_paths()[0]
+    os.makedirs(DATASET_DIR, exist_ok=True)
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    os.replace(index_path + '.tmp', index_path)
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def add_dataset(path, name=None, move=False):
+    """Store a file under `name` (default: its file name stem); returns (name, entry)."""
+    filename = re.sub(r'[:,]', '_', os.path.basename(path)) # ':' and ',' would break the -v mount spec
+    name = name or os.path.splitext(filename)[0]
+    if not DATASET_NAME.match(name): raise ValueError(f"Invalid dataset name: {name!r}")
+    digest = file_sha256(path)
+    _, blob_dir, _ = dataset_paths()
+    os.makedirs(blob_dir, exist_ok=True)
+    blob = os.path.join(blob_dir, digest)
+    with DATASET_LOCK:
+        if os.path.exists(blob): # Same content already stored under another name
+            if move: os.remove(path)
+        elif move: os.replace(path, blob)
         else:
-            podman_cmd.extend(['--network', 'none'])
-        # ---------------------
+            shutil.copyfile(path, blob + '.tmp')
+            os.replace(blob + '.tmp', blob)
+        index = load_dataset_index()
+        replaced = index.get(name, {}).get('sha256')
+        entry = {'sha256': digest, 'filename': filename, 'size': os.path.getsize(blob), 'added': time.time()}
+        index[name] = entry
+        save_dataset_index(index)
+        remove_orphan_blob(index, replaced)
+    return name, entry
 
-        podman_cmd.extend(['-v', f'{output_dir}:/output'])
-        
-        if 'entrypoint' in config: podman_cmd.extend(['--entrypoint', config['entrypoint']])
-        podman_cmd.append(config['image'])
-        podman_cmd.extend(config['cmd'])
+def import_dataset_inbox():
+    _, _, inbox = dataset_paths()
+    try: names = sorted(os.listdir(inbox))
+    except OSError: return []
+    imported = []
+    for filename in names:
+        path = os.path.join(inbox, filename)
+        if not os.path.isfile(path): continue
+        try: imported.append(add_dataset(path, move=True)[0])
+        except (OSError, ValueError) as e: print(f"Dataset import of {filename} failed: {e}")
+    return imported
 
-        process = subprocess.Popen(
-            podman_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            text=False, startupinfo=startupinfo
-        )
-        
-        stdout_bytes, stderr_bytes = process.communicate(input=code_bytes)
-        stdout = strip_ansi_codes(stdout_bytes.decode('utf-8', errors='replace'))
-        stderr = strip_ansi_codes(stderr_bytes.decode('utf-8', errors='replace'))
-        
-        if process.returncode == 0:
-            files = [f for f in os.listdir(output_dir) if os.path.isfile(os.path.join(output_dir, f))]
-            downloads_dir = os.path.join(os.path.expanduser("~"), "Downloads")
-            safe_lang = re.sub(r'[^a-zA-Z0-9]', '_', lang) if lang else "custom"
+def evict_dataset(name):
+    """Drop a name, and its blob unless another name shares it; refuses while a run uses it."""
+    with DATASET_LOCK:
+        index = load_dataset_index()
+        entry = index.get(name)
+        if not entry: raise KeyError(name)
+        digest = entry['sha256']
+        if DATASET_USERS.get(digest): raise RuntimeError(f"Dataset {name} is mounted by a running snippet.")
+        del index[name]
+        save_dataset_index(index)
+        remove_orphan_blob(index, digest)
+    return entry
+
+def remove_orphan_blob(index, digest):
+    """Delete a blob no name refers to any more (caller holds DATASET_LOCK)."""
+    if not digest or DATASET_USERS.get(digest) or any(e['sha256'] == digest for e in index.values()): return
+    try: os.remove(os.path.join(dataset_paths()[1], digest))
+    except OSError: pass
+
+def mount_datasets(config):
+    """Add read-only /data mounts for the header's datasets and pin them until release_datasets()."""
+    names = [n.strip() for n in config['datasets'] if n.strip()]
+    import_dataset_inbox()
+    config = dict(config)
+    mounts = list(config.get('mounts', []))
+    with DATASET_LOCK: # Load and pin together, so an eviction cannot slip in between
+        index = load_dataset_index()
+        missing = [n for n in names if n not in index]
+        if missing: raise ValueError(f"Unknown dataset(s): {', '.join(missing)}. Add them to {dataset_paths()[2]}.")
+        for name in names:
+            entry = index[name]
+            mounts.append((os.path.join(dataset_paths()[1], entry['sha256']), f"/data/{entry['filename']}", 'ro'))
+            DATASET_USERS[entry['sha256']] = DATASET_USERS.get(entry['sha256'], 0) + 1
+    config['mounts'] = mounts
+    config['dataset_hashes'] = [index[name]['sha256'] for name in names]
+    return config
+
+def pin_datasets(config):
+    """Pin a config's mounted datasets once more, e.g. for as long as a session kernel mounts them."""
+    with DATASET_LOCK:
+        for digest in config.get('dataset_hashes', []):
+            DATASET_USERS[digest] = DATASET_USERS.get(digest, 0) + 1
+
+def release_datasets(config):
+    with DATASET_LOCK:
+        for digest in config.get('dataset_hashes', []):
+            DATASET_USERS[digest] -= 1
+
+def dataset_menu_items():
+    from pystray import MenuItem as item
+    import_dataset_inbox()
+    index = load_dataset_index()
+    items = [item(f"Evict {name} ({entry['filename']}, {entry['size'] / 1048576:.1f} MB)",
+                  lambda icon, _, name=name: evict_dataset_from_tray(icon, name)) for name, entry in sorted(index.items())]
+    if not items: items.append(item('No datasets', None, enabled=False))
+    items.append(item('Open Import Folder', open_dataset_inbox))
+    return tuple(items)
+
+def evict_dataset_from_tray(icon, name):
+    try:
+        entry = evict_dataset(name)
+        icon.notify(f"Dataset {name} evicted ({entry['size'] / 1048576:.1f} MB).", title="Ephemeral")
+    except Exception as e: icon.notify(f"Could not evict {name}: {e}", title="Ephemeral Error")
+
+def open_dataset_inbox(icon, item):
+    inbox = dataset_paths()[2]
+    os.makedirs(inbox, exist_ok=True)
+    try: os.startfile(inbox)
+    except Exception as e: icon.notify(f"Drop dataset files into {inbox} ({e})", title="Ephemeral")
+
+def datasets_main(argv):
+    parser = argparse.ArgumentParser(prog='ephemeral --datasets', description='Manage seed datasets.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list')
+    add = commands.add_parser('add')
+    add.add_argument('path')
+    add.add_argument('--name')
+    evict = commands.add_parser('evict')
+    evict.add_argument('name')
+    args = parser.parse_args(argv)
+    try:
+        if args.command == 'add':
+            name, entry = add_dataset(args.path, args.name)
+            print(f"{name}: {entry['filename']} ({entry['size']} bytes, sha256 {entry['sha256'][:12]})")
+        elif args.command == 'evict':
+            evict_dataset(args.name)
+            print(f"Evicted {args.name}")
+        else:
+            import_dataset_inbox()
+            for name, entry in sorted(load_dataset_index().items()):
+                print(f"{name:<24} /data/{entry['filename']:<32} {entry['size'] / 1048576:10.1f} MB  {entry['sha256'][:12]}")
+    except (OSError, ValueError, KeyError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+# --- Dependency Images ---
+# A 'deps=requests,rich' header runs the snippet in a derived image: the language's base image
+# plus one RUN of its 'deps_install' command. The image is tagged with a hash of the base image
+# id, the package list and the install command, so it is built once (with network access) and
+# reused by every later run, which still gets --network none. DEPS_INDEX_FILE records when each
+# one was last used; beyond DEPS_IMAGE_MAX the least recently used are removed.
+DEPS_IMAGE_REPO = 'localhost/ephemeral-deps'
+DEP_NAME = re.compile(r'^[A-Za-z0-9@][A-Za-z0-9._+\-=<>~!@/:\[\]]*$')
+DEPS_LOCK = threading.Lock()
+DEPS_BUILD_LOCKS = {} # tag -> lock, so concurrent runs wait for one build
+
+def load_deps_index():
+    try:
+        with open(DEPS_INDEX_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError): return {}
+
+def save_deps_index(index):
+    try:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with open(DEPS_INDEX_FILE + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=1)
+        os.replace(DEPS_INDEX_FILE + '.tmp', DEPS_INDEX_FILE)
+    except OSError as e: print(f"Dependency image index save failed: {e}")
+
+def deps_install_command(template, deps):
+    command = []
+    for part in template:
+        if part == '{deps}': command.extend(deps)
+        else: command.append(part.replace('{deps}', ', '.join(json.dumps(d) for d in deps)))
+    return command
+
+def dependency_image_tag(base_image, deps, command):
+    h = hashlib.sha256()
+    for part in (get_image_digest(base_image) or base_image, json.dumps(deps), json.dumps(command)):
+        h.update(part.encode('utf-8') + b'\0')
+    return f"{DEPS_IMAGE_REPO}:{h.hexdigest()[:16]}"
+
+def use_dependency_image(config):
+    """Point config at the derived image with its 'deps' installed, building it first if needed."""
+    deps = config['deps']
+    bad = [d for d in deps if not DEP_NAME.match(d)]
+    if bad: raise ValueError(f"Invalid package name(s) in deps=: {', '.join(bad)}")
+    if not config.get('deps_install'): raise ValueError("This language does not support deps= (no 'deps_install' command).")
+    command = deps_install_command(config['deps_install'], deps)
+    tag = dependency_image_tag(config['image'], deps, command)
+    with DEPS_LOCK:
+        lock = DEPS_BUILD_LOCKS.setdefault(tag, threading.Lock())
+    with lock:
+        if not image_present(tag): build_dependency_image(config['image'], tag, command)
+    with DEPS_LOCK:
+        index = load_deps_index()
+        entry = index.setdefault(tag, {'base': config['image'], 'deps': deps, 'created': time.time()})
+        entry['last_used'] = time.time()
+        save_deps_index(index)
+    return dict(config, image=tag)
+
+@traced('deps_build')
+def build_dependency_image(base_image, tag, command):
+    print(f"[Ephemeral] Building {tag}: {' '.join(command)}")
+    with tempfile.TemporaryDirectory(prefix='ephemeral-deps-') as context:
+        containerfile = os.path.join(context, 'Containerfile')
+        with open(containerfile, 'w', encoding='utf-8') as f:
+            f.write(f"FROM {base_image}\nRUN {json.dumps(command)}\n")
+        try:
+            process = subprocess.run(BACKEND.argv(['build', '--tag', tag, '--label', 'ephemeral.deps=1', '--file', containerfile, context]),
+                                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT, startupinfo=hidden_startupinfo(),
+                                     timeout=DEPS_BUILD_TIMEOUT)
+        except subprocess.TimeoutExpired: raise ValueError(f"Installing deps took over {DEPS_BUILD_TIMEOUT}s; gave up.")
+    invalidate_image_index()
+    if process.returncode != 0:
+        log = process.stdout.decode('utf-8', errors='replace').strip()[-2000:]
+        raise ValueError(f"Installing deps failed:\n{log}")
+    threading.Thread(target=gc_dependency_images, daemon=True).start()
+
+def gc_dependency_images(keep=None):
+    """Remove the least recently used dependency images beyond `keep` (DEPS_IMAGE_MAX); returns how many."""
+    keep = DEPS_IMAGE_MAX if keep is None else keep
+    with DEPS_LOCK:
+        index = load_deps_index()
+        ranked = sorted(index, key=lambda tag: index[tag].get('last_used', 0), reverse=True)
+        removed = 0
+        for tag in ranked[keep:]:
+            gone = True
+            for connection in CONNECTIONS or [None]: # Built on whichever connection needed it first
+                with bound_connection(connection):
+                    result = subprocess.run(BACKEND.argv(['rmi', tag]), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                            startupinfo=hidden_startupinfo())
+                message = result.stderr.decode('utf-8', errors='replace').lower()
+                # An image in use (e.g. by a warm container) stays listed and goes next time.
+                if result.returncode and 'image not known' not in message and 'no such image' not in message: gone = False
+            if gone:
+                del index[tag]
+                removed += 1
+        save_deps_index(index)
+    if removed:
+        for connection in CONNECTIONS or [None]:
+            with bound_connection(connection): invalidate_image_index()
+    return removed
+
+# --- Usage History & Prefetch ---
+# Every run records its language and exact image (version tag included). While the user is
+# idle and nothing is executing, the most used images are pulled or refreshed at idle
+# priority. Starting a run kills any in-flight prefetch, so snippets never queue behind one.
+USAGE_LOCK = threading.Lock()
+ACTIVE_RUNS = 0
+PREFETCH_PROCESSES = []
+PREFETCH_BUDGET = {'window_start': 0.0, 'bytes': 0}
+
+def load_usage_history():
+    try:
+        with open(USAGE_HISTORY_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except: return {}
+
+def save_usage_history(history):
+    try:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        tmp_path = USAGE_HISTORY_FILE + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(history, f, indent=1)
+        os.replace(tmp_path, USAGE_HISTORY_FILE)
+    except Exception as e: print(f"Usage history save failed: {e}")
+
+def record_usage(lang, image_name):
+    with USAGE_LOCK:
+        history = load_usage_history()
+        entry = history.setdefault(image_name, {'count': 0, 'langs': []})
+        entry['count'] += 1
+        entry['last'] = time.time()
+        if lang not in entry['langs']: entry['langs'].append(lang)
+        save_usage_history(history)
+
+def mark_run_started():
+    global ACTIVE_RUNS
+    record_machine_activity()
+    with USAGE_LOCK:
+        ACTIVE_RUNS += 1
+        cancelled = list(PREFETCH_PROCESSES)
+    # This only stops the `podman pull` clients: the Podman service may still finish a download
+    # it has started, so a prefetch can keep using bandwidth for a while after a run starts.
+    for process in cancelled:
+        try: process.terminate()
+        except: pass
+
+def mark_run_finished():
+    global ACTIVE_RUNS
+    MACHINE['last_activity'] = time.time()
+    with USAGE_LOCK:
+        ACTIVE_RUNS -= 1
+
+def user_idle_seconds():
+    """Seconds since the last keyboard/mouse input (Windows); elsewhere there is no portable signal,
+    so the user counts as idle and only the other prefetch gates (no active runs, budget) apply."""
+    if os.name != 'nt': return float('inf')
+    try:
+        class LASTINPUTINFO(ctypes.Structure):
+            _fields_ = [('cbSize', ctypes.c_uint), ('dwTime', ctypes.c_uint)]
+        info = LASTINPUTINFO()
+        info.cbSize = ctypes.sizeof(info)
+        if not ctypes.windll.user32.GetLastInputInfo(ctypes.byref(info)): return 0
+        return ((ctypes.windll.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF) / 1000.0
+    except: return 0
+
+def prefetch_budget_left():
+    with USAGE_LOCK:
+        if time.time() - PREFETCH_BUDGET['window_start'] > 3600:
+            PREFETCH_BUDGET['window_start'] = time.time()
+            PREFETCH_BUDGET['bytes'] = 0
+        return PREFETCH_BUDGET['bytes'] < PREFETCH_MAX_MB_PER_HOUR * 1024 * 1024
+
+def backend_ready():
+    """Whether the backend answered its last check; with several connections, the current one's health check."""
+    if CONNECTIONS: return bool(current_connection()['healthy'])
+    return bool(READINESS['ready'])
+
+def prefetch_allowed():
+    return (PREFETCH_ENABLED and ACTIVE_RUNS == 0 and backend_ready() and prefetch_budget_left()
+            and user_idle_seconds() >= PREFETCH_IDLE_SECONDS)
+
+def prefetch_candidates():
+    """Top-N images by use count, decayed by days since last use, that are missing or stale."""
+    now = time.time()
+    history = load_usage_history()
+    ranked = sorted(history.items(), reverse=True,
+                    key=lambda kv: kv[1]['count'] / (1 + (now - kv[1].get('last', 0)) / 86400))
+    candidates = []
+    for image_name, entry in ranked[:PREFETCH_TOP_N]:
+        stale = now - entry.get('refreshed', 0) > PREFETCH_REFRESH_HOURS * 3600
+        if stale or not image_present(image_name): candidates.append(image_name)
+    return candidates
+
+def get_image_size(image_name):
+    try:
+        out = subprocess.check_output(BACKEND.argv(['image', 'inspect', '--format', '{{.Size}}', image_name]),
+                                      stderr=subprocess.DEVNULL, startupinfo=hidden_startupinfo())
+        return int(out.decode('utf-8').strip() or 0)
+    except: return 0
+
+def prefetch_image(image_name):
+    if not prefetch_allowed(): return
+    before = lookup_image_id(image_name)
+    process = subprocess.Popen(BACKEND.argv(['pull', '--quiet', image_name]),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               startupinfo=hidden_startupinfo(), creationflags=getattr(subprocess, 'IDLE_PRIORITY_CLASS', 0))
+    with USAGE_LOCK:
+        PREFETCH_PROCESSES.append(process)
+        if ACTIVE_RUNS: process.terminate() # A run started while we were launching
+    try: exit_code = process.wait()
+    finally:
+        with USAGE_LOCK:
+            PREFETCH_PROCESSES.remove(process)
+    if exit_code != 0: return # Failed, or cancelled by a starting run; retried next pass
+    IMAGE_DIGESTS.pop((connection_name(), image_name), None)
+    invalidate_image_index()
+    if lookup_image_id(image_name) != before:
+        # Podman cannot throttle a pull, so bandwidth is capped as a byte budget per hour.
+        with USAGE_LOCK:
+            PREFETCH_BUDGET['bytes'] += get_image_size(image_name)
+    with USAGE_LOCK:
+        history = load_usage_history()
+        if image_name in history:
+            history[image_name]['refreshed'] = time.time()
+            save_usage_history(history)
+
+def prefetch_loop():
+    while PREFETCH_ENABLED:
+        time.sleep(PREFETCH_INTERVAL)
+        try:
+            if not prefetch_allowed(): continue
+            with ThreadPoolExecutor(max_workers=max(1, PREFETCH_CONCURRENCY)) as pool:
+                list(pool.map(prefetch_image, prefetch_candidates()))
+        except Exception as e: print(f"Prefetch pass failed: {e}")
+
+def start_prefetcher():
+    if PREFETCH_ENABLED:
+        threading.Thread(target=prefetch_loop, daemon=True).start()
+
+# --- Output Streaming ---
+ANSI_PARTIAL = re.compile(r'\x1B(?:\[[0-?]*[ -/]*)?\Z')
+
+class BoundedOutput:
+    """Decodes and ANSI-strips a stream chunk by chunk, keeping only its head and tail."""
+
+    def __init__(self, head_chars, tail_chars, live_sink=None):
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.live_sink = live_sink
+        self.pending = ''
+        self.head = []
+        self.head_len = 0
+        self.tail = ''
+        self.total = 0
+
+    def feed(self, data, final=False):
+        text = self.pending + self.decoder.decode(data, final=final)
+        self.pending = ''
+        if not final:
+            # Hold back an escape sequence split across chunks until it is complete.
+            idx = text.rfind('\x1b')
+            if idx != -1 and ANSI_PARTIAL.match(text, idx):
+                text, self.pending = text[:idx], text[idx:]
+        text = strip_ansi_codes(text)
+        if not text: return
+        if self.live_sink: self.live_sink(text)
+        self.total += len(text)
+        room = self.head_chars - self.head_len
+        if room > 0:
+            self.head.append(text[:room])
+            self.head_len += len(text[:room])
+            text = text[room:]
+        if text:
+            self.tail = (self.tail + text)[-self.tail_chars:] if self.tail_chars else ''
+
+    def getvalue(self):
+        head = ''.join(self.head)
+        dropped = self.total - len(head) - len(self.tail)
+        if dropped > 0:
+            return f"{head}\n\n[... Ephemeral truncated {dropped:,} characters ...]\n\n{self.tail}"
+        return head + self.tail
+
+def open_live_console(title):
+    """Mirror output into a console window tailing a log file; returns (sink, close)."""
+    fd, log_path = tempfile.mkstemp(suffix='.log')
+    log = os.fdopen(fd, 'w', encoding='utf-8')
+    lock = threading.Lock()
+    state = {'written': 0}
+    subprocess.Popen(f'start "Ephemeral Live: {title}" powershell -NoProfile -Command '
+                     f'"Get-Content -Path \'{log_path}\' -Wait"', shell=True)
+    def sink(text):
+        with lock:
+            if log.closed or state['written'] > LIVE_OUTPUT_MAX_MB * 1024 * 1024: return
+            log.write(text)
+            log.flush()
+            state['written'] += len(text)
+            if state['written'] > LIVE_OUTPUT_MAX_MB * 1024 * 1024:
+                log.write("\n[Ephemeral] Live output limit reached; the rest is only in the result.\n")
+                log.flush()
+    def close():
+        with lock:
+            log.write("\n[Ephemeral] Process finished.\n")
+            log.close()
+    return sink, close
+
+def feed_stdin(stream, data):
+    try: stream.write(data)
+    except OSError: pass # The snippet exited without reading all of its input
+    finally:
+        try: stream.close()
+        except OSError: pass
+
+def pump_stream(stream, output, on_chunk=None):
+    while True:
+        chunk = stream.read1(65536)
+        if not chunk: break
+        output.feed(chunk)
+        if on_chunk: on_chunk(len(chunk))
+    output.feed(b'', final=True)
+    stream.close()
+
+def stream_process(process, input_bytes, live_sink=None, timeout=None, max_output=None, kill=None):
+    """Replacement for communicate(): memory stays bounded however much the snippet prints.
+
+    Returns (stdout, stderr, limit_hit) where limit_hit is None, 'timeout' or 'output'.
+    """
+    stdout = BoundedOutput(OUTPUT_HEAD_KB * 1024, OUTPUT_TAIL_KB * 1024, live_sink)
+    stderr = BoundedOutput(OUTPUT_HEAD_KB * 1024, OUTPUT_TAIL_KB * 1024, live_sink)
+    lock = threading.Lock()
+    state = {'bytes': 0, 'limit': None}
+    kill = kill or process.kill
+
+    def trip(limit):
+        with lock:
+            if state['limit']: return
+            state['limit'] = limit
+        kill()
+
+    def count_output(size):
+        with lock:
+            state['bytes'] += size
+            exceeded = max_output and state['bytes'] > max_output
+        if exceeded: trip('output')
+
+    threads = [
+        threading.Thread(target=feed_stdin, args=(process.stdin, input_bytes), daemon=True),
+        threading.Thread(target=pump_stream, args=(process.stdout, stdout, count_output), daemon=True),
+        threading.Thread(target=pump_stream, args=(process.stderr, stderr, count_output), daemon=True),
+    ]
+    for t in threads: t.start()
+    try: process.wait(timeout=timeout or None)
+    except subprocess.TimeoutExpired:
+        trip('timeout')
+        process.wait()
+    for t in threads:
+        # After a kill, don't hang on pipes some orphaned process may still hold open.
+        t.join(timeout=10 if state['limit'] else None)
+    return stdout.getvalue(), stderr.getvalue(), state['limit']
+
+def diagnose_limit(limit_hit, returncode, stderr):
+    """Name the resource limit that most likely ended the run, or None."""
+    if limit_hit: return limit_hit
+    message = stderr.lower()
+    if returncode == 137: return 'memory'  # SIGKILL from the OOM killer
+    if 'resource temporarily unavailable' in message or "can't fork" in message: return 'pids'
+    if 'no space left on device' in message: return 'tmpfs'
+    return None
+
+def describe_limit(limit, limits):
+    return {
+        'timeout': f"Wall-clock timeout of {limits['timeout']:g}s reached; the container was killed.",
+        'output': f"Output limit of {limits['output']} reached; the container was killed.",
+        'memory': f"Memory limit of {limits['memory']} likely exceeded (exit 137, OOM killed).",
+        'pids': f"Process limit of {limits['pids']} pids likely exceeded (fork failed).",
+        'tmpfs': f"/tmp size limit of {limits['tmpfs']} likely exceeded (no space left on device).",
+        'artifacts': f"/output size limit of {limits['artifacts']} (or the disk's free space) reached; the container was killed.",
+    }[limit]
+
+def kill_container(name, connection=None):
+    try:
+        with bound_connection(connection): backend_call(['rm', '--force', '--time', '0', name], timeout=30)
+    except Exception as e: print(f"Failed to kill container {name}: {e}")
+
+def new_result(lang, limits, output_dir):
+    return {'lang': lang, 'returncode': None, 'stdout': '', 'stderr': '', 'limit': None,
+            'limits': limits, 'output_dir': output_dir, 'error': None, 'cancelled': False}
+
+# --- Artifacts ---
+# Output dirs live in ARTIFACT_STAGING_DIR, on the same volume as Downloads, so a single file
+# is handed over with a rename. Multiple files are zipped by an ArtifactStreamer while the
+# container is still writing, so the archive is mostly done when the run ends.
+def new_output_dir(mounted=True):
+    """A fresh host dir to mount as /output (the system temp dir if staging is unavailable or not needed)."""
+    if not mounted or not ARTIFACT_STAGING_DIR: return tempfile.mkdtemp(prefix='ephemeral-')
+    try:
+        if not os.path.isdir(ARTIFACT_STAGING_DIR):
+            os.makedirs(ARTIFACT_STAGING_DIR, exist_ok=True)
+            if os.name == 'nt': ctypes.windll.kernel32.SetFileAttributesW(ARTIFACT_STAGING_DIR, 0x02) # Hidden
+        return tempfile.mkdtemp(dir=ARTIFACT_STAGING_DIR)
+    except OSError:
+        return tempfile.mkdtemp()
+
+def move_artifact(source, target):
+    """Move to a free name based on `target` (rename when on the same volume); returns the final path."""
+    base, ext = os.path.splitext(target)
+    counter = 1
+    while os.path.exists(target):
+        target = f"{base}_{counter}{ext}"
+        counter += 1
+    try: os.replace(source, target)
+    except OSError: shutil.move(source, target) # Different volume: staging fell back to temp
+    return target
+
+def output_files(output_dir, recursive=False):
+    """{relative path: (size, mtime)} of the regular files in output_dir (top level only by default)."""
+    files = {}
+    for root, dirs, names in os.walk(output_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            try: stat = os.stat(path)
+            except OSError: continue
+            files[os.path.relpath(path, output_dir)] = (stat.st_size, stat.st_mtime)
+        if not recursive: break
+    return files
+
+class ArtifactStreamer:
+    """Zips /output files during the run and enforces the 'artifacts' size limit.
+
+    A file is zipped once its size and mtime held still for a poll interval. If it changes
+    after that, finish() rebuilds the zip from scratch.
+    """
+    def __init__(self, output_dir, max_bytes, on_limit):
+        self.output_dir = output_dir
+        self.max_bytes = max_bytes
+        self.on_limit = on_limit
+        self.zip_path = output_dir.rstrip('\\/') + '.zip' # Sibling in the staging dir
+        self.archive = None
+        self.zipped = {}
+        self.seen = {}
+        self.limit_hit = False
+        # What this run may write before the disk gets within ARTIFACT_MIN_FREE_MB of full
+        try: self.disk_budget = max(0, shutil.disk_usage(output_dir).free - ARTIFACT_MIN_FREE_MB * 1024 * 1024)
+        except OSError: self.disk_budget = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.poll_loop, daemon=True)
+        self.thread.start()
+
+    def poll_loop(self):
+        while not self.stopped.wait(ARTIFACT_POLL_SECONDS):
+            self.poll()
+
+    def over_limit(self):
+        """True once the bytes this run wrote to /output exceed the size limit or the disk budget."""
+        written = sum(size for size, _ in output_files(self.output_dir, recursive=True).values())
+        if not written: return False # A run that writes nothing is never killed, however full the disk
+        if self.max_bytes and written > self.max_bytes: return True
+        return self.disk_budget is not None and written > self.disk_budget
+
+    def poll(self, final=False):
+        if self.limit_hit: return
+        if not final and self.over_limit():
+            self.limit_hit = True
+            self.on_limit()
+            return
+        if len(output_files(self.output_dir)) < 2: return # A lone file is renamed, not zipped
+        files = output_files(self.output_dir, recursive=True)
+        settled = files if final else {name: stat for name, stat in files.items() if self.seen.get(name) == stat}
+        self.seen = files
+        try:
+            for name in sorted(settled):
+                if name in self.zipped: continue
+                if self.archive is None: self.archive = zipfile.ZipFile(self.zip_path, 'w', zipfile.ZIP_DEFLATED)
+                self.archive.write(os.path.join(self.output_dir, name), name.replace(os.sep, '/'))
+                self.zipped[name] = settled[name]
+        except OSError as e: print(f"Artifact streaming failed: {e}")
+
+    def discard(self):
+        if self.archive: self.archive.close()
+        self.archive, self.zipped = None, {}
+        try: os.remove(self.zip_path)
+        except OSError: pass
+
+    def finish(self):
+        """Stop polling; returns the completed zip path, or None (fewer than 2 files, or limit hit)."""
+        self.stopped.set()
+        self.thread.join()
+        if self.limit_hit or len(output_files(self.output_dir)) < 2:
+            self.discard()
+            return None
+        files = output_files(self.output_dir, recursive=True)
+        if any(files.get(name) != stat for name, stat in self.zipped.items()):
+            self.discard() # Zipped too early; start over now that the run is done
+        self.poll(final=True)
+        if not self.archive: return None # Opening the zip failed in poll()
+        self.archive.close()
+        self.archive = None
+        return self.zip_path
+
+# --- Session Kernels ---
+# The `session` header flag sends a snippet to a long-lived interpreter container that keeps
+# its state between runs. Each kernel runs a small driver that reads length-framed snippets
+# from stdin and ends each one with a random marker on stdout and stderr, so the host knows
+# where one run's output stops. Kernels are reaped after SESSION_IDLE_TIMEOUT.
+# SESSION_SHIM moves the framing pipe to fd 3 and gives the snippets /dev/null as stdin, so
+# input() or readline() in a snippet sees end-of-file instead of eating the next frame.
+SESSION_SHIM = ['sh', '-c', 'exec 3<&0 </dev/null; exec "$@"', 'sh']
+SESSION_DRIVERS = {
+    'python': {'cmd': ['python', '-u', '-c'], 'driver': r'''
+import os, sys, traceback
+proto = os.fdopen(3, 'rb')
+ns = {'__name__': '__main__'}
+while True:
+    line = proto.readline()
+    if not line: break
+    code = proto.read(int(line)).decode('utf-8')
+    status = 0
+    try: exec(compile(code, '<snippet>', 'exec'), ns)
+    except SystemExit as e: status = e.code if isinstance(e.code, int) else 1
+    except BaseException: traceback.print_exc(); status = 1
+    sys.stdout.flush()
+    sys.stderr.write('\n__MARKER__\n'); sys.stderr.flush()
+    sys.stdout.write('\n__MARKER__ %d\n' % status); sys.stdout.flush()
+'''},
+    'r': {'cmd': ['Rscript', '-e'], 'driver': r'''
+con <- file("/dev/fd/3", "rb")
+repeat {
+  n <- readLines(con, n = 1)
+  if (length(n) == 0) break
+  code <- rawToChar(readBin(con, "raw", as.integer(n)))
+  status <- tryCatch({
+    for (e in parse(text = code)) { r <- withVisible(eval(e, .GlobalEnv)); if (r$visible) print(r$value) }
+    0
+  }, error = function(e) { message("Error: ", conditionMessage(e)); 1 })
+  flush(stdout())
+  cat("\n__MARKER__\n", file = stderr())
+  cat("\n__MARKER__ ", status, "\n", sep = "")
+  flush(stdout())
+}
+'''},
+    'julia': {'cmd': ['julia', '-e'], 'driver': r'''
+proto = open("/dev/fd/3")
+while !eof(proto)
+    n = parse(Int, readline(proto))
+    code = String(read(proto, n))
+    status = 0
+    try
+        include_string(Main, code, "snippet")
+    catch e
+        showerror(stderr, e, catch_backtrace()); status = 1
+    end
+    flush(stdout)
+    print(stderr, "\n__MARKER__\n"); flush(stderr)
+    print(stdout, "\n__MARKER__ ", status, "\n"); flush(stdout)
+end
+'''},
+    'octave': {'cmd': ['octave', '--no-gui', '--quiet', '--eval'], 'driver': r'''
+proto = fopen('/dev/fd/3', 'r');
+while true
+  n = fgetl(proto);
+  if ~ischar(n), break; end
+  code = char(fread(proto, str2double(n), 'uint8=>char')');
+  status = 0;
+  try
+    eval(code);
+  catch err
+    fprintf(stderr, 'error: %s\n', err.message); status = 1;
+  end
+  fflush(stdout);
+  fprintf(stderr, '\n__MARKER__\n'); fflush(stderr);
+  fprintf(stdout, '\n__MARKER__ %d\n', status); fflush(stdout);
+end
+'''},
+}
+KERNELS = {}  # (driver, image, run flags) -> kernel
+KERNEL_LOCK = threading.Lock()
+KERNEL_REAPER = None
+
+def session_key(config):
+    return (config['session'], config['image'], tuple(container_run_flags(config)), tuple(config.get('mounts', [])))
+
+def start_kernel(config):
+    driver = SESSION_DRIVERS[config['session']]
+    marker = f"EPHEMERAL-{uuid.uuid4().hex}"
+    name = f"ephemeral-session-{uuid.uuid4().hex[:12]}"
+    output_dir = new_output_dir()
+    cmd = SESSION_SHIM + driver['cmd'] + [driver['driver'].replace('__MARKER__', marker)]
+    podman_cmd = ['run', '--rm', '-i', '--pull=never', '--name', name] + container_run_flags(config)
+    podman_cmd.extend(['-v', f'{output_dir}:/output'])
+    for host_path, container_path, mode in config.get('mounts', []):
+        podman_cmd.extend(['-v', f'{host_path}:{container_path}:{mode}'])
+    podman_cmd.extend(['--entrypoint', cmd[0], config['image']] + cmd[1:])
+    podman_cmd = BACKEND.argv(podman_cmd)
+    process = BACKEND.popen(podman_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, startupinfo=hidden_startupinfo())
+    kernel = {'name': name, 'process': process, 'output_dir': output_dir, 'lang': config['session'],
+              'stdout': queue.Queue(), 'stderr': queue.Queue(), 'lock': threading.Lock(),
+              'last_used': time.time(), 'runs': 0,
+              'stdout_end': re.compile(re.escape(b'\n' + marker.encode()) + rb' (-?\d+)\n'),
+              'stderr_end': re.compile(re.escape(b'\n' + marker.encode()) + rb'\n'),
+              'marker_len': len(marker) + 16, 'dataset_hashes': list(config.get('dataset_hashes', []))}
+    pin_datasets(kernel) # Its /data mounts outlive the run that started it
+    for stream, chunks in ((process.stdout, kernel['stdout']), (process.stderr, kernel['stderr'])):
+        threading.Thread(target=read_kernel_stream, args=(stream, chunks), daemon=True).start()
+    return kernel
+
+def read_kernel_stream(stream, chunks):
+    while True:
+        data = stream.read1(65536)
+        chunks.put(data)
+        if not data: break
+
+def stop_kernel(kernel):
+    with KERNEL_LOCK:
+        for key, candidate in list(KERNELS.items()):
+            if candidate is kernel: del KERNELS[key]
+    kill_container(kernel['name'])
+    try: kernel['process'].kill()
+    except: pass
+    remove_output_dir(kernel['output_dir'])
+    release_datasets({'dataset_hashes': kernel.pop('dataset_hashes', [])}) # Once, however often it is stopped
+
+def collect_kernel_stream(kernel, which, output, deadline, count_output):
+    """Feed a kernel stream into output until its end marker; returns the match, 'eof' or 'timeout'."""
+    chunks, terminator, keep = kernel[which], kernel[f'{which}_end'], kernel['marker_len']
+    window = b''
+    while True:
+        remaining = deadline - time.monotonic() if deadline else None
+        if remaining is not None and remaining <= 0: return 'timeout'
+        try: data = chunks.get(timeout=remaining)
+        except queue.Empty: return 'timeout'
+        if not data:
+            output.feed(window, final=True)
+            return 'eof'
+        if count_output(len(data)): return 'output'
+        window += data
+        match = terminator.search(window)
+        if match:
+            output.feed(window[:match.start()], final=True)
+            return match
+        if len(window) > keep:
+            # Hold back a tail long enough to contain a split marker.
+            output.feed(window[:-keep])
+            window = window[-keep:]
+
+@traced('session')
+def execute_in_session(config, code, lang, job=None):
+    limits = config.get('limits') or DEFAULT_LIMITS
+    result = new_result(lang, limits, new_output_dir())
+    key = session_key(config)
+    with KERNEL_LOCK:
+        kernel = KERNELS.get(key)
+        if kernel is None or kernel['process'].poll() is not None:
+            kernel = KERNELS[key] = start_kernel(config)
+    start_kernel_reaper()
+    cancel = lambda: stop_kernel(kernel)
+    with kernel['lock']:
+        if job and job['cancelled']:
+            result['cancelled'] = True
+            return result
+        if job: job['kills'].add(cancel)
+        try:
+            code_bytes = normalize_code(code)
+            kernel['process'].stdin.write(f"{len(code_bytes)}\n".encode('utf-8') + code_bytes)
+            kernel['process'].stdin.flush()
+            stdout = BoundedOutput(OUTPUT_HEAD_KB * 1024, OUTPUT_TAIL_KB * 1024)
+            stderr = BoundedOutput(OUTPUT_HEAD_KB * 1024, OUTPUT_TAIL_KB * 1024)
+            deadline = time.monotonic() + limits['timeout'] if limits['timeout'] else None
+            max_output = parse_size(limits['output'])
+            counted = {'bytes': 0}
+            count_lock = threading.Lock() # Both stream readers count into the same total
+            def count_output(size):
+                with count_lock:
+                    counted['bytes'] += size
+                    return bool(max_output and counted['bytes'] > max_output)
+            stderr_end = {}
+            err_thread = threading.Thread(daemon=True, target=lambda: stderr_end.update(
+                end=collect_kernel_stream(kernel, 'stderr', stderr, deadline, count_output)))
+            err_thread.start()
+            stdout_end = collect_kernel_stream(kernel, 'stdout', stdout, deadline, count_output)
+            err_thread.join(timeout=10)
+            ends = (stdout_end, stderr_end.get('end', 'timeout'))
+            result.update(stdout=stdout.getvalue(), stderr=stderr.getvalue())
+            if isinstance(stdout_end, re.Match) and isinstance(ends[1], re.Match):
+                result['returncode'] = int(stdout_end.group(1))
+            else:
+                # The kernel is unusable (killed, limit hit, or out of sync): drop it and its state.
+                stop_kernel(kernel)
+                result['returncode'] = kernel['process'].poll()
+                result['limit'] = next((e for e in ends if e in ('timeout', 'output')), None)
+                result['cancelled'] = bool(job and job['cancelled'])
+                if not result['limit'] and not result['cancelled']:
+                    result['limit'] = diagnose_limit(None, result['returncode'], result['stderr'])
+                    result['stderr'] += "\n[Ephemeral] Session kernel exited; its state was lost."
+            # Hand this run's /output files to the result, leaving the kernel's dir empty.
+            for name in os.listdir(kernel['output_dir']):
+                shutil.move(os.path.join(kernel['output_dir'], name), os.path.join(result['output_dir'], name))
+        except Exception as e:
+            result['error'] = str(e)
+            stop_kernel(kernel)
+        finally:
+            if job: job['kills'].discard(cancel)
+            kernel['last_used'] = time.time()
+            kernel['runs'] += 1
+    return result
+
+def reap_idle_kernels():
+    while True:
+        time.sleep(30)
+        cutoff = time.time() - SESSION_IDLE_TIMEOUT
+        with KERNEL_LOCK:
+            idle = [k for k in KERNELS.values() if k['last_used'] < cutoff and not k['lock'].locked()]
+        for kernel in idle:
+            stop_kernel(kernel)
+
+def start_kernel_reaper():
+    global KERNEL_REAPER
+    with KERNEL_LOCK:
+        if KERNEL_REAPER is not None: return
+        KERNEL_REAPER = threading.Thread(target=reap_idle_kernels, daemon=True)
+    KERNEL_REAPER.start()
+
+def shutdown_sessions():
+    with KERNEL_LOCK:
+        kernels = list(KERNELS.values())
+    for kernel in kernels:
+        stop_kernel(kernel)
+    return len(kernels)
+
+def stop_sessions(icon, item):
+    count = shutdown_sessions()
+    icon.notify(f"Stopped {count} session kernel(s)." if count else "No session kernels running.", title="Ephemeral")
+
+def execute_container(config, code, lang, job=None):
+    """Run one snippet and return a result dict; the caller delivers it, then calls release_result().
+
+    When a scheduler job is given, the running container's kill callback is registered in its
+    'kills' set so the tray can cancel it.
+    """
+    try:
+        if config.get('deps'): config = use_dependency_image(config)
+        if config.get('datasets'): config = mount_datasets(config)
+    except ValueError as e:
+        result = new_result(lang, config.get('limits') or DEFAULT_LIMITS, new_output_dir(mounted=False))
+        result['error'] = str(e)
+        return result
+    try: return run_in_container(config, code, lang, job)
+    finally: release_datasets(config)
+
+def run_in_container(config, code, lang, job=None):
+    if 'session' in config.get('flags', ()):
+        if config.get('session') in SESSION_DRIVERS: return execute_in_session(config, code, lang, job)
+        print(f"No session kernel for {lang}; running one-shot.")
+    code_bytes = normalize_code(code)
+    cache_key = result_cache_key(config, code_bytes)
+    if cache_key:
+        result = new_result(lang, config.get('limits') or DEFAULT_LIMITS, new_output_dir(mounted=False))
+        if load_cached_result(cache_key, result): return result
+        remove_output_dir(result['output_dir'])
+    config = prepare_compile_cache(config, code_bytes)
+    warm = acquire_warm_container(config)
+    output_dir = warm['output_dir'] if warm else new_output_dir()
+    limits = config.get('limits') or DEFAULT_LIMITS
+    result = new_result(lang, limits, output_dir)
+    live_close = None
+    running = {}
+    kill_run = lambda: running['kill']() if 'kill' in running else None
+    streamer = ArtifactStreamer(output_dir, parse_size(limits['artifacts']), kill_run)
+    try:
+        startupinfo = hidden_startupinfo()
+        live_sink = None
+        if LIVE_OUTPUT or 'live' in config.get('flags', ()):
+            live_sink, live_close = open_live_console(lang)
+
+        repulled = False
+        while True:
+            if job and job['cancelled']:
+                result['cancelled'] = True
+                return result
+            container_name = warm['id'] if warm else f"ephemeral-{uuid.uuid4().hex[:12]}"
+            podman_cmd = build_exec_command(config, warm) if warm else build_run_command(config, output_dir, container_name)
+            with trace_phase('run_warm' if warm else 'run_cold'):
+                process = BACKEND.popen(
+                    podman_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    startupinfo=startupinfo
+                )
+                # Killing the podman client would leave the container running; remove the container itself.
+                kill = lambda name=container_name, proc=process, conn=current_connection(): (kill_container(name, conn), proc.kill())
+                running['kill'] = kill
+                if job: job['kills'].add(kill)
+                stdout, stderr, limit_hit = stream_process(
+                    process, code_bytes, live_sink, timeout=limits['timeout'],
+                    max_output=parse_size(limits['output']), kill=kill
+                )
+            if job: job['kills'].discard(kill)
+            if warm and is_stale_warm_failure(process.returncode, stderr):
+                # The warm container died underneath us (e.g. machine restart): fall back to a cold run.
+                discard_warm_container(warm)
+                warm = None
+                streamer.finish()
+                output_dir = result['output_dir'] = new_output_dir()
+                streamer = ArtifactStreamer(output_dir, parse_size(limits['artifacts']), kill_run)
+                continue
+            if not repulled and is_missing_image_failure(process.returncode, stderr):
+                # The image index was stale (image removed outside Ephemeral): verify for real and re-pull.
+                repulled = True
+                invalidate_image_index()
+                if check_image_exists(config['image']) or perform_visible_pull(config['image']) == 0:
+                    continue
+            break
+
+        with trace_phase('artifacts'):
+            result['artifact_zip'] = streamer.finish()
+        result.update(returncode=process.returncode, stdout=stdout, stderr=stderr,
+                      limit='artifacts' if streamer.limit_hit else diagnose_limit(limit_hit, process.returncode, stderr),
+                      cancelled=bool(job and job['cancelled']))
+        if cache_key and process.returncode == 0 and not result['limit'] and not result['cancelled']:
+            store_cached_result(cache_key, result)
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        if live_close: live_close()
+        if not streamer.stopped.is_set():
+            streamer.finish()
+            streamer.discard()
+        if warm:
+            # The container goes now; its /output dir lives on with the result until delivered.
+            threading.Thread(target=kill_container, args=(warm['id'], warm.get('connection')), daemon=True).start()
+        finalize_compile_cache(config)
+        recycle_warm_pool(config)
+    return result
+
+def release_result(result):
+    remove_output_dir(result['output_dir'])
+    if result.get('artifact_zip') and os.path.exists(result['artifact_zip']):
+        os.remove(result['artifact_zip'])
+
+@traced('deliver')
+def deliver_result(icon, result):
+    """Hand a finished run to the user: clipboard, Downloads, or the post-mortem window."""
+    import pyperclip
+    lang = result['lang']
+    output_dir = result['output_dir']
+    stdout, stderr, limit = result['stdout'], result['stderr'], result['limit']
+    annotate_trace(cached=bool(result.get('cached')), status=
+                   'error' if result['error'] else 'cancelled' if result['cancelled'] else
+                   'limit' if limit else 'ok' if result['returncode'] == 0 else 'failed')
+    try:
+        if result['error']:
+            show_post_mortem_error(f"System Exception:\n{result['error']}")
+            icon.notify("Critical System Error", title="Ephemeral Failed")
+        elif result['cancelled']:
+            icon.notify(f"{lang.split()[0] if lang else 'Job'} run cancelled.", title="Ephemeral")
+        elif result['returncode'] == 0 and not limit:
+            files = sorted(output_files(output_dir))
+            downloads_dir = DOWNLOADS_DIR
+            safe_lang = UNSAFE_FILENAME_CHARS.sub('_', lang) if lang else "custom"
 
             if len(files) == 0:
-                result = stdout
                 title_lang = lang.split()[0].capitalize() if lang else "Custom"
-                pyperclip.copy(f"Result ({title_lang}):\n---\n```text\n{result.strip()}\n```")
-                icon.notify(f"{title_lang} execution results copied to clipboard.", title="Ephemeral")
+                pyperclip.copy(f"Result ({title_lang}):\n---\n```text\n{stdout.strip()}\n```")
+                cached = " (cached)" if result.get('cached') else ""
+                icon.notify(f"{title_lang} execution results copied to clipboard{cached}.", title="Ephemeral")
             
             elif len(files) == 1:
                 filename = files[0]
                 filepath = os.path.join(output_dir, filename)
                 
                 if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')):
-                    if copy_image_to_clipboard(filepath):
-                        icon.notify("Image generated and copied to clipboard!", title="Ephemeral")
+                    image_stats = copy_image_to_clipboard(filepath)
+                    if image_stats:
+                        scaled = image_stats['size'] != image_stats['original']
+                        note = f" (downscaled to {image_stats['size'][0]}x{image_stats['size'][1]})" if scaled else ""
+                        icon.notify(f"Image generated and copied to clipboard{note}!", title="Ephemeral")
                     else:
                         icon.notify("Failed to copy image. Check debug.", title="Ephemeral Error")
                 else:
                     target_name = f"Ephemeral_{safe_lang}_{filename}"
-                    target_path = os.path.join(downloads_dir, target_name)
-                    
-                    base, ext = os.path.splitext(target_path)
-                    counter = 1
-                    while os.path.exists(target_path):
-                        target_path = f"{base}_{counter}{ext}"
-                        counter += 1
-                    
-                    shutil.move(filepath, target_path)
+                    target_path = move_artifact(filepath, os.path.join(downloads_dir, target_name))
                     icon.notify(f"File saved to Downloads:\n{os.path.basename(target_path)}", title="Ephemeral")
 
             else:
                 timestamp = int(time.time())
                 zip_base_name = f"Ephemeral_{safe_lang}_Artifacts_{timestamp}"
-                zip_base_path = os.path.join(downloads_dir, zip_base_name)
-                final_zip = shutil.make_archive(zip_base_path, 'zip', output_dir)
+                staged_zip = result.get('artifact_zip')
+                if not staged_zip or not os.path.exists(staged_zip):
+                    # Not streamed (cached or session result): archive next to the output dir.
+                    staged_zip = shutil.make_archive(output_dir.rstrip('\\/') + '_artifacts', 'zip', output_dir)
+                    result['artifact_zip'] = staged_zip
+                final_zip = move_artifact(staged_zip, os.path.join(downloads_dir, zip_base_name + '.zip'))
                 icon.notify(f"Artifacts zipped to Downloads:\n{os.path.basename(final_zip)}", title="Ephemeral")
         else:
-            full_error = f"Exit Code: {process.returncode}\n\nSTDERR:\n{stderr}\n\nSTDOUT:\n{stdout}"
+            full_error = f"Exit Code: {result['returncode']}\n\nSTDERR:\n{stderr}\n\nSTDOUT:\n{stdout}"
+            if limit: full_error = f"LIMIT HIT: {describe_limit(limit, result['limits'])}\n\n{full_error}"
             show_post_mortem_error(full_error)
-            icon.notify("Execution Failed. Debug window opened.", title="Ephemeral Error")
+            if limit: icon.notify(f"Execution stopped: {limit} limit hit. Debug window opened.", title="Ephemeral Error")
+            else: icon.notify("Execution Failed. Debug window opened.", title="Ephemeral Error")
     except Exception as e:
         show_post_mortem_error(f"System Exception:\n{str(e)}")
         icon.notify("Critical System Error", title="Ephemeral Failed")
-    finally:
-        try:
-            for f in os.listdir(output_dir):
-                os.remove(os.path.join(output_dir, f))
-            os.rmdir(output_dir)
-        except: pass
 
-def run_logic(icon):
+def run_container_piped(icon, config, code, lang, job=None):
+    result = execute_container(config, code, lang, job)
+    try:
+        if job: deliver_in_order(job, lambda: deliver_result(icon, result))
+        else: deliver_result(icon, result)
+    finally: release_result(result)
+
+def run_logic(icon, content=None, job=None):
     global LAST_DETECTED_LANG
-    content = get_clipboard()
-    if re.search(r"^Result \(.*\):[\r\n]+---[\r\n]+", content.strip(), re.MULTILINE):
+    if content is None: content = get_clipboard()
+    if PREVIOUS_RESULT.search(content.strip()):
         icon.notify("Clipboard contains previous results. Execution halted.", title="Ephemeral Safety")
+        annotate_trace(status='skipped')
         return
-    lang, code = parse_codeblock(content)
+    blocks = parse_codeblocks(content)
+    runnable = [block for block in blocks if runnable_header(block[0])]
+    if len(runnable) > 1:
+        run_notebook(icon, blocks, job)
+        return
+    # One code block among prose fences (```text output, ```json samples...) runs on its own.
+    lang, code = runnable[0] if runnable and len(blocks) > 1 else parse_codeblock(content)
     if not lang:
         if content and content.strip():
             code = strip_shebang(content)
-            code = re.sub(r"```+\s*$", "", code.rstrip())
+            code = TRAILING_FENCE.sub("", code.rstrip())
             user_input = prompt_user_for_language(LAST_DETECTED_LANG, code)
             if user_input: lang = user_input.strip() 
             else:
                 icon.notify("Execution cancelled.", title="Ephemeral")
+                annotate_trace(status='skipped')
                 return
         else:
              icon.notify("Clipboard is empty.", title="Ephemeral Error")
+             annotate_trace(status='skipped')
              return
     LAST_DETECTED_LANG = lang.split()[0]
     config = resolve_runtime_config(lang)
     if not config or not config.get('image'):
         icon.notify("Configuration failed. Could not resolve image.", title="Ephemeral Error")
+        annotate_trace(status='error')
         return
+    if job: job['label'] = LAST_DETECTED_LANG
     icon.notify(f"Launching {LAST_DETECTED_LANG}...", title="Ephemeral Status")
+    record_usage(LAST_DETECTED_LANG, config['image'])
+    with routed_run([config['image']], pinned='session' in config['flags']):
+        run_on_connection(icon, config, code, lang, job)
+
+def run_on_connection(icon, config, code, lang, job=None):
+    """Wait for the connection the run was routed to, pull the image there if needed, then run."""
     image_name = config['image']
-    is_cached = check_image_exists(image_name)
+    if not wait_for_podman(icon):
+        icon.notify(f"{BACKEND.name} is not available. Execution halted.", title="Ephemeral Error")
+        annotate_trace(status='error')
+        return
+    is_cached = image_present(image_name)
     if not is_cached:
         exit_code = perform_visible_pull(image_name)
         if exit_code != 0:
+            invalidate_podman_status() # A dead machine also looks like a failed pull
             icon.notify("Image download failed.", title="Ephemeral Error")
+            annotate_trace(status='error')
+            return
+    run_container_piped(icon, config, code, lang, job)
+
+# --- Notebook (Multi-Block) Execution ---
+# Every fenced block runs in its own container. Blocks run in parallel (NOTEBOOK_WORKERS at a
+# time) unless they declare an ordering with `id=name` and `after=name[,name]` (or a 1-based
+# block number); a block whose dependency failed is skipped. Fences in a language Ephemeral
+# does not know (text, json, yaml...) and without image= are prose: they are skipped without
+# pulling anything and do not make the notebook fail. A notebook run as a scheduler job owns
+# its job's container slot; every further block running beside it borrows an idle one
+# (borrow_run_slot), so WORKER_COUNT still bounds the containers running at once.
+NOTEBOOK_WORKERS = 4
+
+def runnable_header(header):
+    """Whether a block header names something to run: a known language, or any language with image=."""
+    config = resolve_runtime_config(header) if header else None
+    return bool(config and config.get('image') and not config.get('unknown_lang'))
+
+def notebook_ok(records):
+    return all(r['status'] == 'ok' or r.get('prose') for r in records)
+
+def block_dependencies(record, block_ids, block_count):
+    """Indexes of the blocks this one must wait for, or None if one is unknown."""
+    deps = []
+    for name in (record['config'] or {}).get('overrides', {}).get('after', '').split(','):
+        name = name.strip()
+        if not name: continue
+        if name in block_ids: deps.append(block_ids[name])
+        elif name.isdigit() and 1 <= int(name) <= block_count: deps.append(int(name) - 1)
+        else: return None
+    return deps
+
+def run_block(block, job=None, trace=None, connection=None):
+    use_trace(trace)
+    CONNECTION_LOCAL.connection = connection
+    start = time.perf_counter()
+    result = execute_container(block['config'], block['code'], block['header'], job)
+    block['seconds'] = time.perf_counter() - start
+    block['result'] = result
+    if result['error']: block['status'], block['note'] = 'failed', result['error']
+    elif result['cancelled']: block['status'] = 'cancelled'
+    elif result['returncode'] == 0 and not result['limit']: block['status'] = 'ok'
+    else: block['status'] = 'failed'
+    if result['limit']: block['note'] = describe_limit(result['limit'], result['limits'])
+    return block
+
+def execute_notebook(blocks, job=None, pull=None):
+    """Run parsed (header, code) blocks; returns block records in their original order."""
+    records = []
+    for index, (header, code) in enumerate(blocks):
+        config = resolve_runtime_config(header) if header else None
+        record = {'index': index, 'header': header or '', 'code': code, 'config': config,
+                  'status': 'pending', 'seconds': 0.0, 'result': None, 'note': ''}
+        if not header: record.update(status='skipped', prose=True, note='No language in block header.')
+        elif config and config.get('unknown_lang'):
+            record.update(config=None, status='skipped', prose=True,
+                          note=f"Unknown language '{header.split()[0]}'; add image= to run it.")
+        elif not config or not config.get('image'): record.update(status='skipped', note='Could not resolve image.')
+        records.append(record)
+    block_ids = {r['config']['overrides']['id']: r['index'] for r in records
+                 if r['config'] and 'id' in r['config']['overrides']}
+
+    # Pulls open console windows, so do them one at a time before anything runs.
+    for image_name in dict.fromkeys(r['config']['image'] for r in records if r['status'] == 'pending'):
+        if image_present(image_name): continue
+        if not pull or pull(image_name) != 0:
+            for r in records:
+                if r['status'] == 'pending' and r['config']['image'] == image_name:
+                    r.update(status='skipped', note=f'Image {image_name} unavailable.')
+
+    pending = {r['index']: r for r in records if r['status'] == 'pending'}
+    running, borrowed = {}, set()
+    connection = current_connection()
+    with ThreadPoolExecutor(max_workers=max(1, NOTEBOOK_WORKERS)) as pool:
+        while pending or running:
+            for index, record in list(pending.items()):
+                deps = block_dependencies(record, block_ids, len(records))
+                if job and job['cancelled']:
+                    record['status'] = 'cancelled'
+                elif deps is None or index in deps:
+                    record.update(status='skipped', note='Unknown dependency in after=.')
+                elif any(records[d]['status'] in ('failed', 'skipped', 'cancelled') for d in deps):
+                    record.update(status='skipped', note='A dependency did not succeed.')
+                elif all(records[d]['status'] == 'ok' for d in deps):
+                    extra = bool(running and job)
+                    if extra and not borrow_run_slot(connection): continue # Wait for a block to finish
+                    future = pool.submit(run_block, record, job, current_trace(), connection)
+                    running[future] = index
+                    if extra: borrowed.add(future)
+                else: continue
+                del pending[index]
+            if not running:
+                for record in pending.values():
+                    record.update(status='skipped', note='Circular dependency in after=.')
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                del running[future]
+                if future in borrowed:
+                    borrowed.discard(future)
+                    return_run_slot(connection)
+                future.result()
+    return records
+
+def render_notebook_result(records, wall_seconds):
+    parts = ["Result (Notebook):", "---"]
+    for record in records:
+        result = record['result']
+        lang = record['header'].split()[0] if record['header'] else 'unknown'
+        exit_text = f"exit {result['returncode']}" if result and result['returncode'] is not None else "no exit"
+        parts.append(f"### Block {record['index'] + 1}: {lang} | {record['status']} | {exit_text} | {record['seconds']:.2f}s")
+        if record['note']: parts.append(f"> {record['note']}")
+        if result and record['status'] == 'ok':
+            body = result['stdout'].strip()
+        elif result:
+            streams = (('STDERR', result['stderr'].strip()), ('STDOUT', result['stdout'].strip()))
+            body = '\n\n'.join(f"{name}:\n{text}" for name, text in streams if text)
+        else: body = ''
+        parts.append(f"```text\n{body}\n```")
+    ok = sum(1 for r in records if r['status'] == 'ok')
+    prose = sum(1 for r in records if r.get('prose'))
+    parts.append("---")
+    parts.append(f"{len(records)} blocks: {ok} ok, {len(records) - ok - prose} not ok, {prose} skipped as prose, "
+                 f"{wall_seconds:.2f}s wall time")
+    return '\n'.join(parts)
+
+@traced('artifacts')
+def collect_notebook_artifacts(records, dest_dir=None):
+    """Zip every block's /output files into one archive (Downloads by default); returns its path or None."""
+    entries = []
+    for record in records:
+        output_dir = record['result']['output_dir'] if record['result'] else None
+        if not output_dir or not os.path.isdir(output_dir): continue
+        for name in os.listdir(output_dir):
+            path = os.path.join(output_dir, name)
+            if os.path.isfile(path): entries.append((path, f"block_{record['index'] + 1}/{name}"))
+    if not entries: return None
+    dest_dir = dest_dir or DOWNLOADS_DIR
+    zip_path = os.path.join(dest_dir, f"Ephemeral_Notebook_Artifacts_{int(time.time())}.zip")
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for path, arcname in entries:
+            archive.write(path, arcname)
+    return zip_path
+
+def run_notebook(icon, blocks, job=None):
+    if job: job['label'] = f"notebook ({len(blocks)} blocks)"
+    configs = [c for c in (resolve_runtime_config(header) for header, _ in blocks if header) if c and not c.get('unknown_lang')]
+    # The whole notebook runs on one connection: blocks may share /output files and sessions.
+    with routed_run([c.get('image') for c in configs], pinned=any('session' in c['flags'] for c in configs)):
+        if not wait_for_podman(icon):
+            icon.notify(f"{BACKEND.name} is not available. Execution halted.", title="Ephemeral Error")
+            annotate_trace(status='error')
             return
-    run_container_piped(icon, config, code, lang)
+        icon.notify(f"Running {len(blocks)} blocks...", title="Ephemeral Status")
+        start = time.perf_counter()
+        records = execute_notebook(blocks, job, pull=perform_visible_pull)
+    document = render_notebook_result(records, time.perf_counter() - start)
+    annotate_trace(status='ok' if notebook_ok(records) else 'failed')
+    for record in records:
+        if record['config']: record_usage(record['header'].split()[0], record['config']['image'])
+
+    def deliver():
+        import pyperclip
+        try:
+            zip_path = collect_notebook_artifacts(records)
+            pyperclip.copy(document)
+            ok = sum(1 for r in records if r['status'] == 'ok')
+            runnable = sum(1 for r in records if not r.get('prose'))
+            message = f"Notebook: {ok}/{runnable} blocks ok. Results copied to clipboard."
+            if zip_path: message += f"\nArtifacts: {os.path.basename(zip_path)}"
+            icon.notify(message, title="Ephemeral")
+        except Exception as e:
+            show_post_mortem_error(f"System Exception:\n{str(e)}")
+            icon.notify("Critical System Error", title="Ephemeral Failed")
+    try:
+        if job: deliver_in_order(job, deliver)
+        else: deliver()
+    finally:
+        for record in records:
+            if record['result']: release_result(record['result'])
+
+# --- Job Scheduler ---
+# Hotkey presses become jobs in a FIFO queue served by WORKER_COUNT threads. Identical
+# clipboard payloads already queued or running are dropped, and results are delivered in
+# submission order so the last press always owns the clipboard.
+JOB_LOCK = threading.Condition()
+JOB_QUEUE = deque()
+JOB_RUNNING = []
+JOB_WORKERS = []
+JOB_SEQ = {'next_id': 1, 'next_delivery': 1, 'done': set()}
+JOB_SLOTS = {'borrowed': 0} # Container slots lent to running jobs (parallel notebook blocks)
+
+def update_job_status(icon):
+    with JOB_LOCK:
+        running, queued = len(JOB_RUNNING), len(JOB_QUEUE)
+    icon.title = f"{APP_NAME}: {running} running, {queued} queued" if running or queued else APP_NAME
+    try: icon.update_menu()
+    except: pass
+
+def complete_sequence(seq):
+    with JOB_LOCK:
+        JOB_SEQ['done'].add(seq)
+        while JOB_SEQ['next_delivery'] in JOB_SEQ['done']:
+            JOB_SEQ['done'].discard(JOB_SEQ['next_delivery'])
+            JOB_SEQ['next_delivery'] += 1
+        JOB_LOCK.notify_all()
+
+def deliver_in_order(job, deliver):
+    with trace_phase('order_wait'), JOB_LOCK:
+        JOB_LOCK.wait_for(lambda: JOB_SEQ['next_delivery'] >= job['seq'])
+    try: deliver()
+    finally:
+        job['delivered'] = True
+        complete_sequence(job['seq'])
+
+def borrow_run_slot(connection=None):
+    """Reserve an idle worker's slot (and a slot on `connection`) for one more container of a running job."""
+    with JOB_LOCK:
+        if len(JOB_RUNNING) + JOB_SLOTS['borrowed'] >= WORKER_COUNT: return False
+        JOB_SLOTS['borrowed'] += 1
+    if connection:
+        with CONNECTIONS_LOCK: connection['active'] += 1
+    return True
+
+def return_run_slot(connection=None):
+    if connection:
+        with CONNECTIONS_LOCK: connection['active'] -= 1
+    with JOB_LOCK:
+        JOB_SLOTS['borrowed'] -= 1
+        JOB_LOCK.notify_all()
+
+def submit_job(icon, content):
+    key = hashlib.sha256((content or '').encode('utf-8', errors='replace')).hexdigest()
+    with JOB_LOCK:
+        if any(j['key'] == key and not j['cancelled'] for j in list(JOB_QUEUE) + JOB_RUNNING):
+            duplicate = True
+        else:
+            duplicate = False
+            job = {'seq': JOB_SEQ['next_id'], 'key': key, 'content': content, 'label': 'snippet',
+                   'cancelled': False, 'kills': set(), 'delivered': False, 'submitted': time.perf_counter()}
+            JOB_SEQ['next_id'] += 1
+            JOB_QUEUE.append(job)
+            JOB_LOCK.notify_all()
+        while len(JOB_WORKERS) < WORKER_COUNT:
+            worker = threading.Thread(target=job_worker, args=(icon,), daemon=True)
+            JOB_WORKERS.append(worker)
+            worker.start()
+    if duplicate: icon.notify("That clipboard is already queued or running.", title="Ephemeral")
+    update_job_status(icon)
+
+def job_worker(icon):
+    while True:
+        with JOB_LOCK:
+            JOB_LOCK.wait_for(lambda: JOB_QUEUE and len(JOB_RUNNING) + JOB_SLOTS['borrowed'] < WORKER_COUNT)
+            job = JOB_QUEUE.popleft()
+            JOB_RUNNING.append(job)
+        update_job_status(icon)
+        mark_run_started()
+        begin_trace(job['label'], start=job['submitted'])
+        add_phase('queue', time.perf_counter() - job['submitted'])
+        try: run_logic(icon, job['content'], job)
+        except Exception as e:
+            annotate_trace(status='error')
+            print(f"Job {job['seq']} failed: {e}")
+        finally:
+            annotate_trace(label=job['label'])
+            end_trace()
+            mark_run_finished()
+            with JOB_LOCK:
+                JOB_RUNNING.remove(job)
+            if not job['delivered']: complete_sequence(job['seq'])
+            update_job_status(icon)
+
+def cancel_job(icon, seq):
+    with JOB_LOCK:
+        job = next((j for j in list(JOB_QUEUE) + JOB_RUNNING if j['seq'] == seq), None)
+        if not job: return
+        job['cancelled'] = True
+        queued = job in JOB_QUEUE
+        if queued: JOB_QUEUE.remove(job)
+        kills = list(job['kills'])
+    if queued: complete_sequence(seq)
+    for kill in kills:
+        threading.Thread(target=kill, daemon=True).start()
+    icon.notify(f"Cancelled job #{seq} ({job['label']}).", title="Ephemeral")
+    update_job_status(icon)
+
+def cancel_all_jobs(icon, item=None):
+    with JOB_LOCK:
+        seqs = [j['seq'] for j in list(JOB_QUEUE) + JOB_RUNNING]
+    for seq in seqs:
+        cancel_job(icon, seq)
+
+def job_menu_items():
+    from pystray import MenuItem as item
+    with JOB_LOCK:
+        jobs = [(j, 'running') for j in JOB_RUNNING] + [(j, 'queued') for j in JOB_QUEUE]
+    if not jobs:
+        return (item('No active jobs', None, enabled=False),)
+    items = [item(f"Cancel #{j['seq']} {j['label']} ({state})",
+                  lambda icon, _, seq=j['seq']: cancel_job(icon, seq)) for j, state in jobs]
+    items.append(item('Cancel All', cancel_all_jobs))
+    return tuple(items)
 
 def on_hotkey(icon):
-    threading.Thread(target=run_logic, args=(icon,)).start()
+    submit_job(icon, get_clipboard())
+
+# --- Headless Mode ---
+# `ephemeral.py --headless [--json] [--backend B] [--workers N] [--artifacts DIR] PATH...`
+# runs every fenced block of the given markdown files (or directories of them) without the
+# tray, clipboard, hotkey or any GUI library, and exits non-zero if any block is not ok.
+class ConsoleNotifier:
+    """Stands in for the tray icon: notifications go to stderr."""
+    def notify(self, message, title=APP_NAME):
+        print(f"[{title}] {message}", file=sys.stderr)
+
+def collect_markdown_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, n) for n in sorted(names) if n.lower().endswith(('.md', '.markdown')))
+        else: files.append(path)
+    return files
+
+@traced('pull')
+def pull_image_quietly(image_name):
+    print(f"[Ephemeral] Pulling {image_name}...", file=sys.stderr)
+    exit_code = subprocess.call(BACKEND.argv(['pull', image_name]), stdout=sys.stderr, stderr=sys.stderr)
+    IMAGE_DIGESTS.pop((connection_name(), image_name), None)
+    invalidate_image_index()
+    return exit_code
+
+def block_report(record):
+    result = record['result'] or {}
+    return {
+        'index': record['index'] + 1, 'header': record['header'],
+        'lang': record['header'].split()[0] if record['header'] else None,
+        'status': record['status'], 'exit_code': result.get('returncode'),
+        'seconds': round(record['seconds'], 3), 'note': record['note'],
+        'stdout': result.get('stdout', ''), 'stderr': result.get('stderr', ''),
+    }
+
+def headless_main(argv):
+    global BACKEND, POOL_ENABLED, PREFETCH_ENABLED, NOTEBOOK_WORKERS, ARTIFACT_STAGING_DIR
+    parser = argparse.ArgumentParser(prog='ephemeral --headless', description='Run the fenced blocks of markdown files.')
+    parser.add_argument('paths', nargs='+', help='Markdown files or directories')
+    parser.add_argument('--json', action='store_true', help='Print a JSON report instead of markdown')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=CONTAINER_BACKEND)
+    parser.add_argument('--workers', type=int, default=NOTEBOOK_WORKERS, help='Blocks run in parallel')
+    parser.add_argument('--artifacts', metavar='DIR', help='Zip each file\'s /output files into DIR')
+    args = parser.parse_args(argv)
+
+    BACKEND = BACKENDS[args.backend]()
+    POOL_ENABLED = PREFETCH_ENABLED = False # Nothing to warm up for in a single batch
+    ARTIFACT_STAGING_DIR = None # Artifacts are zipped, never renamed into Downloads
+    NOTEBOOK_WORKERS = args.workers
+    ensure_podman_running(ConsoleNotifier())
+
+    reports, all_ok = [], True
+    try:
+        for path in collect_markdown_files(args.paths):
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            blocks = parse_codeblocks(content)
+            if not blocks:
+                header, code = parse_codeblock(content)
+                blocks = [(header, code)] if header else []
+            start = time.perf_counter()
+            records = execute_notebook(blocks, pull=pull_image_quietly)
+            wall_seconds = time.perf_counter() - start
+            all_ok = all_ok and notebook_ok(records)
+            artifacts = None
+            if args.artifacts:
+                os.makedirs(args.artifacts, exist_ok=True)
+                artifacts = collect_notebook_artifacts(records, args.artifacts)
+            if args.json:
+                reports.append({'file': path, 'seconds': round(wall_seconds, 3), 'artifacts': artifacts,
+                                'blocks': [block_report(r) for r in records]})
+            else:
+                print(f"==> {path} <==")
+                print(render_notebook_result(records, wall_seconds))
+                if artifacts: print(f"Artifacts: {artifacts}")
+            for record in records:
+                if record['result']: release_result(record['result'])
+    finally:
+        shutdown_sessions()
+    if args.json: print(json.dumps({'backend': BACKEND.name, 'ok': all_ok, 'files': reports}, indent=2))
+    return 0 if all_ok else 1
+
+# --- Suite Benchmark ---
+# `ephemeral.py --bench [SUITE] [--langs a,b] [--workers N] [--backend B] [--report FILE]
+# [--baseline FILE]` runs ephemeral_test_suite.md (fenced and shebang parts), checks every
+# "Math Check" value and times each phase per case. The JSON report is sorted so reports from
+# two releases diff cleanly; with --baseline, broken or slower cases fail the run.
+MATH_OUTPUT = re.compile(r'Math(?: Check)?:\s*(-?\d+)\s*- OK')
+MATH_LITERAL = re.compile(r'Math(?: Check)?: (\d+) - OK')
+MATH_INFIX = re.compile(r'(\d+)\s*\+\s*(\d+)')
+MATH_RPN = re.compile(r'(\d+) (\d+) \+')
+MATH_PREFIX = re.compile(r'\(\+ (\d+) (\d+)\)') # Lisps: (+ 28 2)
+BENCH_PHASES = ('image_check', 'pull', 'start', 'compile', 'execute')
+BENCH_SLOWDOWN = 1.5      # start+compile+execute this much slower than the baseline is a regression
+BENCH_MIN_SLOWDOWN = 0.5  # ...and by at least this many seconds (ignores jitter on fast cases)
+
+def expected_math(code):
+    """The value a suite snippet should print after "Math Check:", or None if it has none."""
+    for pattern in (MATH_LITERAL, MATH_INFIX, MATH_RPN, MATH_PREFIX):
+        match = pattern.search(code)
+        if match: return sum(int(g) for g in match.groups())
+    return None
+
+def suite_cases(content):
+    cases = []
+    for header, code in parse_codeblocks(content, keep_shebang=True):
+        part = 'fenced'
+        if header == 'text' and code.lstrip().startswith('#!'):
+            header, code = parse_codeblock(code) # PART 2 blocks are copied without their fence
+            part = 'shebang'
+        else: code = strip_shebang(code)
+        if header: cases.append({'id': f"{part}/{header.split()[0]}", 'header': header, 'code': code})
+    return cases
+
+def time_container_start(config):
+    """Seconds to start and tear down an empty container of this image, or None."""
+    output_dir = tempfile.mkdtemp()
+    probe = dict(config, entrypoint='sh', cmd=['-c', ':'], mounts=[])
+    start = time.perf_counter()
+    try:
+        subprocess.run(build_run_command(probe, output_dir, f"ephemeral-bench-{uuid.uuid4().hex[:12]}"),
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       startupinfo=hidden_startupinfo(), timeout=120, check=True)
+        return time.perf_counter() - start
+    except Exception: return None
+    finally: remove_output_dir(output_dir)
+
+def run_bench_case(case, pull_locks):
+    config = resolve_runtime_config(case['header'])
+    record = {'id': case['id'], 'lang': case['header'].split()[0], 'image': None, 'status': 'error',
+              'expected': expected_math(case['code']), 'actual': None, 'exit_code': None,
+              'note': '', 'phases': dict.fromkeys(BENCH_PHASES, 0.0)}
+    if not config or not config.get('image'):
+        record['note'] = 'Could not resolve image.'
+        return record
+    image_name, phases = config['image'], record['phases']
+    record['image'] = image_name
+
+    start = time.perf_counter()
+    present = image_present(image_name)
+    phases['image_check'] = time.perf_counter() - start
+    if not present:
+        with pull_locks.setdefault(image_name, threading.Lock()):
+            start = time.perf_counter()
+            if not image_present(image_name) and pull_image_quietly(image_name) != 0:
+                record['note'] = 'Pull failed.'
+                return record
+            phases['pull'] = time.perf_counter() - start
+
+    phases['start'] = time_container_start(config) or 0.0
+    # Compiled languages run twice against an empty compile cache: build+run, then run only.
+    runs = []
+    for attempt in range(2 if config.get('compile') else 1):
+        start = time.perf_counter()
+        result = execute_container(config, case['code'], case['header'])
+        runs.append(time.perf_counter() - start)
+        release_result(result)
+        if result['error'] or result['returncode'] != 0 or result['limit']: break
+    if len(runs) == 2: phases['compile'] = max(0.0, runs[0] - runs[1])
+    phases['execute'] = max(0.0, runs[-1] - phases['start'])
+
+    record['exit_code'] = result['returncode']
+    match = MATH_OUTPUT.search(result['stdout'])
+    record['actual'] = int(match.group(1)) if match else None
+    if result['error']: record['note'] = result['error']
+    elif result['limit']: record.update(status='fail', note=describe_limit(result['limit'], result['limits']))
+    elif result['returncode'] != 0:
+        record.update(status='fail', note=(result['stderr'].strip() or result['stdout'].strip())[-200:])
+    elif record['expected'] is None:
+        record.update(status='pass' if result['stdout'].strip() else 'fail', note='No Math Check in snippet.')
+    elif record['actual'] == record['expected']: record['status'] = 'pass'
+    else: record.update(status='fail', note=f"Math Check: expected {record['expected']}, got {record['actual']}")
+    return record
+
+def compare_bench_reports(baseline, report):
+    """Human-readable regressions of `report` against an earlier `baseline` report."""
+    before = {case['id']: case for case in baseline.get('cases', [])}
+    regressions = []
+    for case in report['cases']:
+        old = before.get(case['id'])
+        if not old: continue
+        if old['status'] == 'pass' and case['status'] != 'pass':
+            regressions.append(f"{case['id']}: {old['status']} -> {case['status']}")
+            continue
+        old_time = sum(old['phases'].get(p, 0) for p in ('start', 'compile', 'execute'))
+        new_time = sum(case['phases'].get(p, 0) for p in ('start', 'compile', 'execute'))
+        if new_time > old_time * BENCH_SLOWDOWN and new_time - old_time > BENCH_MIN_SLOWDOWN:
+            regressions.append(f"{case['id']}: {old_time:.2f}s -> {new_time:.2f}s")
+    return regressions
+
+def micro_bench(suite_text, copies=20, rounds=20):
+    """Time the per-press parsing path on a clipboard holding `copies` concatenated suites."""
+    clipboard = suite_text * copies
+    blocks = parse_codeblocks(clipboard, keep_shebang=True)
+    headers = [header for header, _ in blocks if header]
+    shebangs = [code for _, code in blocks if code.lstrip().startswith('#!')]
+    ansi_text = ('\x1b[31mred\x1b[0m plain text ' * 50 + '\n') * 2000
+    cases = [
+        (f"parse_codeblocks ({len(blocks)} blocks)", lambda: parse_codeblocks(clipboard)),
+        (f"shebang detection ({len(shebangs)} blocks)", lambda: [parse_codeblock(code) for code in shebangs]),
+        (f"resolve_runtime_config ({len(headers)} headers)", lambda: [resolve_runtime_config(h) for h in headers]),
+        ("strip_ansi_codes (2000 lines)", lambda: strip_ansi_codes(ansi_text)),
+        ("rebuild_lang_index", rebuild_lang_index),
+    ]
+    for name, func in cases:
+        func() # Warm up
+        start = time.perf_counter()
+        for _ in range(rounds): func()
+        print(f"{name:<44} {(time.perf_counter() - start) / rounds * 1000:9.3f} ms")
+
+def bench_main(argv):
+    global BACKEND, POOL_ENABLED, PREFETCH_ENABLED, RESULT_CACHE_ENABLED, COMPILE_CACHE_DIR, ARTIFACT_STAGING_DIR
+    default_suite = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ephemeral_test_suite.md')
+    parser = argparse.ArgumentParser(prog='ephemeral --bench', description='Benchmark and verify the test suite.')
+    parser.add_argument('suite', nargs='?', default=default_suite)
+    parser.add_argument('--langs', help='Comma-separated languages to run (default: all)')
+    parser.add_argument('--workers', type=int, default=NOTEBOOK_WORKERS, help='Cases run in parallel')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=CONTAINER_BACKEND)
+    parser.add_argument('--report', metavar='FILE', help='Write the JSON report here')
+    parser.add_argument('--baseline', metavar='FILE', help='Earlier report to check for regressions')
+    parser.add_argument('--micro', action='store_true', help='Only micro-benchmark clipboard parsing (no containers)')
+    args = parser.parse_args(argv)
+
+    with open(args.suite, 'r', encoding='utf-8') as f:
+        suite_text = f.read()
+    if args.micro:
+        micro_bench(suite_text)
+        return 0
+    cases = suite_cases(suite_text)
+    if args.langs:
+        wanted = {lang.strip().lower() for lang in args.langs.split(',')}
+        cases = [case for case in cases if case['id'].split('/', 1)[1].lower() in wanted]
+
+    # Measure cold paths: no warm pool, no result cache and a throwaway compile cache.
+    BACKEND = BACKENDS[args.backend]()
+    POOL_ENABLED = PREFETCH_ENABLED = RESULT_CACHE_ENABLED = False
+    ARTIFACT_STAGING_DIR = None
+    saved_cache_dir, COMPILE_CACHE_DIR = COMPILE_CACHE_DIR, tempfile.mkdtemp(prefix='ephemeral-bench-')
+    ensure_podman_running(ConsoleNotifier())
+    pull_locks = {}
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            records = list(pool.map(lambda case: run_bench_case(case, pull_locks), cases))
+    finally:
+        shutil.rmtree(COMPILE_CACHE_DIR, ignore_errors=True)
+        COMPILE_CACHE_DIR = saved_cache_dir
+    wall_seconds = time.perf_counter() - start
+
+    for record in records:
+        record['phases'] = {name: round(value, 3) for name, value in record['phases'].items()}
+        record['phases']['total'] = round(sum(record['phases'].values()), 3)
+    records.sort(key=lambda r: r['id'])
+    counts = {status: sum(1 for r in records if r['status'] == status) for status in ('pass', 'fail', 'error')}
+    report = {'suite': os.path.basename(args.suite), 'backend': BACKEND.name, 'workers': args.workers,
+              'wall_seconds': round(wall_seconds, 3), 'summary': counts, 'cases': records}
+
+    print(f"{'case':<22} {'status':<6}" + ''.join(f" {name:>11}" for name in BENCH_PHASES + ('total',)))
+    for r in records:
+        print(f"{r['id']:<22} {r['status']:<6}" + ''.join(f" {r['phases'][name]:>11.3f}" for name in BENCH_PHASES + ('total',))
+              + (f"  {r['note'].splitlines()[-1]}" if r['note'] else ''))
+    print(f"{len(records)} cases: {counts['pass']} pass, {counts['fail']} fail, {counts['error']} error, {wall_seconds:.2f}s wall time")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_bench_reports(json.load(f), report)
+        print(f"{len(regressions)} regressions against {args.baseline}")
+        for line in regressions: print(f"  {line}")
+    return 0 if counts['pass'] == len(records) and not regressions else 1
 
 # --- Main Entry Points ---
+# --- Startup ---
+# The hotkey is hooked before pystray/PIL load, and the Podman probe runs in the background,
+# so the tray is usable at once. Each milestone is logged (and traced) in ms since launch.
+STARTUP = {'icon': None, 'early_presses': [], 'milestones': {}}
+STARTUP_LOCK = threading.Lock()
+
+def mark_startup(milestone):
+    with STARTUP_LOCK:
+        if milestone in STARTUP['milestones']: return
+        STARTUP['milestones'][milestone] = round((time.perf_counter() - STARTUP_CLOCK) * 1000, 1)
+        milestones = dict(STARTUP['milestones'])
+    if milestone == 'podman':
+        print(f"[Ephemeral] Startup: {startup_summary()}")
+        write_trace_event({'event': 'startup', 'ts': time.time(), 'ms': milestones})
+
+def startup_summary():
+    with STARTUP_LOCK:
+        return ', '.join(f"{name} {ms:.0f} ms" for name, ms in STARTUP['milestones'].items())
+
+def register_hotkey():
+    """Hook the hotkey before the tray exists; a press that early runs once the icon is up."""
+    import keyboard
+    def pressed():
+        with STARTUP_LOCK:
+            icon = STARTUP['icon']
+            if not icon: STARTUP['early_presses'].append(get_clipboard())
+        if icon: on_hotkey(icon)
+    keyboard.add_hotkey(HOTKEY, pressed)
+    mark_startup('hotkey')
+
 def setup_tray_mode(icon):
     """Standard Mode: Persistent Tray Icon"""
     icon.visible = True
+    with STARTUP_LOCK:
+        STARTUP['icon'] = icon
+        early_presses, STARTUP['early_presses'] = STARTUP['early_presses'], []
+    mark_startup('tray')
+    if PODMAN_CONNECTIONS:
+        setup_connections()
+        start_connection_monitor()
+    else: start_readiness_probe(icon)
+    for content in early_presses: submit_job(icon, content)
     def init_sequence():
-        ensure_podman_running(icon)
-    threading.Thread(target=init_sequence).start()
-    keyboard.add_hotkey(HOTKEY, lambda: on_hotkey(icon))
+        if not wait_for_podman(icon): return
+        build_image_index()
+        start_prefetcher()
+    threading.Thread(target=init_sequence, daemon=True).start()
+    start_metrics_server()
+    start_registry_watcher(icon)
+    start_machine_lifecycle(icon)
 
 def setup_oneshot_mode(icon, file_path):
     """One-Shot Mode: Run file, respect Podman state, then exit."""
+    global POOL_ENABLED
     icon.visible = True
+    POOL_ENABLED = False # Nothing left to warm up for after a single run
     
     def auto_run_sequence():
         # 1. Check Initial State
@@ -538,15 +3960,14 @@ def setup_oneshot_mode(icon, file_path):
             with open(file_path, 'r', encoding='utf-8') as f:
                 content = f.read()
             
-            pyperclip.copy(content)
-            time.sleep(0.5) 
-            
             icon.notify(f"Loading {os.path.basename(file_path)}...", title="Ephemeral One-Shot")
             
             # This calls the container logic. Ideally this call blocks until done.
             # In our current code, run_logic spawns subprocess.communicate(), 
             # so it is effectively blocking for this thread.
-            run_logic(icon)
+            begin_trace(os.path.basename(file_path))
+            try: run_logic(icon, content)
+            finally: end_trace()
             
         except Exception as e:
             icon.notify(f"One-Shot Failed: {e}", title="Ephemeral Error")
@@ -566,23 +3987,47 @@ def setup_oneshot_mode(icon, file_path):
     threading.Thread(target=auto_run_sequence).start()
 
 def quit_app(icon, item):
-    stop_podman_machine(icon)
+    cancel_readiness_probe()
+    release_clipboard_owner()
+    shutdown_warm_pool()
+    shutdown_sessions()
+    if MACHINE_STOP_ON_QUIT: stop_podman_machine(icon)
     icon.stop()
     sys.exit()
 
 if __name__ == '__main__':
+    if '--headless' in sys.argv[1:]:
+        sys.exit(headless_main([a for a in sys.argv[1:] if a != '--headless']))
+    if '--datasets' in sys.argv[1:]:
+        sys.exit(datasets_main([a for a in sys.argv[1:] if a != '--datasets']))
+    if '--bench' in sys.argv[1:]:
+        sys.exit(bench_main([a for a in sys.argv[1:] if a != '--bench']))
+
+    file_target = sys.argv[1] if len(sys.argv) > 1 and os.path.exists(sys.argv[1]) else None
+    if not file_target: register_hotkey()
+
+    import pystray
+    from pystray import MenuItem as item
     image = create_icon_image()
     menu = (
         item('Run Clipboard', lambda icon, item: on_hotkey(icon), default=True),
+        item('Jobs', pystray.Menu(job_menu_items)),
+        item('Recent Runs', pystray.Menu(recent_runs_menu_items)),
+        item('Podman Machine', pystray.Menu(machine_menu_items)),
+        item('Connections', pystray.Menu(connection_menu_items)),
+        item('Datasets', pystray.Menu(dataset_menu_items)),
         item('Clear Image Cache', purge_cache),
+        item('Clear Compile Cache', clear_compile_cache),
+        item(result_cache_menu_text, toggle_result_cache, checked=lambda item: RESULT_CACHE_ENABLED),
+        item('Clear Result Cache', clear_result_cache),
+        item('Stop Sessions', stop_sessions),
         item('Quit', quit_app)
     )
     icon = pystray.Icon("Ephemeral", image, "Ephemeral", menu)
 
     # DETECT MODE
-    if len(sys.argv) > 1 and os.path.exists(sys.argv[1]):
+    if file_target:
         # One-Shot Mode
-        file_target = sys.argv[1]
         icon.run(lambda icon: setup_oneshot_mode(icon, file_target))
     else:
         # Standard Tray Mode
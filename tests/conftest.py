@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+import ephemeral
+
+HOME = os.path.expanduser('~')
+
+
+@pytest.fixture(autouse=True)
+def isolated_home(tmp_path, monkeypatch):
+    """Point every path under the user's home (~/.ephemeral, Downloads) at a per-test directory."""
+    home = tmp_path / 'home'
+    for name, value in list(vars(ephemeral).items()):
+        if name.isupper() and isinstance(value, str) and value.startswith(HOME + os.sep):
+            monkeypatch.setattr(ephemeral, name, str(home / os.path.relpath(value, HOME)))
+    return home
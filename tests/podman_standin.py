@@ -0,0 +1,133 @@
+"""A minimal stand-in for the Podman service (libpod REST API) on a unix socket.
+
+It speaks just the endpoints PodmanApiBackend uses, and runs each container's command as a
+host process. Images whose name contains 'missing' do not exist.
+"""
+import json
+import socket
+import subprocess
+import threading
+import uuid
+
+
+class PodmanStandin:
+    def __init__(self, path):
+        self.path = path
+        self.url = f"unix://{path}"
+        self.log = [] # (method, path) of every request, without the API version
+        self.containers = {}
+        self.connections = set()
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(16)
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def close(self):
+        self.server.close()
+        for container in self.containers.values():
+            if container['process'] and container['process'].poll() is None: container['process'].kill()
+
+    def accept_loop(self):
+        while True:
+            try: conn, _ = self.server.accept()
+            except OSError: return
+            self.connections.add(conn)
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        stream = conn.makefile('rb')
+        try:
+            while True:
+                line = stream.readline()
+                if not line: return
+                method, target, _ = line.decode('ascii').split(' ', 2)
+                headers = {}
+                while True:
+                    header = stream.readline().decode('ascii')
+                    if header in ('\r\n', ''): break
+                    key, _, value = header.partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = stream.read(int(headers.get('content-length') or 0))
+                path = target.split('/', 2)[2] # Drop the leading /v4.0.0
+                self.log.append((method, path))
+                if self.route(conn, method, path, body) == 'hijacked': return
+        except OSError: pass
+        finally:
+            self.connections.discard(conn)
+            conn.close()
+
+    def drop_connections(self):
+        """Close every open client connection, as a restarted service would."""
+        for conn in list(self.connections):
+            try: conn.shutdown(socket.SHUT_RDWR)
+            except OSError: pass
+
+    def reply(self, conn, status, data=b'', content_type='application/json'):
+        conn.sendall(f"HTTP/1.1 {status} X\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(data)}\r\n\r\n".encode('ascii') + data)
+
+    def route(self, conn, method, path, body):
+        path, _, query = path.partition('?')
+        if path == 'libpod/_ping': return self.reply(conn, 200, b'OK', 'text/plain')
+        if path == 'libpod/info': return self.reply(conn, 200, json.dumps({'host': {'cpus': 4}}).encode())
+        if path == 'libpod/images/json':
+            return self.reply(conn, 200, json.dumps([{'Names': ['docker.io/library/python:3.10-slim'], 'Id': 'abc'}]).encode())
+        if path.startswith('libpod/images/') and path.endswith('/exists'):
+            return self.reply(conn, 404 if 'missing' in path else 204)
+        if path == 'libpod/containers/create':
+            spec = json.loads(body)
+            if 'missing' in spec['image']:
+                return self.reply(conn, 404, json.dumps({'message': f"{spec['image']}: image not known"}).encode())
+            container = uuid.uuid4().hex
+            self.containers[container] = {'spec': spec, 'process': None, 'started': threading.Event()}
+            return self.reply(conn, 201, json.dumps({'Id': container}).encode())
+        container, _, action = path[len('libpod/containers/'):].partition('/')
+        state = self.containers.get(container)
+        if not path.startswith('libpod/containers/') or not state:
+            return self.reply(conn, 404, b'{"message": "no such container"}')
+        if method == 'DELETE':
+            if state['process'] and state['process'].poll() is None: state['process'].kill()
+            del self.containers[container]
+            return self.reply(conn, 200, b'[]')
+        if action == 'start':
+            spec = state['spec']
+            state['process'] = subprocess.Popen((spec.get('entrypoint') or []) + spec['command'], stdin=subprocess.PIPE,
+                                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            state['started'].set()
+            return self.reply(conn, 204)
+        if action == 'wait':
+            state['started'].wait()
+            return self.reply(conn, 200, str(state['process'].wait()).encode())
+        if action == 'attach':
+            self.attach(conn, state)
+            return 'hijacked'
+        return self.reply(conn, 404)
+
+    def attach(self, conn, state):
+        """Upgrade to a raw stream: stdin in, 8-byte framed stdout (1) and stderr (2) out."""
+        conn.sendall(b"HTTP/1.1 101 UPGRADED\r\nContent-Type: application/vnd.docker.multiplexed-stream\r\n"
+                     b"Connection: Upgrade\r\nUpgrade: tcp\r\n\r\n")
+        state['started'].wait()
+        process, lock = state['process'], threading.Lock()
+
+        def pump_stdin():
+            while True:
+                data = conn.recv(65536)
+                if not data: break
+                try: process.stdin.write(data); process.stdin.flush()
+                except OSError: break
+            try: process.stdin.close()
+            except OSError: pass
+
+        def pump_output(stream, stream_id):
+            while True:
+                data = stream.read1(65536)
+                if not data: return
+                with lock: conn.sendall(bytes([stream_id, 0, 0, 0]) + len(data).to_bytes(4, 'big') + data)
+
+        threading.Thread(target=pump_stdin, daemon=True).start()
+        pumps = [threading.Thread(target=pump_output, args=(process.stdout, 1)),
+                 threading.Thread(target=pump_output, args=(process.stderr, 2))]
+        for pump in pumps: pump.start()
+        for pump in pumps: pump.join()
+        conn.shutdown(socket.SHUT_RDWR)
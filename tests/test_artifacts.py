@@ -0,0 +1,69 @@
+import os
+import shutil
+import zipfile
+from collections import namedtuple
+
+import ephemeral
+
+Usage = namedtuple('Usage', 'total used free')
+
+
+def near_full_disk(free_mb):
+    return lambda path: Usage(100 * 1024 ** 3, 0, free_mb * 1024 * 1024)
+
+
+def test_run_writing_nothing_is_never_killed(tmp_path, monkeypatch):
+    monkeypatch.setattr(shutil, 'disk_usage', near_full_disk(ephemeral.ARTIFACT_MIN_FREE_MB // 2))
+    killed = []
+    streamer = ephemeral.ArtifactStreamer(str(tmp_path), 10 * 1024 * 1024, lambda: killed.append(True))
+    streamer.poll()
+    assert streamer.finish() is None
+    assert not killed and not streamer.limit_hit
+
+
+def test_disk_guard_counts_bytes_this_run_wrote(tmp_path, monkeypatch):
+    monkeypatch.setattr(shutil, 'disk_usage', near_full_disk(ephemeral.ARTIFACT_MIN_FREE_MB + 1))
+    killed = []
+    streamer = ephemeral.ArtifactStreamer(str(tmp_path), 0, lambda: killed.append(True))
+    (tmp_path / 'small.txt').write_bytes(b'x' * 1024)
+    streamer.poll()
+    assert not killed
+    (tmp_path / 'big.bin').write_bytes(b'x' * (2 * 1024 * 1024))
+    streamer.poll()
+    streamer.finish()
+    assert killed and streamer.limit_hit
+
+
+def test_size_limit(tmp_path):
+    killed = []
+    streamer = ephemeral.ArtifactStreamer(str(tmp_path), 1024, lambda: killed.append(True))
+    (tmp_path / 'a.bin').write_bytes(b'x' * 2048)
+    streamer.poll()
+    streamer.finish()
+    assert killed
+
+
+def test_zip_that_cannot_be_opened_is_no_artifact(tmp_path, monkeypatch):
+    def refuse(*args, **kwargs): raise OSError("disk full")
+    monkeypatch.setattr(zipfile, 'ZipFile', refuse)
+    streamer = ephemeral.ArtifactStreamer(str(tmp_path), 0, lambda: None)
+    (tmp_path / 'a.txt').write_text('a')
+    (tmp_path / 'b.txt').write_text('b')
+    assert streamer.finish() is None
+
+
+def test_staging_dir_is_only_created_for_mounted_output():
+    config = ephemeral.resolve_runtime_config('python data=nosuchdataset')
+    result = ephemeral.execute_container(config, 'print(1)', 'python')
+    assert 'Unknown dataset' in result['error']
+    ephemeral.remove_output_dir(result['output_dir'])
+    assert not os.path.exists(ephemeral.ARTIFACT_STAGING_DIR)
+    output_dir = ephemeral.new_output_dir()
+    assert os.path.dirname(output_dir) == ephemeral.ARTIFACT_STAGING_DIR
+
+
+def test_no_staging_dir_means_system_temp(monkeypatch):
+    monkeypatch.setattr(ephemeral, 'ARTIFACT_STAGING_DIR', None)
+    output_dir = ephemeral.new_output_dir()
+    try: assert os.path.isdir(output_dir)
+    finally: ephemeral.remove_output_dir(output_dir)
@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+import ephemeral
+
+
+@pytest.fixture
+def headless(monkeypatch):
+    """headless_main() rebinds these module globals; put them back afterwards."""
+    for name in ('BACKEND', 'POOL_ENABLED', 'PREFETCH_ENABLED', 'NOTEBOOK_WORKERS', 'ARTIFACT_STAGING_DIR'):
+        monkeypatch.setattr(ephemeral, name, getattr(ephemeral, name))
+    monkeypatch.setattr(ephemeral, 'READINESS', dict(ephemeral.READINESS, procs=set()))
+
+
+def test_local_backend_runs_the_command_on_the_host():
+    backend = ephemeral.LocalBackend()
+    argv = backend.argv(['run', '--rm', '-i', '--name', 'x', '--memory', '256m', '--network', 'none',
+                         '-v', '/tmp/out:/output', '--entrypoint', 'sh', 'python:3.10-slim', '-c', 'echo hi'])
+    assert argv == ['sh', '-c', 'echo hi']
+    assert backend.argv(['images', '--format', 'json'])[-1] == '[]'
+    assert not backend.containers and not backend.has_machine
+
+
+def test_docker_backend_translates_podman_only_commands():
+    backend = ephemeral.DockerBackend()
+    assert backend.argv(['image', 'exists', 'python:3.10-slim']) == ['docker', 'image', 'inspect', '--format', '{{.Id}}', 'python:3.10-slim']
+    assert backend.argv(['rm', '--force', '--time', '0', 'abc']) == ['docker', 'rm', '--force', 'abc']
+    line = '{"Repository": "python", "Tag": "3.10-slim", "ID": "abc"}\n{"Repository": "<none>", "ID": "def"}\n'
+    assert backend.parse_images(line) == [(['python:3.10-slim'], 'abc'), ([], 'def')]
+
+
+def test_headless_json_report_with_the_local_backend(tmp_path, headless, capsys):
+    notes = tmp_path / 'notes.md'
+    notes.write_text("```python\nprint(6 * 7)\n```\n\nSome prose.\n\n```python\nraise SystemExit(3)\n```\n")
+    assert ephemeral.headless_main(['--json', '--backend', 'local', str(notes)]) == 1
+    report = json.loads(capsys.readouterr().out)
+    assert report['backend'] == 'local' and not report['ok']
+    blocks = report['files'][0]['blocks']
+    assert [(b['status'], b['exit_code']) for b in blocks] == [('ok', 0), ('failed', 3)]
+    assert blocks[0]['stdout'] == '42\n'
+    assert ephemeral.BACKEND.name == 'local' and not ephemeral.POOL_ENABLED
+
+
+def test_headless_exits_zero_when_every_block_passes(tmp_path, headless, capsys):
+    (tmp_path / 'a.md').write_text("```python\nprint('a')\n```\n")
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / 'b.md').write_text("```python\nprint('b')\n```\n")
+    assert ephemeral.headless_main(['--backend', 'local', str(tmp_path)]) == 0
+    out = capsys.readouterr().out
+    assert out.index('a.md <==') < out.index('b.md <==') # Directories are walked in sorted order
@@ -0,0 +1,16 @@
+import os
+
+import ephemeral
+
+SUITE = os.path.join(os.path.dirname(__file__), '..', 'ephemeral_test_suite.md')
+
+
+def test_shebang_cases_expect_the_same_math_check_as_fenced_ones():
+    with open(SUITE, 'r', encoding='utf-8') as f:
+        cases = ephemeral.suite_cases(f.read())
+    expected = {case['id']: ephemeral.expected_math(case['code']) for case in cases}
+    assert expected['shebang/clojure'] == expected['fenced/clojure'] == 30
+    assert expected['shebang/lisp'] == expected['fenced/lisp'] == 30
+    for case_id, value in expected.items():
+        part, lang = case_id.split('/')
+        if part == 'shebang' and f"fenced/{lang}" in expected: assert value == expected[f"fenced/{lang}"], case_id
@@ -0,0 +1,32 @@
+from io import BytesIO
+
+import pytest
+
+import ephemeral
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def test_png_within_the_budget_is_copied_as_is(tmp_path):
+    path = tmp_path / 'plot.png'
+    Image.new('RGB', (40, 30), 'red').save(path)
+    png, size, original = ephemeral.prepare_clipboard_image(str(path))
+    assert png == path.read_bytes() and size == original == (40, 30)
+
+
+def test_large_image_is_downscaled_to_the_pixel_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(ephemeral, 'CLIPBOARD_IMAGE_MAX_PIXELS', 10_000)
+    path = tmp_path / 'plot.png'
+    Image.new('RGBA', (400, 100), (0, 0, 255, 128)).save(path)
+    png, size, original = ephemeral.prepare_clipboard_image(str(path))
+    assert original == (400, 100) and size == (200, 50) # Aspect ratio kept
+    with Image.open(BytesIO(png)) as img:
+        assert img.format == 'PNG' and img.size == size and img.mode == 'RGBA'
+
+
+def test_jpeg_is_converted_to_png(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    Image.new('RGB', (64, 48), 'green').save(path, 'JPEG')
+    png, size, _ = ephemeral.prepare_clipboard_image(str(path))
+    with Image.open(BytesIO(png)) as img:
+        assert img.format == 'PNG' and img.size == size == (64, 48)
@@ -0,0 +1,53 @@
+import os
+
+import ephemeral
+
+
+def test_key_covers_image_commands_and_normalized_source():
+    spec = {'build': 'gcc -x c - -o /artifact/run', 'run': '/artifact/run'}
+    code = ephemeral.normalize_code('int main(){return 0;}\r\n')
+    assert code == ephemeral.normalize_code('int main(){return 0;}') # Line endings and the final newline do not matter
+    key = ephemeral.compile_cache_key('sha256:a', spec, code)
+    assert key == ephemeral.compile_cache_key('sha256:a', dict(spec), code)
+    assert key != ephemeral.compile_cache_key('sha256:b', spec, code)
+    assert key != ephemeral.compile_cache_key('sha256:a', dict(spec, build='gcc -O2 -x c - -o /artifact/run'), code)
+    assert key != ephemeral.compile_cache_key('sha256:a', spec, ephemeral.normalize_code('int main(){return 1;}'))
+
+
+def test_miss_publishes_the_build_and_the_next_run_hits(monkeypatch):
+    monkeypatch.setattr(ephemeral, 'IMAGE_DIGESTS', {(None, 'gcc:latest'): 'sha256:abc'})
+    config = ephemeral.resolve_runtime_config('c')
+    code = ephemeral.normalize_code('int main(){return 0;}')
+    miss = ephemeral.prepare_compile_cache(config, code)
+    assert miss['compile_cache']['hit'] is False and 'entrypoint' not in miss
+    staging, _, mode = miss['mounts'][-1]
+    assert mode == 'rw' and os.path.basename(staging).startswith('.staging-')
+    open(os.path.join(staging, 'run'), 'w').close()
+    open(os.path.join(staging, '.built'), 'w').close() # What the build command leaves behind
+    ephemeral.finalize_compile_cache(miss)
+    assert not os.path.exists(staging)
+    hit = ephemeral.prepare_compile_cache(config, code)
+    assert hit['compile_cache'] == {'hit': True}
+    assert hit['mounts'][-1] == (miss['compile_cache']['target'], '/artifact', 'ro')
+    assert 'gcc' not in ' '.join(hit['cmd'])
+
+
+def test_failed_build_is_not_cached(monkeypatch):
+    monkeypatch.setattr(ephemeral, 'IMAGE_DIGESTS', {(None, 'gcc:latest'): 'sha256:abc'})
+    config = ephemeral.resolve_runtime_config('c')
+    miss = ephemeral.prepare_compile_cache(config, b'syntax error\n')
+    ephemeral.finalize_compile_cache(miss)
+    assert not os.path.exists(miss['compile_cache']['staging'])
+    assert ephemeral.prepare_compile_cache(config, b'syntax error\n')['compile_cache']['hit'] is False
+
+
+def test_least_recently_used_entries_are_trimmed_first(tmp_path):
+    cache = tmp_path / 'cache'
+    for age, name in enumerate(('newest', 'middle', 'oldest')):
+        entry = cache / name
+        entry.mkdir(parents=True)
+        (entry / 'run').write_bytes(b'x' * 400 * 1024)
+        os.utime(entry, (1000 - age, 1000 - age))
+    (cache / '.staging-x').mkdir() # In-flight builds are never evicted
+    ephemeral.enforce_cache_limit(str(cache), 1, ephemeral.threading.Lock())
+    assert sorted(os.listdir(cache)) == ['.staging-x', 'middle', 'newest']
@@ -0,0 +1,81 @@
+import os
+
+import ephemeral
+
+
+def routed(monkeypatch, names):
+    monkeypatch.setattr(ephemeral, 'PODMAN_CONNECTIONS', names)
+    monkeypatch.setattr(ephemeral, 'CONNECTIONS', [])
+    monkeypatch.setattr(ephemeral, 'BACKEND', ephemeral.BACKEND)
+    monkeypatch.setattr(ephemeral, 'WORKER_COUNT', ephemeral.WORKER_COUNT)
+    ephemeral.setup_connections()
+    return ephemeral.CONNECTIONS
+
+
+def test_url_connection_cli_commands_reach_the_same_service(monkeypatch):
+    connections = routed(monkeypatch, ['tcp://build-box:8888', 'laptop'])
+    with ephemeral.bound_connection(connections[0]):
+        assert ephemeral.BACKEND.argv(['pull', 'python:3.11']) == ['podman', '--url', 'tcp://build-box:8888', 'pull', 'python:3.11']
+        assert not ephemeral.BACKEND.has_machine
+    with ephemeral.bound_connection(connections[1]):
+        assert ephemeral.BACKEND.argv(['image', 'prune', '-f']) == ['podman', '--connection', 'laptop', 'image', 'prune', '-f']
+
+
+def test_default_api_backend_uses_the_default_engine():
+    backend = ephemeral.PodmanApiBackend()
+    assert backend.argv(['info']) == ['podman', 'info']
+    assert backend.has_machine
+
+
+def test_url_connection_still_uses_the_api(monkeypatch):
+    backend = ephemeral.PodmanApiBackend('tcp://build-box:8888')
+    seen = []
+    monkeypatch.setattr(backend, 'api_process', lambda args, kwargs: seen.append(args) or ephemeral.ApiProcess.completed(0, kwargs))
+    assert backend.popen(backend.argv(['info'])).wait() == 0
+    assert seen == [['info']]
+
+
+def test_image_ids_are_cached_per_connection(monkeypatch):
+    connections = routed(monkeypatch, ['box-a', 'box-b'])
+    monkeypatch.setattr(ephemeral, 'IMAGE_DIGESTS', {})
+    monkeypatch.setattr(ephemeral, 'IMAGE_INDEX', {'box-a': {'docker.io/library/python:3.10-slim': 'sha256:aaa'},
+                                                   'box-b': {'docker.io/library/python:3.10-slim': 'sha256:bbb'}})
+    digests = {}
+    for connection in connections + connections: # Second pass is served from IMAGE_DIGESTS
+        with ephemeral.bound_connection(connection):
+            digests.setdefault(connection['name'], set()).add(ephemeral.get_image_digest('python:3.10-slim'))
+    assert digests == {'box-a': {'sha256:aaa'}, 'box-b': {'sha256:bbb'}}
+    monkeypatch.setattr(ephemeral, 'RESULT_CACHE_ENABLED', True)
+    monkeypatch.setattr(ephemeral, 'RESULT_CACHE_MAX_MB', 100)
+    config = ephemeral.resolve_runtime_config('python')
+    keys = set()
+    for connection in connections:
+        with ephemeral.bound_connection(connection):
+            keys.add(ephemeral.result_cache_key(config, b'print(1)\n'))
+    assert len(keys) == 2
+
+
+def test_dependency_images_are_removed_from_every_connection(tmp_path, monkeypatch):
+    log = tmp_path / 'podman.log'
+    cli = tmp_path / 'podman'
+    cli.write_text(f'#!/bin/sh\necho "$*" >> {log}\n')
+    cli.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(ephemeral, 'DEPS_INDEX_FILE', str(tmp_path / 'deps.json'))
+    monkeypatch.setattr(ephemeral, 'IMAGE_INDEX', {})
+    routed(monkeypatch, ['box-a', 'box-b'])
+    ephemeral.save_deps_index({'localhost/ephemeral-deps:abc': {'last_used': 1}})
+    assert ephemeral.gc_dependency_images(keep=0) == 1
+    assert log.read_text().splitlines() == ['--connection box-a rmi localhost/ephemeral-deps:abc',
+                                            '--connection box-b rmi localhost/ephemeral-deps:abc']
+    assert ephemeral.load_deps_index() == {}
+
+
+def test_prefetch_follows_connection_health(monkeypatch):
+    connections = routed(monkeypatch, ['box-a', 'box-b'])
+    monkeypatch.setattr(ephemeral, 'PREFETCH_ENABLED', True)
+    monkeypatch.setattr(ephemeral, 'user_idle_seconds', lambda: 3600)
+    monkeypatch.setitem(ephemeral.READINESS, 'ready', None) # Never set while connections are health-checked
+    assert not ephemeral.prefetch_allowed()
+    connections[0]['healthy'] = True
+    assert ephemeral.prefetch_allowed()
@@ -0,0 +1,37 @@
+import pytest
+
+import ephemeral
+
+
+@pytest.fixture
+def dataset_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(ephemeral, 'DATASET_DIR', str(tmp_path / 'datasets'))
+    return tmp_path
+
+
+def test_mount_spec_characters_are_replaced_in_file_names(dataset_dir):
+    source = dataset_dir / 'we:ird,v2.csv'
+    source.write_text('a,b\n1,2\n')
+    name, entry = ephemeral.add_dataset(str(source))
+    assert (name, entry['filename']) == ('we_ird_v2', 'we_ird_v2.csv')
+    config = ephemeral.mount_datasets({'datasets': [name]})
+    try: assert config['mounts'][0][1:] == ('/data/we_ird_v2.csv', 'ro')
+    finally: ephemeral.release_datasets(config)
+
+
+def test_invalid_names_are_rejected(dataset_dir):
+    source = dataset_dir / 'sales.csv'
+    source.write_text('x\n')
+    for name in ('a:b', 'a,b'):
+        with pytest.raises(ValueError): ephemeral.add_dataset(str(source), name)
+
+
+def test_mounted_dataset_cannot_be_evicted(dataset_dir):
+    source = dataset_dir / 'sales.csv'
+    source.write_text('x\n')
+    ephemeral.add_dataset(str(source))
+    config = ephemeral.mount_datasets({'datasets': ['sales']})
+    with pytest.raises(RuntimeError): ephemeral.evict_dataset('sales')
+    ephemeral.release_datasets(config)
+    ephemeral.evict_dataset('sales')
+    with pytest.raises(ValueError): ephemeral.mount_datasets({'datasets': ['sales']})
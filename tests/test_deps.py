@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+import ephemeral
+
+
+@pytest.fixture
+def podman(tmp_path, monkeypatch):
+    """A fake `podman` whose `build` adds the tag to its image listing."""
+    log = tmp_path / 'podman.log'
+    images = tmp_path / 'images.json'
+    images.write_text('[]')
+    cli = tmp_path / 'podman'
+    cli.write_text(f'#!/bin/sh\necho "$*" >> {log}\n'
+                   f'case "$1" in\n'
+                   f'  images) cat {images} ;;\n'
+                   f'  build) echo \'[{{"Names": ["\'$3\'"], "Id": "built"}}]\' > {images} ;;\n'
+                   f'esac\n')
+    cli.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(ephemeral, 'BACKEND', ephemeral.PodmanBackend())
+    monkeypatch.setattr(ephemeral, 'IMAGE_INDEX', {})
+    monkeypatch.setattr(ephemeral, 'IMAGE_DIGESTS', {(None, 'python:3.10-slim'): 'sha256:base'})
+    monkeypatch.setattr(ephemeral, 'gc_dependency_images', lambda keep=None: 0)
+    return log
+
+
+def test_header_packages_are_deduplicated_and_sorted():
+    assert ephemeral.resolve_runtime_config('python deps=rich,requests,rich')['deps'] == ['requests', 'rich']
+
+
+def test_install_command_fills_in_the_packages():
+    assert ephemeral.deps_install_command(['pip', 'install', '{deps}'], ['a', 'b']) == ['pip', 'install', 'a', 'b']
+    assert ephemeral.deps_install_command(['julia', '-e', 'Pkg.add([{deps}])'], ['A', 'B']) == ['julia', '-e', 'Pkg.add(["A", "B"])']
+
+
+def test_tag_depends_on_base_image_packages_and_command(monkeypatch):
+    monkeypatch.setattr(ephemeral, 'IMAGE_DIGESTS', {(None, 'python:3.10-slim'): 'sha256:a', (None, 'python:3.12'): 'sha256:b'})
+    tag = ephemeral.dependency_image_tag('python:3.10-slim', ['rich'], ['pip', 'install', 'rich'])
+    assert tag.startswith('localhost/ephemeral-deps:') and len(tag.rsplit(':', 1)[1]) == 16
+    assert tag == ephemeral.dependency_image_tag('python:3.10-slim', ['rich'], ['pip', 'install', 'rich'])
+    assert tag != ephemeral.dependency_image_tag('python:3.12', ['rich'], ['pip', 'install', 'rich'])
+    assert tag != ephemeral.dependency_image_tag('python:3.10-slim', ['rich==13'], ['pip', 'install', 'rich==13'])
+    assert tag != ephemeral.dependency_image_tag('python:3.10-slim', ['rich'], ['pip', 'install', '-U', 'rich'])
+    ephemeral.IMAGE_DIGESTS[(None, 'python:3.10-slim')] = 'sha256:rebuilt' # The base image was pulled again
+    assert tag != ephemeral.dependency_image_tag('python:3.10-slim', ['rich'], ['pip', 'install', 'rich'])
+
+
+@pytest.mark.parametrize('name', ['rich; rm -rf /', '--index-url=http://evil', '$(id)', 'a b', '`x`'])
+def test_unsafe_package_names_are_rejected(name, podman):
+    config = dict(ephemeral.resolve_runtime_config('python'), deps=[name])
+    with pytest.raises(ValueError, match='Invalid package name'):
+        ephemeral.use_dependency_image(config)
+    assert not podman.exists()
+
+
+@pytest.mark.parametrize('name', ['numpy>=1.26', 'rich[jupyter]', '@types/node', 'pkg_name.sub-1'])
+def test_version_specifiers_and_scoped_names_are_accepted(name):
+    assert ephemeral.DEP_NAME.match(name)
+
+
+def test_language_without_an_install_command_is_refused(podman):
+    config = dict(ephemeral.resolve_runtime_config('bash'), deps=['jq'])
+    with pytest.raises(ValueError, match='does not support deps='):
+        ephemeral.use_dependency_image(config)
+
+
+def test_image_is_built_once_and_then_reused(podman):
+    config = dict(ephemeral.resolve_runtime_config('python'), deps=['rich'])
+    first = ephemeral.use_dependency_image(config)
+    second = ephemeral.use_dependency_image(config)
+    assert first['image'] == second['image'] and first['image'].startswith('localhost/ephemeral-deps:')
+    assert [line.split()[0] for line in podman.read_text().splitlines()].count('build') == 1
+    assert ephemeral.load_deps_index()[first['image']]['deps'] == ['rich']
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import ephemeral
+
+IMAGES = '[{"Names": ["docker.io/library/python:3.10-slim", "ghcr.io/acme/tool:1"], "Id": "abc"}]'
+
+
+@pytest.fixture
+def podman(tmp_path, monkeypatch):
+    """A fake `podman` that logs its arguments and lists IMAGES."""
+    log = tmp_path / 'podman.log'
+    cli = tmp_path / 'podman'
+    cli.write_text(f"#!/bin/sh\necho \"$*\" >> {log}\n"
+                   f"case \"$1\" in images) echo '{IMAGES}' ;; image) exit 1 ;; esac\n")
+    cli.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(ephemeral, 'BACKEND', ephemeral.PodmanBackend())
+    monkeypatch.setattr(ephemeral, 'IMAGE_INDEX', {})
+    monkeypatch.setattr(ephemeral, 'IMAGE_CHECK_COST', None)
+    return log
+
+
+def calls(log):
+    return [line.split()[:2] for line in log.read_text().splitlines()]
+
+
+def test_normalized_names():
+    assert ephemeral.normalize_image_name('python') == 'docker.io/library/python:latest'
+    assert ephemeral.normalize_image_name('julia:1.9') == 'docker.io/library/julia:1.9'
+    assert ephemeral.normalize_image_name('acme/tool') == 'docker.io/acme/tool:latest'
+    assert ephemeral.normalize_image_name('localhost/ephemeral-deps:x') == 'localhost/ephemeral-deps:x'
+    assert ephemeral.normalize_image_name('ghcr.io/acme/tool@sha256:1') == 'ghcr.io/acme/tool@sha256:1'
+
+
+def test_one_listing_answers_every_lookup_and_calibrates_once(podman):
+    assert ephemeral.image_present('python:3.10-slim')
+    assert ephemeral.image_present('ghcr.io/acme/tool:1')
+    assert not ephemeral.image_present('rust:latest')
+    # One listing, then a single `image exists` to measure what each run used to pay
+    assert calls(podman) == [['images', '--format'], ['image', 'exists']]
+    assert ephemeral.IMAGE_CHECK_COST is not None
+    ephemeral.invalidate_image_index()
+    assert ephemeral.lookup_image_id('python:3.10-slim') == 'abc'
+    assert calls(podman)[2:] == [['images', '--format']] # Rebuilt after a pull or prune, not re-calibrated
+
+
+def test_failed_listing_falls_back_to_image_exists(podman, tmp_path):
+    (tmp_path / 'podman').write_text(f"#!/bin/sh\necho \"$*\" >> {podman}\n"
+                                     "case \"$1\" in images) exit 1 ;; image) exit 0 ;; esac\n")
+    assert ephemeral.image_present('python:3.10-slim')
+    assert calls(podman) == [['images', '--format'], ['image', 'exists']]
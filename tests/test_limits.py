@@ -0,0 +1,16 @@
+import ephemeral
+
+
+def test_invalid_header_value_falls_back_to_the_language_limit():
+    limits = ephemeral.resolve_runtime_config('rust timeout=abc memory=lots')['limits']
+    assert limits['timeout'] == 180.0
+    assert limits['memory'] == ephemeral.resolve_runtime_config('rust')['limits']['memory']
+
+
+def test_header_overrides_the_language_limit():
+    assert ephemeral.resolve_runtime_config('rust timeout=5')['limits']['timeout'] == 5.0
+
+
+def test_invalid_language_limit_falls_back_to_the_default():
+    limits = ephemeral.resolve_limits({'pids': 'many'}, {'pids': 'x'})
+    assert limits['pids'] == ephemeral.DEFAULT_LIMITS['pids']
@@ -0,0 +1,103 @@
+import json
+import time
+
+import pytest
+
+import ephemeral
+
+
+def test_stats_are_fetched_for_the_menu_not_every_tick(monkeypatch):
+    calls = []
+    info = {'host': {'memTotal': 8 * 2**30, 'memFree': 6 * 2**30, 'cpus': 4, 'cpuUtilization': {'idlePercent': 90.0}}}
+
+    def output(args, timeout=None):
+        calls.append(args)
+        return json.dumps(info).encode()
+
+    monkeypatch.setattr(ephemeral, 'backend_output', output)
+    monkeypatch.setitem(ephemeral.READINESS, 'ready', True)
+    monkeypatch.setattr(ephemeral, 'MACHINE', dict(ephemeral.MACHINE, last_activity=time.time(), stats=None))
+    for _ in range(5): ephemeral.machine_tick(None)
+    assert calls == []
+    ephemeral.request_machine_stats()
+    for _ in range(50):
+        if ephemeral.MACHINE['stats']: break
+        time.sleep(0.02)
+    assert ephemeral.MACHINE['stats']['cpu_percent'] == 10.0 and len(calls) == 1
+    ephemeral.request_machine_stats() # Still fresh: no second `podman info`
+    assert len(calls) == 1 and not ephemeral.MACHINE['stats_refreshing']
+
+
+@pytest.fixture
+def machine(monkeypatch):
+    """Ready machine, empty activity history; stops and pre-boots are recorded instead of run."""
+    actions = []
+    monkeypatch.setattr(ephemeral, 'MACHINE', dict(ephemeral.MACHINE, history={}, stopped_at=None, preboot_slot=None,
+                                                   last_activity=time.time()))
+    monkeypatch.setitem(ephemeral.READINESS, 'ready', True)
+    monkeypatch.setattr(ephemeral, 'refresh_machine_stats', lambda: None)
+    monkeypatch.setattr(ephemeral, 'stop_idle_machine', lambda icon, reason: actions.append(('stop', reason)))
+    monkeypatch.setattr(ephemeral, 'start_readiness_probe', lambda icon: actions.append(('preboot',)))
+    return actions
+
+
+def busy_in(ts, weeks):
+    """History with runs in ts's hour of the week, in each of the given weeks ago."""
+    return {ephemeral.activity_slot(ts): [time.strftime('%Y-%m-%d', time.localtime(ts - w * 7 * 86400)) for w in weeks]}
+
+
+def test_hour_is_busy_after_runs_in_enough_recent_weeks(machine):
+    now = time.time()
+    ephemeral.MACHINE['history'] = busy_in(now, [1])
+    assert not ephemeral.predicted_busy(now)
+    ephemeral.MACHINE['history'] = busy_in(now, [1, 2])
+    assert ephemeral.predicted_busy(now)
+    ephemeral.MACHINE['history'] = busy_in(now, [1, 6]) # Six weeks ago is outside MACHINE_HISTORY_WEEKS
+    assert not ephemeral.predicted_busy(now)
+
+
+def test_idle_machine_is_stopped_unless_the_hour_is_usually_busy(machine, monkeypatch):
+    now = time.time()
+    ephemeral.MACHINE['last_activity'] = now - 10 * 60
+    ephemeral.machine_tick(None, now)
+    assert machine == [] # Not idle long enough
+    ephemeral.MACHINE['last_activity'] = now - 25 * 60
+    ephemeral.MACHINE['history'] = busy_in(now, [1, 2])
+    ephemeral.machine_tick(None, now)
+    assert machine == []
+    ephemeral.MACHINE['history'] = {}
+    ephemeral.machine_tick(None, now)
+    assert machine == [('stop', 'idle 25 min')]
+    monkeypatch.setattr(ephemeral, 'MACHINE_IDLE_MINUTES', 0)
+    ephemeral.machine_tick(None, now)
+    assert len(machine) == 1
+
+
+def test_stopped_machine_is_prebooted_once_before_a_busy_hour(machine):
+    now = time.time()
+    upcoming = now + ephemeral.MACHINE_PREBOOT_LEAD_MINUTES * 60
+    ephemeral.READINESS['ready'] = False
+    ephemeral.MACHINE['stopped_at'] = now - 3600
+    ephemeral.machine_tick(None, now)
+    assert machine == []
+    ephemeral.MACHINE['history'] = busy_in(upcoming, [1, 2])
+    ephemeral.machine_tick(None, now)
+    assert machine == [('preboot',)] and ephemeral.MACHINE['stopped_at'] is None
+    ephemeral.MACHINE['stopped_at'] = now # Stopped again by hand in the same hour: no second pre-boot
+    ephemeral.machine_tick(None, now)
+    assert machine == [('preboot',)]
+
+
+def test_activity_is_recorded_once_per_hour_and_day(monkeypatch):
+    monkeypatch.setattr(ephemeral, 'MACHINE', dict(ephemeral.MACHINE, history=None))
+    ephemeral.record_machine_activity()
+    ephemeral.record_machine_activity()
+    with open(ephemeral.MACHINE_ACTIVITY_FILE, 'r', encoding='utf-8') as f:
+        history = json.load(f)
+    assert history == {ephemeral.activity_slot(time.time()): [time.strftime('%Y-%m-%d')]}
+
+
+def test_machine_in_use_is_never_stopped(monkeypatch):
+    monkeypatch.setattr(ephemeral, 'ACTIVE_RUNS', 1)
+    monkeypatch.setattr(ephemeral.subprocess, 'run', lambda *a, **k: pytest.fail("stopped a busy machine"))
+    assert not ephemeral.stop_idle_machine(None)
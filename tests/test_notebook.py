@@ -0,0 +1,76 @@
+import threading
+import time
+
+import ephemeral
+
+
+def test_prose_fences_are_skipped_without_pulling(monkeypatch):
+    monkeypatch.setattr(ephemeral, 'image_present', lambda image: False)
+    pulls = []
+    blocks = [('text', 'just notes'), ('json', '{"a": 1}'), ('yaml', 'a: 1'), (None, 'plain fence')]
+    records = ephemeral.execute_notebook(blocks, pull=lambda image: pulls.append(image) or 1)
+    assert pulls == []
+    assert [r['status'] for r in records] == ['skipped'] * 4
+    assert "Unknown language 'text'" in records[0]['note']
+    assert ephemeral.notebook_ok(records)
+    assert '0 not ok, 4 skipped as prose' in ephemeral.render_notebook_result(records, 0.0)
+
+
+def test_unknown_language_with_image_still_runs(monkeypatch):
+    monkeypatch.setattr(ephemeral, 'image_present', lambda image: False)
+    pulls = []
+    records = ephemeral.execute_notebook([('cobol image=esolang/cobol', 'x')], pull=lambda image: pulls.append(image) or 1)
+    assert pulls == ['esolang/cobol']
+    assert records[0]['note'] == 'Image esolang/cobol unavailable.'
+    assert not ephemeral.notebook_ok(records)
+
+
+class Icon:
+    def notify(self, message, title=None): pass
+
+
+def dispatch(monkeypatch, content):
+    calls = []
+    monkeypatch.setattr(ephemeral, 'run_notebook', lambda icon, blocks, job=None: calls.append(('notebook', len(blocks))))
+    monkeypatch.setattr(ephemeral, 'run_on_connection', lambda icon, config, code, lang, job=None: calls.append((lang, code)))
+    ephemeral.run_logic(Icon(), content)
+    return calls
+
+
+def test_code_block_with_prose_fences_runs_on_its_own(monkeypatch):
+    content = "Output:\n```text\n42\n```\n\n```python\nprint(42)\n```\n"
+    assert dispatch(monkeypatch, content) == [('python', 'print(42)\n')]
+
+
+def test_two_code_blocks_run_as_a_notebook(monkeypatch):
+    content = "```python\nprint(1)\n```\n```text\nnote\n```\n```ruby\nputs 2\n```\n"
+    assert dispatch(monkeypatch, content) == [('notebook', 3)]
+
+
+def test_parallel_blocks_stay_within_the_worker_count(monkeypatch):
+    monkeypatch.setattr(ephemeral, 'image_present', lambda image: True)
+    monkeypatch.setattr(ephemeral, 'WORKER_COUNT', 2)
+    monkeypatch.setattr(ephemeral, 'NOTEBOOK_WORKERS', 4)
+    job = {'cancelled': False, 'kills': set()}
+    monkeypatch.setattr(ephemeral, 'JOB_RUNNING', [job])
+    state = {'now': 0, 'peak': 0}
+    lock = threading.Lock()
+
+    def run_block(block, job=None, trace=None, connection=None):
+        with lock:
+            state['now'] += 1
+            state['peak'] = max(state['peak'], state['now'] + len(ephemeral.JOB_RUNNING) - 1)
+        time.sleep(0.05)
+        with lock: state['now'] -= 1
+        block['status'] = 'ok'
+        return block
+
+    monkeypatch.setattr(ephemeral, 'run_block', run_block)
+    records = ephemeral.execute_notebook([('python', 'print(1)')] * 5, job)
+    assert [r['status'] for r in records] == ['ok'] * 5
+    assert state['peak'] == 2 and ephemeral.JOB_SLOTS['borrowed'] == 0
+
+    monkeypatch.setattr(ephemeral, 'JOB_RUNNING', [job, {'cancelled': False}]) # Another job holds the other worker
+    state['peak'] = 0
+    ephemeral.execute_notebook([('python', 'print(1)')] * 3, job)
+    assert state['peak'] == 2 # This notebook ran its blocks one at a time
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+
+import ephemeral
+
+
+def test_head_and_tail_are_kept_with_a_truncation_note():
+    output = ephemeral.BoundedOutput(10, 5)
+    for n in range(100): output.feed(f"{n:02d}".encode())
+    output.feed(b'', final=True)
+    assert output.getvalue() == "0001020304\n\n[... Ephemeral truncated 185 characters ...]\n\n79899"
+    assert output.total == 200
+
+
+def test_short_output_is_returned_whole():
+    output = ephemeral.BoundedOutput(10, 5)
+    output.feed(b'hello')
+    output.feed(b' world', final=True)
+    assert output.getvalue() == 'hello world'
+
+
+def test_split_utf8_and_ansi_sequences_are_reassembled():
+    output = ephemeral.BoundedOutput(100, 100)
+    data = 'résumé \x1b[31mred\x1b[0m'.encode()
+    for i in range(len(data)): output.feed(data[i:i + 1]) # One byte at a time
+    output.feed(b'', final=True)
+    assert output.getvalue() == 'résumé red'
+
+
+def test_output_limit_kills_the_process():
+    process = subprocess.Popen([sys.executable, '-c', 'while True: print("x" * 1000)'],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, _, limit = ephemeral.stream_process(process, b'', timeout=20, max_output=100_000)
+    assert limit == 'output' and process.returncode != 0
+    assert len(stdout) <= (ephemeral.OUTPUT_HEAD_KB + ephemeral.OUTPUT_TAIL_KB) * 1024 + 100
+
+
+def test_timeout_kills_the_process():
+    process = subprocess.Popen([sys.executable, '-c', 'import time; print("started", flush=True); time.sleep(30)'],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, _, limit = ephemeral.stream_process(process, b'', timeout=0.5)
+    assert limit == 'timeout' and stdout == 'started\n'
@@ -0,0 +1,113 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import ephemeral
+from podman_standin import PodmanStandin
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="needs unix sockets")
+
+
+@pytest.fixture
+def standin(tmp_path):
+    server = PodmanStandin(str(tmp_path / 'podman.sock'))
+    yield server
+    server.close()
+
+
+def run(backend, args, stdin=b''):
+    process = backend.popen(backend.argv(args), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process.stdin.write(stdin)
+    process.stdin.close()
+    out, err = process.communicate(timeout=20)
+    return process.returncode, out, err
+
+
+def test_create_attach_start_wait_flow(standin):
+    backend = ephemeral.PodmanApiBackend(standin.url)
+    code = "import sys; data = sys.stdin.read(); print(data.upper()); print('warn', file=sys.stderr); sys.exit(3)"
+    returncode, out, err = run(backend, ['run', '--rm', '-i', '--pull=never', '--name', 'x', '--network', 'none',
+                                         '--memory', '256m', 'python:3.10-slim', sys.executable, '-c', code], b'hello')
+    assert (returncode, out, err) == (3, b'HELLO\n', b'warn\n')
+    calls = [(method, path.split('?')[0].rsplit('/', 1)[-1]) for method, path in standin.log]
+    assert calls[0] == ('POST', 'create') and calls[-2:] == [('POST', 'wait'), ('DELETE', calls[-1][1])]
+    assert [c for c in calls if c[1] in ('attach', 'start')] == [('POST', 'attach'), ('POST', 'start')]
+    assert not standin.containers # Removed once its exit code was read
+
+
+def test_missing_image_fails_the_run_without_the_cli(standin):
+    backend = ephemeral.PodmanApiBackend(standin.url)
+    returncode, _, err = run(backend, ['run', '--rm', '-i', 'missing:latest', 'true'])
+    assert returncode == 125 and b'image not known' in err
+    assert backend.popen(backend.argv(['image', 'exists', 'missing:latest'])).wait() == 1
+    assert backend.popen(backend.argv(['image', 'exists', 'python:3.10-slim'])).wait() == 0
+
+
+def test_attach_stream_is_demultiplexed_across_split_frames():
+    backend = ephemeral.PodmanApiBackend('unix:///nonexistent/podman.sock')
+    process = ephemeral.ApiProcess(subprocess.PIPE, subprocess.PIPE)
+    ours, theirs = socket.socketpair()
+    frames = b''.join(bytes([stream, 0, 0, 0]) + len(data).to_bytes(4, 'big') + data
+                      for stream, data in ((1, b'out-1 '), (2, b'err-1 '), (1, b''), (1, b'out-2' * 20000), (2, b'err-2')))
+
+    def send():
+        for position in range(3, len(frames), 7): # Headers and payloads split at odd offsets
+            theirs.sendall(frames[position:position + 7])
+        theirs.close()
+
+    threading.Thread(target=send, daemon=True).start()
+    threading.Thread(target=backend.pump_attach, args=(ours, frames[:3], 'c', process), daemon=True).start()
+    out, err = process.communicate(timeout=20)
+    assert out == b'out-1 ' + b'out-2' * 20000 and err == b'err-1 err-2'
+    assert process.returncode == 137 # The exit code could not be read from the (unreachable) service
+
+
+def test_unreachable_api_falls_back_to_the_cli(tmp_path, monkeypatch):
+    cli = tmp_path / 'podman'
+    cli.write_text('#!/bin/sh\necho "cli $*"\n')
+    cli.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    socket_path = str(tmp_path / 'podman.sock')
+    backend = ephemeral.PodmanApiBackend(f"unix://{socket_path}")
+    out, _ = backend.popen(backend.argv(['info']), stdout=subprocess.PIPE).communicate(timeout=20)
+    assert out == f"cli --url unix://{socket_path} info\n".encode()
+    standin = PodmanStandin(socket_path)
+    try:
+        backend.popen(backend.argv(['info']), stdout=subprocess.PIPE).communicate(timeout=20)
+        assert standin.log == [] # Still inside RETRY_SECONDS: the CLI is used without retrying the socket
+        backend.down_until = 0
+        assert backend.popen(backend.argv(['info'])).wait() == 0
+        assert standin.log == [('GET', 'libpod/_ping')]
+    finally: standin.close()
+
+
+def test_only_idempotent_requests_are_retried_on_a_stale_connection(standin):
+    backend = ephemeral.PodmanApiBackend(standin.url)
+    assert backend.request('GET', '/libpod/_ping')[0] == 200
+    standin.drop_connections()
+    time.sleep(0.1)
+    assert backend.request('GET', '/libpod/_ping')[0] == 200 # Retried on a fresh connection
+    standin.drop_connections()
+    time.sleep(0.1)
+    with pytest.raises(OSError):
+        backend.request('POST', '/libpod/containers/create', {'image': 'python:3.10-slim', 'command': ['true']})
+    assert not standin.containers
+
+
+def test_failed_cleanup_does_not_rerun_the_snippet_on_the_cli(standin, monkeypatch):
+    backend = ephemeral.PodmanApiBackend(standin.url)
+    request = backend.request
+
+    def flaky(method, path, body=None):
+        if method == 'DELETE' or path.endswith('/start'): raise OSError("connection reset")
+        return request(method, path, body)
+
+    monkeypatch.setattr(backend, 'request', flaky)
+    monkeypatch.setattr(subprocess, 'Popen', lambda *a, **k: pytest.fail("fell back to the CLI"))
+    process = backend.popen(backend.argv(['run', '--rm', 'python:3.10-slim', 'true']), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert process.wait() == 125 and b'connection reset' in process.stderr.read()
@@ -0,0 +1,75 @@
+import os
+import time
+
+import pytest
+
+import ephemeral
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    """A fake `podman` that logs its arguments; `run -d` prints a container id."""
+    log = tmp_path / 'podman.log'
+    cli = tmp_path / 'podman'
+    cli.write_text(f'#!/bin/sh\necho "$*" >> {log}\n'
+                   'case "$1" in run) echo "warm-$$" ;; image) echo \'["/entry"]\' ;; esac\n')
+    cli.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(ephemeral, 'BACKEND', ephemeral.PodmanBackend())
+    monkeypatch.setattr(ephemeral, 'POOL_ENABLED', True)
+    monkeypatch.setattr(ephemeral, 'POOL_MAX_LANGS', 2)
+    monkeypatch.setattr(ephemeral, 'WARM_POOL', {})
+    monkeypatch.setattr(ephemeral, 'WARM_POOL_USAGE', ephemeral.OrderedDict())
+    monkeypatch.setattr(ephemeral, 'WARM_POOL_PENDING', {})
+    monkeypatch.setattr(ephemeral, 'WARM_POOL_REAPER', object()) # No reaper thread
+    monkeypatch.setattr(ephemeral, 'IMAGE_ENTRYPOINTS', {})
+    return log
+
+
+def commands(log, verb):
+    return [line for line in log.read_text().splitlines() if line.split()[0] == verb] if log.exists() else []
+
+
+def wait_for(condition):
+    for _ in range(250):
+        if condition(): return
+        time.sleep(0.02)
+    raise AssertionError("timed out")
+
+
+def test_warm_container_serves_one_run_and_is_replaced(pool):
+    config = ephemeral.resolve_runtime_config('python')
+    assert ephemeral.acquire_warm_container(config) is None # Cold until the language was used once
+    ephemeral.recycle_warm_pool(config)
+    wait_for(lambda: ephemeral.WARM_POOL.get(ephemeral.pool_key(config)))
+    warm = ephemeral.acquire_warm_container(config)
+    assert warm['id'].startswith('warm-') and ephemeral.acquire_warm_container(config) is None
+    assert ephemeral.build_exec_command(config, warm)[:4] == ['podman', 'exec', '-i', warm['id']]
+    assert ephemeral.build_exec_command(config, warm)[4] == '/entry' # The image's entrypoint, re-applied
+    assert '--network none' in commands(pool, 'run')[0]
+    ephemeral.recycle_warm_pool(config)
+    wait_for(lambda: ephemeral.WARM_POOL.get(ephemeral.pool_key(config)))
+    assert len(commands(pool, 'run')) == 2
+    ephemeral.discard_warm_container(warm)
+    ephemeral.shutdown_warm_pool()
+    assert len(commands(pool, 'rm')) == 2 and not ephemeral.WARM_POOL
+
+
+def test_least_recently_used_language_loses_its_pool(pool):
+    configs = [ephemeral.resolve_runtime_config(lang) for lang in ('python', 'ruby', 'lua')]
+    for config in configs[:2]: ephemeral.recycle_warm_pool(config)
+    wait_for(lambda: len(commands(pool, 'run')) == 2 and sum(map(len, ephemeral.WARM_POOL.values())) == 2)
+    ephemeral.recycle_warm_pool(configs[2])
+    wait_for(lambda: len(commands(pool, 'rm')) == 1 and len(commands(pool, 'run')) == 3)
+    assert list(ephemeral.WARM_POOL_USAGE) == [ephemeral.pool_key(c) for c in configs[1:]]
+    assert ephemeral.pool_key(configs[0]) not in ephemeral.WARM_POOL
+    ephemeral.shutdown_warm_pool()
+
+
+def test_runs_needing_network_or_mounts_start_cold(pool, monkeypatch):
+    config = ephemeral.resolve_runtime_config('python')
+    assert ephemeral.pool_eligible(config)
+    assert not ephemeral.pool_eligible(ephemeral.resolve_runtime_config('python unsafe'))
+    assert not ephemeral.pool_eligible(dict(config, mounts=[('/cache', '/artifact', 'ro')]))
+    monkeypatch.setattr(ephemeral, 'BACKEND', ephemeral.LocalBackend())
+    assert not ephemeral.pool_eligible(config)
@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+
+import pytest
+
+import ephemeral
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="Windows reads the real idle time")
+def test_prefetch_is_not_blocked_by_missing_idle_signal(monkeypatch):
+    monkeypatch.setattr(ephemeral, 'PREFETCH_ENABLED', True)
+    monkeypatch.setattr(ephemeral, 'ACTIVE_RUNS', 0)
+    monkeypatch.setitem(ephemeral.READINESS, 'ready', True)
+    assert ephemeral.user_idle_seconds() >= ephemeral.PREFETCH_IDLE_SECONDS
+    assert ephemeral.prefetch_allowed()
+    monkeypatch.setattr(ephemeral, 'ACTIVE_RUNS', 1)
+    assert not ephemeral.prefetch_allowed()
+
+
+@pytest.fixture
+def idle(tmp_path, monkeypatch):
+    """Prefetch gates open, against a fake `podman` whose `pull` adds the image to its listing."""
+    images = tmp_path / 'images.json'
+    images.write_text('[]')
+    cli = tmp_path / 'podman'
+    cli.write_text(f'#!/bin/sh\ncase "$1" in\n'
+                   f'  images) cat {images} ;;\n'
+                   f'  pull) [ -f {tmp_path}/slow ] && sleep 30; echo \'[{{"Names": ["\'$3\'"], "Id": "new"}}]\' > {images} ;;\n'
+                   f'  image) echo 2097152 ;;\n'
+                   f'esac\n')
+    cli.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(ephemeral, 'BACKEND', ephemeral.PodmanBackend())
+    monkeypatch.setattr(ephemeral, 'IMAGE_INDEX', {})
+    monkeypatch.setattr(ephemeral, 'PREFETCH_ENABLED', True)
+    monkeypatch.setattr(ephemeral, 'ACTIVE_RUNS', 0)
+    monkeypatch.setattr(ephemeral, 'PREFETCH_BUDGET', {'window_start': time.time(), 'bytes': 0})
+    monkeypatch.setattr(ephemeral, 'user_idle_seconds', lambda: 3600)
+    monkeypatch.setitem(ephemeral.READINESS, 'ready', True)
+    return tmp_path
+
+
+def test_candidates_are_the_most_used_missing_or_stale_images(idle, monkeypatch):
+    monkeypatch.setattr(ephemeral, 'PREFETCH_TOP_N', 2)
+    (idle / 'images.json').write_text('[{"Names": ["docker.io/library/python:3.12"], "Id": "py"}]')
+    now = time.time()
+    ephemeral.save_usage_history({
+        'python:3.12': {'count': 10, 'last': now, 'refreshed': now},  # Present and fresh
+        'julia:1.9': {'count': 10, 'last': now - 30 * 86400},         # Not used for a month: decays out of the top N
+        'rust:latest': {'count': 3, 'last': now},
+    })
+    assert ephemeral.prefetch_candidates() == ['rust:latest']
+
+
+def test_pull_marks_the_image_refreshed_and_charges_the_budget(idle, monkeypatch):
+    monkeypatch.setattr(ephemeral, 'PREFETCH_MAX_MB_PER_HOUR', 1)
+    ephemeral.save_usage_history({'rust:latest': {'count': 1, 'last': time.time()}})
+    ephemeral.prefetch_image('rust:latest')
+    assert ephemeral.lookup_image_id('rust:latest') == 'new'
+    assert ephemeral.load_usage_history()['rust:latest']['refreshed'] > 0
+    assert ephemeral.PREFETCH_BUDGET['bytes'] == 2097152
+    assert not ephemeral.prefetch_allowed() # 2 MB pulled against a 1 MB hourly budget
+
+
+def test_starting_a_run_cancels_the_pull(idle):
+    (idle / 'slow').touch()
+    ephemeral.save_usage_history({'rust:latest': {'count': 1, 'last': time.time()}})
+    prefetch = threading.Thread(target=ephemeral.prefetch_image, args=('rust:latest',))
+    prefetch.start()
+    for _ in range(250):
+        if ephemeral.PREFETCH_PROCESSES: break
+        time.sleep(0.02)
+    ephemeral.mark_run_started()
+    prefetch.join(10)
+    assert not prefetch.is_alive() and not ephemeral.PREFETCH_PROCESSES
+    assert 'refreshed' not in ephemeral.load_usage_history()['rust:latest'] # Retried on a later pass
+    ephemeral.mark_run_finished()
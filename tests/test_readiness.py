@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+
+import pytest
+
+import ephemeral
+
+
+class Icon:
+    def __init__(self): self.notes = []
+    def notify(self, message, title=None): self.notes.append(message)
+
+
+@pytest.fixture
+def podman(tmp_path, monkeypatch):
+    """A fake `podman`: `info` answers once `machine start` has run (or `up` exists), after `delay` seconds."""
+    log = tmp_path / 'podman.log'
+    cli = tmp_path / 'podman'
+    cli.write_text(f'#!/bin/sh\necho "$*" >> {log}\n'
+                   f'case "$1" in\n'
+                   f'  info) [ -f {tmp_path}/delay ] && sleep "$(cat {tmp_path}/delay)"; [ -f {tmp_path}/up ] ;;\n'
+                   f'  machine) touch {tmp_path}/up ;;\n'
+                   f'esac\n')
+    cli.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(ephemeral, 'BACKEND', ephemeral.PodmanBackend())
+    monkeypatch.setattr(ephemeral, 'READINESS', {'ready': None, 'checked': 0.0, 'probe': None, 'cancelled': False, 'procs': set()})
+    monkeypatch.setattr(ephemeral, 'MACHINE', dict(ephemeral.MACHINE))
+    return tmp_path
+
+
+def calls(podman):
+    log = podman / 'podman.log'
+    return log.read_text().splitlines() if log.exists() else []
+
+
+def test_concurrent_runs_share_one_probe_and_trust_its_answer(podman):
+    (podman / 'up').touch()
+    (podman / 'delay').write_text('0.3')
+    results = []
+    waiters = [threading.Thread(target=lambda: results.append(ephemeral.wait_for_podman(Icon()))) for _ in range(3)]
+    for waiter in waiters: waiter.start()
+    for waiter in waiters: waiter.join(10)
+    assert results == [True] * 3 and calls(podman) == ['info']
+    assert ephemeral.wait_for_podman(Icon()) and calls(podman) == ['info'] # Fresh: no new probe
+    ephemeral.READINESS['checked'] -= ephemeral.PODMAN_STATUS_TTL
+    assert ephemeral.wait_for_podman(Icon()) and calls(podman) == ['info', 'info']
+
+
+def test_probe_boots_a_stopped_machine(podman):
+    icon = Icon()
+    ephemeral.MACHINE['stopped_at'] = time.time()
+    assert ephemeral.wait_for_podman(icon)
+    assert calls(podman) == ['info', 'machine start']
+    assert icon.notes[-1] == "Podman machine started successfully."
+    assert ephemeral.MACHINE['stopped_at'] is None
+
+
+def test_quitting_kills_a_probe_in_flight(podman):
+    (podman / 'delay').write_text('30')
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(ephemeral.wait_for_podman(Icon())))
+    waiter.start()
+    for _ in range(250):
+        if ephemeral.READINESS['procs']: break
+        time.sleep(0.02)
+    ephemeral.cancel_readiness_probe()
+    waiter.join(10)
+    assert results == [False] and calls(podman) == ['info'] # No machine start after a cancel
@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+
+import ephemeral
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    """Empty user and system language dirs; the built-in index comes back afterwards."""
+    user, system = tmp_path / 'user', tmp_path / 'system'
+    user.mkdir()
+    system.mkdir()
+    monkeypatch.setattr(ephemeral, 'USER_REGISTRY_DIR', str(user))
+    monkeypatch.setattr(ephemeral, 'SYSTEM_REGISTRY_DIR', str(system))
+    monkeypatch.setattr(ephemeral, 'REGISTRY', {})
+    monkeypatch.setattr(ephemeral, 'LANG_INDEX', ephemeral.LANG_INDEX)
+    return user, system
+
+
+def write(directory, name, data, mtime=None):
+    path = directory / name
+    path.write_text(json.dumps(data))
+    if mtime: os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_rebuild_swaps_the_index_instead_of_mutating_it():
+    before = ephemeral.LANG_INDEX
+    snapshot = dict(before)
+    ephemeral.rebuild_lang_index()
+    assert ephemeral.LANG_INDEX is not before
+    assert before == snapshot # A reader holding the old tables keeps a consistent set
+    assert ephemeral.canonical_lang('python') == 'python'
+
+
+def test_user_files_win_and_tune_built_in_languages(registry):
+    user, system = registry
+    write(system, 'zig.json', {'image': 'zig:system', 'cmd': 'zig run -', 'aliases': ['ZIGLANG']})
+    write(user, 'zig.json', {'image': 'zig:user', 'cmd': ['zig', 'run', '-']})
+    write(user, 'python.json', {'pool_size': 0}) # Only a tweak: the built-in image and cmd stay
+    ephemeral.load_registry()
+    assert ephemeral.lang_config('zig')['image'] == 'zig:user'
+    assert ephemeral.canonical_lang('ziglang') is None # The user file replaced the system one, aliases and all
+    python = ephemeral.lang_config('python')
+    assert python['pool_size'] == 0 and python['image'] == ephemeral.LANG_MAP['python']['image']
+    assert ephemeral.resolve_runtime_config('zig')['image'] == 'zig:user'
+
+
+def test_hot_reload_picks_up_changes_and_removals(registry):
+    user, _ = registry
+    path = write(user, 'zig.json', {'image': 'zig:1', 'cmd': ['zig'], 'aliases': ['zg']}, mtime=1000)
+    ephemeral.load_registry()
+    assert ephemeral.canonical_lang('zg') == 'zig' and ephemeral.lang_config('zig')['image'] == 'zig:1'
+    write(user, 'zig.json', {'image': 'zig:2', 'cmd': ['zig'], 'aliases': ['zg']}, mtime=2000)
+    ephemeral.load_registry()
+    assert ephemeral.lang_config('zig')['image'] == 'zig:2'
+    path.unlink()
+    ephemeral.load_registry()
+    assert ephemeral.canonical_lang('zg') is None and ephemeral.lang_config('zig') is None
+
+
+def test_unchanged_files_are_not_parsed_again(registry, monkeypatch):
+    user, _ = registry
+    write(user, 'zig.json', {'image': 'zig:1', 'cmd': ['zig'], 'aliases': ['zg']}, mtime=1000)
+    ephemeral.load_registry()
+    ephemeral.REGISTRY.clear() # As after a restart: aliases come from the scan cache
+    parsed = []
+    parse = ephemeral.parse_registry_file
+    monkeypatch.setattr(ephemeral, 'parse_registry_file', lambda path: parsed.append(path) or parse(path))
+    ephemeral.load_registry()
+    assert parsed == [] and ephemeral.canonical_lang('zg') == 'zig'
+    assert ephemeral.lang_config('zig')['image'] == 'zig:1' # Parsed on first use
+    assert len(parsed) == 1
+
+
+def test_invalid_file_is_skipped(registry, capsys):
+    user, _ = registry
+    (user / 'broken.json').write_text('{not json')
+    write(user, 'cmdless.json', {'image': 'x', 'cmd': 5})
+    ephemeral.load_registry()
+    assert ephemeral.lang_config('broken') is None and ephemeral.lang_config('cmdless') is None
+    assert 'Invalid language file' in capsys.readouterr().out
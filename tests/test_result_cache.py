@@ -0,0 +1,17 @@
+import ephemeral
+
+
+def test_cached_subdirectories_are_replayed(tmp_path, monkeypatch):
+    monkeypatch.setattr(ephemeral, 'RESULT_CACHE_DIR', str(tmp_path / 'cache'))
+    first = tmp_path / 'first'
+    (first / 'plots' / 'raw').mkdir(parents=True)
+    (first / 'plots' / 'raw' / 'a.csv').write_text('1,2\n')
+    (first / 'summary.txt').write_text('ok\n')
+    ephemeral.store_cached_result('k', {'output_dir': str(first), 'returncode': 0, 'stdout': 'out', 'stderr': ''})
+    second = tmp_path / 'second'
+    second.mkdir()
+    result = {'output_dir': str(second)}
+    assert ephemeral.load_cached_result('k', result)
+    assert (second / 'plots' / 'raw' / 'a.csv').read_text() == '1,2\n'
+    assert (second / 'summary.txt').read_text() == 'ok\n'
+    assert result['stdout'] == 'out' and result['cached']
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import deque
+
+import pytest
+
+import ephemeral
+
+
+class Icon:
+    title = ''
+
+    def __init__(self): self.notes = []
+    def notify(self, message, title=None): self.notes.append(message)
+    def update_menu(self): pass
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """Fresh queues and workers; run_logic waits until the test releases that clipboard's content."""
+    monkeypatch.setattr(ephemeral, 'JOB_LOCK', threading.Condition())
+    monkeypatch.setattr(ephemeral, 'JOB_QUEUE', deque())
+    monkeypatch.setattr(ephemeral, 'JOB_RUNNING', [])
+    monkeypatch.setattr(ephemeral, 'JOB_WORKERS', [])
+    monkeypatch.setattr(ephemeral, 'JOB_SEQ', {'next_id': 1, 'next_delivery': 1, 'done': set()})
+    monkeypatch.setattr(ephemeral, 'JOB_SLOTS', {'borrowed': 0})
+    monkeypatch.setattr(ephemeral, 'WORKER_COUNT', 2)
+    state = {'release': {}, 'started': [], 'delivered': []}
+
+    def run_logic(icon, content, job):
+        state['started'].append(content)
+        job['kills'].add(state['release'].setdefault(content, threading.Event()).set)
+        state['release'][content].wait(10)
+        if not job['cancelled']: ephemeral.deliver_in_order(job, lambda: state['delivered'].append(content))
+
+    monkeypatch.setattr(ephemeral, 'run_logic', run_logic)
+    yield state
+    for event in state['release'].values(): event.set()
+    wait_for(lambda: not ephemeral.JOB_RUNNING)
+
+
+def wait_for(condition):
+    for _ in range(250):
+        if condition(): return
+        time.sleep(0.02)
+    raise AssertionError("timed out")
+
+
+def test_results_are_delivered_in_submission_order(scheduler):
+    icon = Icon()
+    ephemeral.submit_job(icon, 'first')
+    ephemeral.submit_job(icon, 'second')
+    wait_for(lambda: len(scheduler['started']) == 2)
+    scheduler['release']['second'].set()
+    time.sleep(0.1)
+    assert scheduler['delivered'] == [] # Finished first, but waits for the earlier press
+    scheduler['release']['first'].set()
+    wait_for(lambda: len(scheduler['delivered']) == 2)
+    assert scheduler['delivered'] == ['first', 'second']
+
+
+def test_identical_clipboard_is_not_queued_twice(scheduler):
+    icon = Icon()
+    ephemeral.submit_job(icon, 'same')
+    ephemeral.submit_job(icon, 'same')
+    assert icon.notes == ["That clipboard is already queued or running."]
+    wait_for(lambda: scheduler['started'] == ['same'])
+    scheduler['release']['same'].set()
+    wait_for(lambda: scheduler['delivered'] == ['same'])
+    ephemeral.submit_job(icon, 'same') # Done: the same clipboard may run again
+    wait_for(lambda: scheduler['started'] == ['same', 'same'])
+
+
+def test_workers_are_bounded_and_cancelled_jobs_are_skipped(scheduler):
+    icon = Icon()
+    for content in ('a', 'b', 'c', 'd'): ephemeral.submit_job(icon, content)
+    wait_for(lambda: len(scheduler['started']) == 2)
+    time.sleep(0.1)
+    assert scheduler['started'] == ['a', 'b'] and len(ephemeral.JOB_QUEUE) == 2
+    ephemeral.cancel_job(icon, 3) # Queued: dropped without running
+    ephemeral.cancel_job(icon, 1) # Running: its kill callbacks fire
+    wait_for(lambda: len(scheduler['started']) == 3)
+    scheduler['release']['b'].set()
+    scheduler['release'].setdefault('d', threading.Event()).set()
+    wait_for(lambda: scheduler['delivered'] == ['b', 'd'])
+    assert scheduler['started'] == ['a', 'b', 'd']
+    wait_for(lambda: icon.title == ephemeral.APP_NAME) # No running or queued jobs left
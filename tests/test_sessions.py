@@ -0,0 +1,38 @@
+import pytest
+
+import ephemeral
+
+
+def python_session(tmp_path, monkeypatch):
+    monkeypatch.setattr(ephemeral, 'BACKEND', ephemeral.LocalBackend())
+    monkeypatch.setattr(ephemeral, 'ARTIFACT_STAGING_DIR', str(tmp_path))
+    return {'session': 'python', 'image': 'python:3.10-slim', 'flags': {'session'},
+            'limits': dict(ephemeral.DEFAULT_LIMITS, timeout=20)}
+
+
+def test_snippet_reading_stdin_gets_eof_and_keeps_the_kernel(tmp_path, monkeypatch):
+    config = python_session(tmp_path, monkeypatch)
+    try:
+        first = ephemeral.execute_in_session(config, "x = 41\ntry: input()\nexcept EOFError: print('eof')\n", 'python')
+        assert first['returncode'] == 0 and first['stdout'].strip() == 'eof'
+        second = ephemeral.execute_in_session(config, "import sys\nprint(x + 1, repr(sys.stdin.read()))\n", 'python')
+        assert second['returncode'] == 0 and second['stdout'].strip() == "42 ''"
+    finally:
+        ephemeral.shutdown_sessions()
+
+
+def test_kernel_keeps_its_datasets_pinned_until_it_stops(tmp_path, monkeypatch):
+    config = python_session(tmp_path, monkeypatch)
+    source = tmp_path / 'sales.csv'
+    source.write_text('x\n')
+    _, entry = ephemeral.add_dataset(str(source))
+    config['datasets'] = ['sales']
+    try:
+        result = ephemeral.execute_container(config, "print('ran')\n", 'python')
+        assert result['returncode'] == 0
+        assert ephemeral.DATASET_USERS[entry['sha256']] == 1
+        with pytest.raises(RuntimeError): ephemeral.evict_dataset('sales')
+    finally:
+        ephemeral.shutdown_sessions()
+    assert ephemeral.DATASET_USERS[entry['sha256']] == 0
+    ephemeral.evict_dataset('sales')
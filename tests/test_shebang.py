@@ -0,0 +1,42 @@
+import pytest
+
+import ephemeral
+
+
+@pytest.mark.parametrize('line', ['#! unsafe python', '#!python unsafe', '#!/usr/bin/env python3 unsafe'])
+def test_network_flag_is_kept_on_either_side_of_the_language(line):
+    header, code = ephemeral.parse_codeblock(f"{line}\nprint(1)\n")
+    assert header.split()[0] == 'python' and 'unsafe' in header.split()
+    assert code.strip() == 'print(1)'
+    assert ephemeral.resolve_runtime_config(header)['allow_network']
+
+
+def test_interpreter_path_is_not_a_flag():
+    assert ephemeral.parse_codeblock("#!/usr/bin/env python3\nprint(1)\n")[0] == 'python'
+
+
+def test_aliases_resolve_case_insensitively_through_chains():
+    assert ephemeral.canonical_lang('PY') == 'python'
+    assert ephemeral.canonical_lang('sh') == 'bash'
+    assert ephemeral.canonical_lang('nonexistent') is None
+    assert ephemeral.resolve_alias('a', {'a': 'b', 'b': 'c', 'c': {}}) == 'c'
+    assert ephemeral.resolve_alias('a', {'a': 'b', 'b': 'a'}) is None # A cycle resolves to nothing
+
+
+@pytest.mark.parametrize('line, header', [
+    ('#!/bin/bash', 'bash'),              # 'sh' must not match inside 'bash'
+    ('#!/bin/sh -e', 'sh -e'),
+    ('#! python:3.11', 'python:3.11'),    # An explicit version tag is kept
+    ('#!/usr/bin/env node --trace', 'node --trace'),
+])
+def test_language_is_found_as_a_whole_token(line, header):
+    assert ephemeral.parse_codeblock(f"{line}\necho\n")[0] == header
+
+
+def test_unknown_shebang_is_not_a_header():
+    assert ephemeral.parse_codeblock("#!/usr/bin/perlish\nprint 1\n") == (None, None)
+
+
+def test_nested_fences_are_unwrapped():
+    content = "````\n```python\nprint(1)\n```\n````\n\n```ruby\n#! ruby\nputs 2\n```\n"
+    assert ephemeral.parse_codeblocks(content) == [('python', 'print(1)\n'), ('ruby', 'puts 2\n')]
@@ -0,0 +1,43 @@
+import json
+import os
+
+import ephemeral
+
+
+def test_phases_outside_a_run_are_not_written():
+    with ephemeral.trace_phase('podman_check'): pass
+    assert not os.path.exists(ephemeral.TRACE_FILE)
+
+
+def test_run_phases_are_written_and_summed():
+    ephemeral.begin_trace('python')
+    with ephemeral.trace_phase('run_cold'):
+        with ephemeral.trace_phase('image_check'): pass # Nested: logged, left out of the breakdown
+    ephemeral.end_trace()
+    with open(ephemeral.TRACE_FILE, 'r', encoding='utf-8') as f:
+        events = [json.loads(line) for line in f]
+    assert [(e['event'], e.get('phase')) for e in events] == [('phase', 'image_check'), ('phase', 'run_cold'), ('run', None)]
+    assert list(events[-1]['phases']) == ['run_cold']
+
+
+def test_percentiles_over_recent_runs(monkeypatch):
+    runs = [{'id': n, 'label': 'python', 'status': 'ok' if n % 10 else 'error', 'seconds': n / 10,
+             'phases': {'execute': n / 100, **({'pull': 5.0} if n == 100 else {})}} for n in range(1, 101)]
+    monkeypatch.setattr(ephemeral, 'RECENT_RUNS', ephemeral.deque(runs))
+    stats = ephemeral.phase_percentiles()
+    assert list(stats) == ['total', 'execute', 'pull']
+    assert stats['total'] == (5.1, 9.1, 10.0)
+    assert stats['execute'] == (0.51, 0.91, 1.0)
+    assert stats['pull'] == (5.0, 5.0, 5.0) # Only the runs that had the phase count
+    assert ephemeral.percentile([], 0.5) == 0.0
+    text = ephemeral.metrics_text()
+    assert 'ephemeral_phase_seconds{phase="total",quantile="0.9"} 9.1000' in text
+    assert 'ephemeral_recent_runs{status="error"} 10' in text and 'ephemeral_recent_runs{status="ok"} 90' in text
+
+
+def test_trace_file_is_rotated_above_its_size_limit(monkeypatch):
+    monkeypatch.setattr(ephemeral, 'TRACE_MAX_MB', 0.001)
+    for n in range(100): ephemeral.write_trace_event({'event': 'test', 'n': n})
+    assert os.path.getsize(ephemeral.TRACE_FILE) <= 1100
+    with open(ephemeral.TRACE_FILE + '.1', 'r', encoding='utf-8') as f:
+        assert json.loads(f.readline())['n'] > 0 # The oldest lines were rotated out